@@ -1,13 +1,104 @@
 # pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring,logging-fstring-interpolation
+import re
+from functools import partial
+from os.path import dirname, join
+from time import monotonic
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
 from ovos_bus_client import Message
+from ovos_utils.dialog import join_list
 from ovos_workshop.decorators import intent_handler
 from ovos_workshop.skills import OVOSSkill
 
+try:
+    from ovos_number_parser import extract_number
+except ImportError:  # older ovos-workshop releases ship lingua_franca instead
+    from lingua_franca.parse import extract_number
+
+from neon_homeassistant_skill.cache import EntityStateCache, normalize_entity_name
+from neon_homeassistant_skill.coalesce import Adjustment, AdjustmentCoalescer
+from neon_homeassistant_skill.colors import ColorNames, color_key, reported_rgb
+from neon_homeassistant_skill.correlation import (
+    DEFAULT_REQUEST_TIMEOUT,
+    PHAL_NAMESPACE,
+    REQUEST_ID_KEY,
+    REQUEST_TIMEOUTS,
+    Batch,
+    Batches,
+    PendingRequest,
+    PendingRequests,
+)
+from neon_homeassistant_skill.entities import LEADING_ARTICLE, EntityIndex, EntityRecord, clean_entity_name
+from neon_homeassistant_skill.lang import normalize_lang
+from neon_homeassistant_skill.metrics import Metrics
+from neon_homeassistant_skill.offline import COMMAND_ASPECTS, OfflineQueue, QueuedCommand
+from neon_homeassistant_skill.recorder import INTENT, REQUEST, RESPONSE, TrafficRecorder
+from neon_homeassistant_skill.routines import (
+    Routine,
+    RoutineRun,
+    RoutineRuns,
+    RoutineStep,
+    compile_routines,
+)
+from neon_homeassistant_skill.routing import ResponseRouter
+from neon_homeassistant_skill.snapshot import EntitySnapshot
+from neon_homeassistant_skill.throttle import CommandThrottle
+
+# "the lamp, the fan and the TV" -> ["lamp", "fan", "TV"]
+ENTITY_LIST_SEPARATOR = re.compile(r"\s*,\s*(?:and\s+)?|\s+and\s+")
+# Device types an area-wide "turn on/off everything" applies to
+TOGGLEABLE_TYPES = ("light", "switch", "fan", "media_player", "input_boolean", "humidifier", "climate")
+# Multiples of `brightness_step` for "a little" and "a lot" brighter or dimmer
+SMALL_STEP_FACTOR = 0.5
+LARGE_STEP_FACTOR = 3
+# Seconds to wait after asking the PHAL plugin to rebuild its device list before fetching it
+DEVICE_LIST_REFRESH_DELAY = 5
+# Seconds to collect state change signals that don't say what changed before reloading the device list once
+STALE_DEVICE_LIST_DELAY = 5
+# Vocab for each kind of device a question can be about, and the entity kinds it covers; None means all
+DEVICE_KINDS = {
+    "lights": ("light",),
+    "switches": ("switch", "input_boolean"),
+    "fans": ("fan",),
+    "doors": ("door",),
+    "windows": ("window",),
+    "locks": ("lock",),
+    "blinds": ("cover",),
+    "devices": None,
+}
+# Vocab for each spoken state and the Home Assistant states it covers; open/closed sensors report on/off
+STATE_GROUPS = {
+    "unlocked": ("unlocked",),
+    "locked": ("locked",),
+    "open": ("on", "open"),
+    "closed": ("off", "closed"),
+    "on": ("on",),
+    "off": ("off",),
+}
+# Devices named in answer to "which ... are ..." before the rest are only counted
+MAX_LISTED_DEVICES = 10
+
 
 class NeonHomeAssistantSkill(OVOSSkill):
     """Home Assistant skill for Neon OS. Requires the PHAL Home Assistant plugin."""
 
     _intents_enabled = True
+    _disable_intents = False
+    _silent_entities = frozenset()
+    _request_timeouts = REQUEST_TIMEOUTS
+    _entity_aliases = {}
+    _command_threshold = 0.7
+    _routines = {}
+    _resync_interval = 0
+    _devices_stale = False
+    _devices_loaded_at = float("-inf")
+    _stale_refresh_scheduled = False
+    _state_changed_message = ""
+    _snapshot_interval = 0
+    _ha_available = True
+    _consecutive_timeouts = 0
+    _probe_pending = False
+    _recorder = None
     connected_intents = (
         "sensor.intent",
         "turn.on.intent",
@@ -21,54 +112,79 @@ class NeonHomeAssistantSkill(OVOSSkill):
         "lights.set.color.intent",
         "show.area.dashboard.intent",
         "assist.intent",
+        "turn.on.area.intent",
+        "turn.off.area.intent",
+        "count.devices.intent",
+        "list.devices.intent",
+        "run.routine.intent",
     )
 
     def initialize(self):
-        # Register bus handlers
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.assist.message.response",
-            self._handle_assist_error,
-        )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.get.device.response",
-            self.handle_get_device_response,
-        )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.device.turn_on.response",
-            self.handle_turn_on_response,
-        )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.device.turn_off.response",
-            self.handle_turn_off_response,
-        )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.get.light.brightness.response",
-            self.handle_get_light_brightness_response,
-        )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.set.light.brightness.response",
-            self.handle_set_light_brightness_response,
+        self._state_cache = EntityStateCache(max_size=self.cache_size, ttl=self.cache_ttl)
+        self._pending_requests = PendingRequests(on_timeout=self._handle_request_timeout)
+        self._pending_requests.start()
+        self._batches = Batches()
+        self._routine_runs = RoutineRuns()
+        self._adjustments = AdjustmentCoalescer(on_flush=self._apply_adjustment, window=self.coalesce_window)
+        self._entities = EntityIndex(threshold=self.entity_match_threshold)
+        self._metrics = Metrics(sample_rate=self.metrics_sample_rate)
+        self._colors = ColorNames(join(dirname(__file__), "locale"))
+        # Words that name a kind of device, per language, read from the kind vocab on first use
+        self._kind_words: Dict[str, Dict[str, Tuple[str, ...]]] = {}
+        self._throttle = CommandThrottle(
+            send=self._send_now, on_shed=self._handle_shed_request, on_merged=self._handle_merged_request
         )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.increase.light.brightness.response",
-            self.handle_set_light_brightness_response,
+        self._offline_queue = OfflineQueue(
+            path=join(self.file_system.path, "offline_queue.json"),
+            max_size=self.offline_queue_size,
+            ttl=self.offline_queue_ttl,
+            max_attempts=self.offline_replay_attempts,
         )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.decrease.light.brightness.response",
-            self.handle_set_light_brightness_response,
-        )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.get.light.color.response",
-            self.handle_get_light_color_response,
-        )
-        self.bus.on(
-            "ovos.phal.plugin.homeassistant.set.light.color.response",
-            self.handle_set_light_color_response,
+        self._snapshot = EntitySnapshot(join(self.file_system.path, "entities.jsonl"))
+        self.settings_change_callback = self._handle_settings_changed
+        self._router = ResponseRouter(
+            self.bus,
+            {
+                "assist.message.response": self._handle_assist_error,
+                "get.devices.response": self.handle_get_devices_response,
+                "get.device.response": self.handle_get_device_response,
+                "device.turn_on.response": self.handle_turn_on_response,
+                "device.turn_off.response": self.handle_turn_off_response,
+                "get.light.brightness.response": self.handle_get_light_brightness_response,
+                "set.light.brightness.response": self.handle_set_light_brightness_response,
+                "increase.light.brightness.response": self.handle_set_light_brightness_response,
+                "decrease.light.brightness.response": self.handle_set_light_brightness_response,
+                "get.light.color.response": self.handle_get_light_color_response,
+                "set.light.color.response": self.handle_set_light_color_response,
+                "call.supported.function.response": self.handle_call_supported_function_response,
+                "device.state.updated": self.handle_device_state_updated,
+                "ready": self.handle_phal_ready,
+            },
         )
+        self._router.attach()
+        self.bus.on(f"{self.skill_id}.metrics", self.handle_metrics_query)
+        self._load_settings()
+        self._load_snapshot()
+        self._request_device_list()
+        self._schedule_resync()
+        self._schedule_snapshot()
+        self._schedule_metrics_log()
         if self.disable_intents:
             self.log.info("User has indicated they do not want to use Home Assistant intents. Disabling.")
             self.disable_ha_intents()
 
+    def shutdown(self):
+        self._router.detach()
+        self._subscribe_state_changes("")
+        self._save_snapshot()
+        self._throttle.clear()
+        self._set_recording(False)
+        self._adjustments.flush_all()
+        self._pending_requests.stop()
+        self._pending_requests.clear()
+        self._batches.clear()
+        self._routine_runs.clear()
+
     @property
     def verbose(self):
         return self.settings.get("verbose", False)
@@ -79,23 +195,223 @@ class NeonHomeAssistantSkill(OVOSSkill):
 
     @property
     def silent_entities(self):
-        return set(self.settings.get("silent_entities", []))
+        return self._silent_entities
 
     @silent_entities.setter
     def silent_entities(self, value):
         self.settings["silent_entities"] = value
+        self._silent_entities = frozenset(value)
+
+    @property
+    def optimistic_responses(self):
+        """Speak the expected result of a command right away and only correct it if Home Assistant disagrees."""
+        return self.settings.get("optimistic_responses", False)
+
+    @property
+    def record_traffic(self):
+        """Append PHAL plugin requests, responses and the intents behind them to a file for later replay."""
+        return self.settings.get("record_traffic", False)
+
+    @property
+    def cache_ttl(self):
+        """Seconds a device state reported by Home Assistant may be reused to answer status queries."""
+        return self.settings.get("cache_ttl", 10)
+
+    @property
+    def cache_size(self):
+        """Maximum number of devices whose state is kept locally."""
+        return self.settings.get("cache_size", 1000)
+
+    @property
+    def coalesce_window(self):
+        """Seconds to collect brightness and color adjustments for a light before sending the net change."""
+        return self.settings.get("coalesce_window", 0.5)
+
+    @property
+    def brightness_step(self):
+        """Percent to change brightness by for "brighter" or "dimmer". Should match the PHAL plugin's increment."""
+        return self.settings.get("brightness_step", 10)
+
+    @property
+    def entity_match_threshold(self):
+        """Minimum similarity (0-1) for a spoken device name to match a device in the local index."""
+        return self.settings.get("entity_match_threshold", 0.5)
+
+    @property
+    def command_match_threshold(self):
+        """Minimum similarity (0-1) for a spoken device name to match the device a command is sent to."""
+        return self.settings.get("command_match_threshold", 0.7)
+
+    @property
+    def entity_aliases(self):
+        """Extra spoken names for devices, mapped to an entity ID or friendly name."""
+        return self.settings.get("entity_aliases", {})
+
+    @property
+    def routines(self):
+        """Named lists of commands run together by "run <name>", each a dict with an action, device and value."""
+        return self.settings.get("routines", {})
+
+    @property
+    def resync_interval(self):
+        """Seconds between full reloads of the device list. State changes are applied as they happen in between."""
+        return self.settings.get("resync_interval", 3600)
+
+    @property
+    def stale_refresh_interval(self):
+        """Least seconds between device list reloads prompted by state change signals that don't say what changed."""
+        return self.settings.get("stale_refresh_interval", 60)
+
+    @property
+    def index_max_age(self):
+        """Seconds a stale device index is still used to answer questions before the device list is fetched first."""
+        return self.settings.get("index_max_age", 300)
+
+    @property
+    def state_changed_message(self):
+        """Bus message relaying Home Assistant `state_changed` events, applied one device at a time. Empty for none."""
+        return self.settings.get("state_changed_message", "")
+
+    @property
+    def snapshot_interval(self):
+        """Seconds between saves of the device index for the next startup, if it changed. 0 saves only at shutdown."""
+        return self.settings.get("snapshot_interval", 900)
+
+    @property
+    def metrics_sample_rate(self):
+        """Fraction (0-1) of intents to trace through each stage. 0 only counts intents."""
+        return self.settings.get("metrics_sample_rate", 0.0)
+
+    @property
+    def metrics_log_interval(self):
+        """Seconds between stats log lines while tracing is on. 0 turns the log off."""
+        return self.settings.get("metrics_log_interval", 300)
+
+    @property
+    def offline_queue_size(self):
+        """Most commands to hold while Home Assistant is unreachable. 0 turns the queue off."""
+        return self.settings.get("offline_queue_size", 100)
+
+    @property
+    def offline_queue_ttl(self):
+        """Seconds a queued command stays worth replaying."""
+        return self.settings.get("offline_queue_ttl", 3600)
+
+    @property
+    def offline_replay_attempts(self):
+        """Times a queued command is replayed without an answer before it is dropped."""
+        return self.settings.get("offline_replay_attempts", 3)
+
+    @property
+    def offline_timeout_limit(self):
+        """Unanswered requests in a row after which Home Assistant is taken to be unreachable."""
+        return self.settings.get("offline_timeout_limit", 3)
+
+    @property
+    def offline_probe_interval(self):
+        """Seconds between checks for Home Assistant coming back while it is unreachable."""
+        return self.settings.get("offline_probe_interval", 30)
+
+    @property
+    def rate_limit(self):
+        """Requests per second sent to the PHAL plugin, averaged over a short burst. 0 for no limit."""
+        return self.settings.get("rate_limit", 10)
+
+    @property
+    def entity_rate_limit(self):
+        """Commands per second sent to any one device, averaged over a short burst. 0 for no limit."""
+        return self.settings.get("entity_rate_limit", 2)
+
+    @property
+    def rate_limit_backlog(self):
+        """Requests that may wait for the rate limits before further ones are dropped."""
+        return self.settings.get("rate_limit_backlog", 20)
+
+    @property
+    def request_timeouts(self):
+        """Seconds to wait for each PHAL request type, with any overrides from settings."""
+        return self._request_timeouts
 
     @property
     def disable_intents(self):
-        setting = self.settings.get("disable_intents", False)
-        self._handle_connection_state(setting)
-        return setting
+        """Whether Home Assistant intents are disabled, as of the last settings change."""
+        return self._disable_intents
 
     @disable_intents.setter
     def disable_intents(self, value):
         self.settings["disable_intents"] = value
+        self._disable_intents = value
         self._handle_connection_state(value)
 
+    def _load_settings(self):
+        """Precompute values derived from settings, so reading them in handlers is cheap and side-effect free."""
+        self._silent_entities = frozenset(self.settings.get("silent_entities", []))
+        self._request_timeouts = {**REQUEST_TIMEOUTS, **self.settings.get("request_timeouts", {})}
+        self._disable_intents = self.settings.get("disable_intents", False)
+        self._state_cache.configure(max_size=self.cache_size, ttl=self.cache_ttl)
+        self._entity_aliases = dict(self.entity_aliases)
+        self._routines = compile_routines(self.routines)
+        self._resync_interval = self.resync_interval
+        self._snapshot_interval = self.snapshot_interval
+        self._adjustments.window = self.coalesce_window
+        self._entities.threshold = self.entity_match_threshold
+        self._command_threshold = max(self.command_match_threshold, self.entity_match_threshold)
+        self._metrics.sample_rate = self.metrics_sample_rate
+        self._offline_queue.max_size = self.offline_queue_size
+        self._offline_queue.ttl = self.offline_queue_ttl
+        self._offline_queue.max_attempts = self.offline_replay_attempts
+        self._throttle.configure(self.rate_limit, self.entity_rate_limit, self.rate_limit_backlog)
+        self._set_recording(self.record_traffic)
+        self._subscribe_state_changes(self.state_changed_message)
+
+    def _subscribe_state_changes(self, msg_type: str):
+        """Listen for relayed Home Assistant `state_changed` events on `msg_type` instead of the current one."""
+        if msg_type == self._state_changed_message:
+            return
+        if self._state_changed_message:
+            self.bus.remove(self._state_changed_message, self.handle_device_state_updated)
+        if msg_type:
+            self.bus.on(msg_type, self.handle_device_state_updated)
+        self._state_changed_message = msg_type
+
+    def _handle_settings_changed(self):
+        """Refresh precomputed settings and toggle intents if `disable_intents` changed."""
+        disable_intents, aliases, resync_interval = self._disable_intents, self._entity_aliases, self._resync_interval
+        snapshot_interval = self._snapshot_interval
+        metrics_log = (self._metrics.sample_rate, self.metrics_log_interval)
+        self._load_settings()
+        if self._disable_intents != disable_intents:
+            self._handle_connection_state(self._disable_intents)
+        if self._entity_aliases != aliases:
+            self._request_device_list()
+        if self._resync_interval != resync_interval:
+            self._schedule_resync()
+        if self._snapshot_interval != snapshot_interval:
+            self._schedule_snapshot()
+        if (self._metrics.sample_rate, self.metrics_log_interval) != metrics_log:
+            self._schedule_metrics_log()
+
+    def _set_recording(self, enabled: bool):
+        """Start or stop recording PHAL plugin traffic to `traffic.jsonl` in the skill's file system."""
+        if enabled and self._recorder is None:
+            self._recorder = TrafficRecorder(join(self.file_system.path, "traffic.jsonl"))
+            self._router.observer = partial(self._record, RESPONSE)
+            self.log.info(f"Recording Home Assistant traffic to {self._recorder.path}")
+        elif not enabled and self._recorder is not None:
+            self._router.observer = None
+            self._recorder.close()
+            self._recorder = None
+
+    def _record(self, direction: str, message: Message):
+        recorder = self._recorder
+        if recorder is not None:
+            recorder.record(direction, message)
+
+    def _emit_phal(self, message: Message):
+        """Send `message` to the PHAL plugin."""
+        self._record(REQUEST, message)
+        self.bus.emit(message)
+
     def _handle_connection_state(self, disable_intents: bool):
         if self._intents_enabled and disable_intents is True:
             self.log.info(
@@ -106,47 +422,56 @@ class NeonHomeAssistantSkill(OVOSSkill):
             self.log.info("Enabling Home Assistant intents by user request. To disable, set disable_intents to True.")
             self.enable_ha_intents()
 
-    def enable_ha_intents(self):
-        for intent in self.connected_intents:
-            success = self.enable_intent(intent)
-            if not success:
-                self.log.error(f"Error registering intent: {intent}")
-            else:
-                self.log.info(f"Successfully registered intent: {intent}")
-        self._intents_enabled = True
-
-    def disable_ha_intents(self):
-        for intent in self.connected_intents:
-            self.intent_service.remove_intent(intent)
-            try:
-                assert self.intent_service.intent_is_detached(intent) is True
-            except AssertionError:
-                self.log.error(f"Error disabling intent: {intent}")
-        self._intents_enabled = False
+    def enable_ha_intents(self) -> bool:
+        return self._set_ha_intents_enabled(True)
+
+    def disable_ha_intents(self) -> bool:
+        return self._set_ha_intents_enabled(False)
+
+    def _set_ha_intents_enabled(self, enabled: bool) -> bool:
+        """Register or detach all connected intents in one pass.
+
+        Only intents not already in the requested state are touched, and the result is checked once
+        for the whole group. Returns True if every connected intent ended up in the requested state.
+        """
+        registered = {name for name, _ in self.intent_service.registered_intents}
+        pending = [intent for intent in self.connected_intents if (intent in registered) is not enabled]
+        if not pending:
+            self._intents_enabled = enabled
+            return True
+        if enabled:
+            failed = [intent for intent in pending if not self.enable_intent(intent)]
+        else:
+            for intent in pending:
+                self.intent_service.remove_intent(intent)
+            detached = {name for name, _ in self.intent_service.detached_intents}
+            failed = [intent for intent in pending if intent not in detached]
+        action = "register" if enabled else "disable"
+        if failed:
+            self.log.error(f"Error trying to {action} intents: {', '.join(failed)}")
+        else:
+            self.log.info(f"Successfully {action}d {len(pending)} Home Assistant intents")
+        self._intents_enabled = enabled
+        return not failed
 
     # Handlers
 
     @intent_handler("get.all.devices.intent")  # pragma: no cover
     def handle_rebuild_device_list(self, message: Message):
-        self.bus.emit(
-            message.forward(
-                "ovos.phal.plugin.homeassistant.rebuild.device.list",
-                None,
-            )
-        )
-        self.speak_dialog("acknowledge")
+        self._emit_phal(message.forward(f"{PHAL_NAMESPACE}rebuild.device.list", None))
+        # The plugin doesn't answer a rebuild, so fetch the new list once it has had time to finish
+        self.schedule_event(self._request_device_list, DEVICE_LIST_REFRESH_DELAY, name="RefreshDeviceList")
+        self._speak_for(message, "acknowledge")
 
     @intent_handler("enable.intent")  # pragma: no cover
     def handle_enable_intent(self, message: Message):
-        self.settings["disable_intents"] = False
-        self.speak_dialog("enable")
-        self.enable_ha_intents()
+        self._speak_for(message, "enable")
+        self.disable_intents = False
 
     @intent_handler("disable.intent")  # pragma: no cover
     def handle_disable_intent(self, message: Message):
-        self.settings["disable_intents"] = True
-        self.speak_dialog("disable")
-        self.disable_ha_intents()
+        self._speak_for(message, "disable")
+        self.disable_intents = True
 
     @intent_handler("sensor.intent")  # pragma: no cover
     def get_device_intent(self, message: Message):
@@ -154,89 +479,180 @@ class NeonHomeAssistantSkill(OVOSSkill):
         self.log.info(message.data)
         device = message.data.get("entity", "")
         if device:
-            self.bus.emit(message.forward("ovos.phal.plugin.homeassistant.get.device", {"device": device}))
+            data = self._lookup_device(message, device)
+            if data is None:
+                return self._speak_for(message, "device.not.found", data={"device": device})
+            device = data["device"]
+            cached = self._state_cache.get(device, "state", "type")
+            if cached:
+                self.log.debug(f"Answering status of {device} from cache")
+                return self._speak_for(
+                    message,
+                    "device.status",
+                    data={"device": cached.get("name", device), "type": cached["type"], "state": cached["state"]},
+                )
+            self._send_request(message, "get.device", data)
             if self.verbose:
-                self.speak_dialog("acknowledge")
+                self._speak_for(message, "acknowledge")
             else:
                 self.log.info(f"Trying to get device status for {device}")
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(message, "no.parsed.device")
 
     def handle_get_device_response(self, message: Message):
         self.log.info(message.data)
-        device = message.data
-        if device:
-            self.speak_dialog(
+        # Only the fields the skill speaks are kept, not the plugin's full copy of the Home Assistant state
+        record = EntityRecord.from_device(message.data) if message.data else None
+        if record:
+            self._state_cache.update(
+                record.name,
+                name=record.name,
+                type=record.type,
+                state=record.state,
+                brightness=(
+                    self._get_percentage_brightness_from_ha_value(record.brightness)
+                    if record.brightness is not None
+                    else None
+                ),
+            )
+        origin = self._resolve_request(message)
+        if origin is None:
+            return
+        if record:
+            self._speak_for(
+                origin,
                 "device.status",
-                data={
-                    "device": device.get("attributes", {}).get("friendly_name", device.get("name")),
-                    "type": device.get("type"),
-                    "state": device.get("state"),
-                },
+                data={"device": record.name, "type": record.type, "state": record.state},
             )
         else:
-            self.speak_dialog("device.not.found")
+            self._speak_for(origin, "device.not.found", data={"device": origin.data.get("entity", "")})
 
     @intent_handler("turn.on.intent")  # pragma: no cover
     def handle_turn_on_intent(self, message: Message) -> None:
         """Handle turn on intent."""
         self.log.info(message.data)
-        device = message.data.get("entity", "")
-        if device:
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.device.turn_on",
-                    {"device": device},
-                )
-            )
-            if self.verbose:
-                self.speak_dialog("acknowledge")
-            else:
-                self.log.info(f"Trying to turn on device {device}")
-        else:
-            self.speak_dialog("no.parsed.device")
+        self._send_turn_command(message, "device.turn_on")
 
     def handle_turn_on_response(self, message: Message) -> None:
         """Handle turn on intent response."""
         self.log.debug(f"Handling turn on response to {message.data}")
         device = message.data.get("device", "")
+        if device:
+            self._state_cache.update(device, state="on")
+            self._set_indexed_state(device, "on")
+        origin = self._resolve_request(message)
+        if origin is None:
+            return
         if device and device not in self.silent_entities:
-            self.speak_dialog("device.turned.on", data={"device": device})
+            self._speak_for(origin, "device.turned.on", data={"device": device})
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(origin, "no.parsed.device")
 
     @intent_handler("turn.off.intent")  # pragma: no cover
     @intent_handler("stop.intent")  # pragma: no cover
     def handle_turn_off_intent(self, message: Message) -> None:
         """Handle turn off intent."""
         self.log.info(message.data)
-        device = message.data.get("entity", "")
-        if device:
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.device.turn_off",
-                    {"device": device},
-                )
-            )
-            if self.verbose:
-                self.speak_dialog("acknowledge")
-            else:
-                self.log.info(f"Trying to turn off device {device}")
-        else:
-            self.speak_dialog("no.parsed.device")
+        self._send_turn_command(message, "device.turn_off")
 
     def handle_turn_off_response(self, message: Message) -> None:
         self.log.debug(f"Handling turn off response to {message.data}")
         device = message.data.get("device", "")
+        if device:
+            self._state_cache.update(device, state="off")
+            self._set_indexed_state(device, "off")
+        origin = self._resolve_request(message)
+        if origin is None:
+            return
         if device and device not in self.silent_entities:
-            self.speak_dialog("device.turned.off", data={"device": device})
+            self._speak_for(origin, "device.turned.off", data={"device": device})
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(origin, "no.parsed.device")
+
+    @intent_handler("turn.on.area.intent")  # pragma: no cover
+    def handle_turn_on_area_intent(self, message: Message) -> None:
+        """Handle turning on every device, or every light, in an area."""
+        self._send_area_command(message, "device.turn_on")
+
+    @intent_handler("turn.off.area.intent")  # pragma: no cover
+    def handle_turn_off_area_intent(self, message: Message) -> None:
+        """Handle turning off every device, or every light, in an area."""
+        self._send_area_command(message, "device.turn_off")
+
+    @intent_handler("count.devices.intent")  # pragma: no cover
+    def handle_count_devices_intent(self, message: Message) -> None:
+        """Handle questions like "how many windows are open", answered from the entity index."""
+        self._answer_aggregate(message, listing=False)
+
+    @intent_handler("list.devices.intent")  # pragma: no cover
+    def handle_list_devices_intent(self, message: Message) -> None:
+        """Handle questions like "which lights are on in the kitchen", answered from the entity index."""
+        self._answer_aggregate(message, listing=True)
+
+    @intent_handler("run.routine.intent")  # pragma: no cover
+    def handle_run_routine_intent(self, message: Message) -> None:
+        """Handle running a routine from settings, such as "movie time"."""
+        name = message.data.get("routine", "")
+        routine = self._routines.get(normalize_entity_name(LEADING_ARTICLE.sub("", name)))
+        if routine is None:
+            return self._speak_for(message, "routine.not.found", data={"routine": name})
+        self._run_routine(message, routine)
+
+    def handle_get_devices_response(self, message: Message) -> None:
+        """Refresh the entity index from a device list, and finish the question or area command that requested it."""
+        devices = message.data.get("devices")
+        if isinstance(devices, list):
+            self._entities.rebuild(devices, aliases=self._entity_aliases)
+            self._devices_stale, self._devices_loaded_at = False, monotonic()
+            self.log.debug(f"Indexed {len(self._entities)} Home Assistant devices")
+            self._set_available(True)
+        request = self._pending_requests.resolve(message.context.get(REQUEST_ID_KEY))
+        if request is not None and "aggregate" in request.extra:
+            return self._answer_aggregate(request.message, request.extra["aggregate"], fetch=False)
+        if request is None or "bulk" not in request.extra:
+            return
+        self._send_area_bulk(
+            request.message, request.extra["bulk"], request.extra["area"], request.extra.get("domain")
+        )
+
+    def handle_device_state_updated(self, message: Message) -> None:
+        """Apply a device state change pushed by the PHAL plugin to the entity index and state cache.
+
+        Changes that carry the entity's new state, either as a Home Assistant `state_changed` event or
+        already unwrapped, are applied as a delta. The plugin's own signal carries no data, so then the
+        index is marked stale until the device list is reloaded. Cached states are kept, as they expire
+        after `cache_ttl` seconds anyway, unless the signal names the entity that changed.
+        """
+        data = message.data or {}
+        event = (data.get("event") or {}).get("data") or data
+        entity_id = event.get("entity_id") or data.get("device_id")
+        if entity_id and "new_state" in event:
+            return self._apply_state_change(entity_id, event["new_state"])
+        known = self._entities.by_id(entity_id) if entity_id else None
+        if known:
+            self._state_cache.invalidate(known.name)
+        self._mark_devices_stale()
+
+    def _mark_devices_stale(self):
+        """Reload the device list once for a burst of changes the index couldn't apply.
+
+        The reload waits at least `stale_refresh_interval` seconds after the last one, so a busy install
+        sending signals all the time reloads its device list at that pace rather than after every burst.
+        """
+        self._devices_stale = True
+        if not self._stale_refresh_scheduled:
+            self._stale_refresh_scheduled = True
+            delay = max(STALE_DEVICE_LIST_DELAY, self._devices_loaded_at + self.stale_refresh_interval - monotonic())
+            self.schedule_event(self._refresh_stale_devices, delay, name="RefreshStaleDevices")
+
+    def _refresh_stale_devices(self, _: Optional[Message] = None):
+        self._stale_refresh_scheduled = False
+        self._request_device_list()
 
     @intent_handler("open.dashboard.intent")  # pragma: no cover
     def handle_open_dashboard_intent(self, message: Message):
         self.bus.emit(message.forward("ovos-PHAL-plugin-homeassistant.home", None))
-        self.speak_dialog("ha.dashboard.opened")
+        self._speak_for(message, "ha.dashboard.opened")
 
     @intent_handler("close.dashboard.intent")  # pragma: no cover
     def handle_close_dashboard_intent(self, message: Message):
@@ -246,28 +662,41 @@ class NeonHomeAssistantSkill(OVOSSkill):
                 None,
             )
         )
-        self.speak_dialog("ha.dashboard.closed")
+        self._speak_for(message, "ha.dashboard.closed")
 
     @intent_handler("lights.get.brightness.intent")  # pragma: no cover
     def handle_get_brightness_intent(self, message: Message):
         self.log.info(message.data)
         device = message.data.get("entity", "")
         if device:
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.get.light.brightness",
-                    {"device": device},
+            data = self._lookup_device(message, device)
+            if data is None:
+                return self._speak_for(message, "device.not.found", data={"device": device})
+            device = data["device"]
+            cached = self._state_cache.get(device, "brightness")
+            if cached:
+                self.log.debug(f"Answering brightness of {device} from cache")
+                return self._speak_for(
+                    message,
+                    "lights.current.brightness",
+                    data={"brightness": cached["brightness"], "device": device},
                 )
-            )
+            self._send_request(message, "get.light.brightness", data)
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(message, "no.parsed.device")
 
     def handle_get_light_brightness_response(self, message: Message):
         brightness = message.data.get("brightness")
         device = message.data.get("device")
         self.log.info(f"Device {device} brightness is {brightness}")
         if brightness:
-            self.speak_dialog(
+            self._state_cache.update(device, brightness=brightness)
+        origin = self._resolve_request(message)
+        if origin is None:
+            return
+        if brightness:
+            self._speak_for(
+                origin,
                 "lights.current.brightness",
                 data={
                     "brightness": brightness,
@@ -275,9 +704,9 @@ class NeonHomeAssistantSkill(OVOSSkill):
                 },
             )
         if message.data.get("response"):
-            self.speak_dialog("device.not.found", data={"device": device})
+            self._speak_for(origin, "device.not.found", data={"device": device})
         else:
-            self.speak_dialog("lights.status.not.available", data={"device": device})
+            self._speak_for(origin, "lights.status.not.available", data={"device": device})
 
     @intent_handler("lights.set.brightness.intent")  # pragma: no cover
     def handle_set_brightness_intent(self, message: Message):
@@ -285,32 +714,41 @@ class NeonHomeAssistantSkill(OVOSSkill):
         device = message.data.get("entity")
         brightness = message.data.get("brightness")
         if device and brightness:
-            call_data = {
-                "device": device,
-                "function_name": "turn_on",
-                "brightness": self._get_ha_value_from_percentage_brightness(brightness),
-            }
-            self.log.info(call_data)
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.set.light.brightness",
-                    call_data,
+            data = self._lookup_device(message, device, command=True)
+            if data is None:
+                return self._speak_for(message, "device.not.found", data={"device": device})
+            device = data["device"]
+            announced = {}
+            if self._should_announce(data):
+                announced["brightness"] = int(brightness)
+                self._speak_for(
+                    message, "lights.current.brightness", data={"brightness": int(brightness), "device": device}
                 )
+            self._adjustments.add(
+                device, message, device_id=data.get("device_id"), brightness=int(brightness), announced=announced
             )
+            if announced:
+                return
             if self.verbose:
-                self.speak_dialog("acknowledge")
+                self._speak_for(message, "acknowledge")
             else:
                 self.log.info(f"Trying to set brightness for {device}")
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(message, "no.parsed.device")
 
     def handle_set_light_brightness_response(self, message: Message):
         """Handle set light brightness response. Works for increasing/decreasing or setting explicitly."""
         brightness = message.data.get("brightness")
         device = message.data.get("device")
         self.log.info(f"Device {device} brightness is now {brightness}")
+        if brightness and device:
+            self._state_cache.update(device, brightness=brightness, state="on")
+        origin = self._resolve_request(message)
+        if origin is None:
+            return
         if brightness and device not in self.silent_entities:
-            return self.speak_dialog(
+            return self._speak_for(
+                origin,
                 "lights.current.brightness",
                 data={
                     "brightness": brightness,
@@ -320,49 +758,43 @@ class NeonHomeAssistantSkill(OVOSSkill):
         if device in self.silent_entities:
             return
         if message.data.get("response"):
-            return self.speak_dialog("device.not.found", data={"device": device})
+            return self._speak_for(origin, "device.not.found", data={"device": device})
         else:
-            return self.speak_dialog("lights.status.not.available", data={"device": device})
+            return self._speak_for(origin, "lights.status.not.available", data={"device": device})
 
     @intent_handler("lights.increase.brightness.intent")  # pragma: no cover
     def handle_increase_brightness_intent(self, message: Message):
         self.log.info(message.data)
         device = message.data.get("entity")
         if device:
-            call_data = {"device": device}
-            self.log.info(call_data)
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.increase.light.brightness",
-                    call_data,
-                )
-            )
+            data = self._lookup_device(message, device, command=True)
+            if data is None:
+                return self._speak_for(message, "device.not.found", data={"device": device})
+            device = data["device"]
+            self._adjustments.add(device, message, device_id=data.get("device_id"), step=self._parse_step(message))
             if self.verbose:
-                self.speak_dialog("acknowledge")
+                self._speak_for(message, "acknowledge")
             else:
                 self.log.info(f"Trying to increase brightness for {device}")
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(message, "no.parsed.device")
 
     @intent_handler("lights.decrease.brightness.intent")  # pragma: no cover
     def handle_decrease_brightness_intent(self, message: Message):
         self.log.info(message.data)
         device = message.data.get("entity")
         if device:
-            call_data = {"device": device}
-            self.log.info(call_data)
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.decrease.light.brightness",
-                    call_data,
-                )
-            )
+            data = self._lookup_device(message, device, command=True)
+            if data is None:
+                return self._speak_for(message, "device.not.found", data={"device": device})
+            device = data["device"]
+            self._adjustments.add(device, message, device_id=data.get("device_id"), step=-self._parse_step(message))
             if self.verbose:
-                self.speak_dialog("acknowledge")
+                self._speak_for(message, "acknowledge")
             else:
                 self.log.info(f"Trying to decrease brightness for {device}")
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(message, "no.parsed.device")
 
     # Light color
     @intent_handler("lights.get.color.intent")  # pragma: no cover
@@ -370,21 +802,29 @@ class NeonHomeAssistantSkill(OVOSSkill):
         self.log.info(message.data)
         device = message.data.get("entity")
         if device:
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.get.light.color",
-                    {"device": device},
-                )
-            )
+            data = self._lookup_device(message, device)
+            if data is None:
+                return self._speak_for(message, "device.not.found", data={"device": device})
+            device = data["device"]
+            cached = self._state_cache.get(device, "color")
+            if cached:
+                self.log.debug(f"Answering color of {device} from cache")
+                color = self._colors.describe(self._message_lang(message), cached)
+                return self._speak_for(message, "lights.current.color", data={"color": color, "device": device})
+            self._send_request(message, "get.light.color", data)
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(message, "no.parsed.device")
 
     def handle_get_light_color_response(self, message: Message):
-        color = message.data.get("color")
         device = message.data.get("device")
+        color = self._cache_color(device, message)
         self.log.info(f"Device {device} color is {color}")
+        origin = self._resolve_request(message)
+        if origin is None:
+            return
         if color:
-            return self.speak_dialog(
+            return self._speak_for(
+                origin,
                 "lights.current.color",
                 data={
                     "color": color,
@@ -392,9 +832,9 @@ class NeonHomeAssistantSkill(OVOSSkill):
                 },
             )
         if message.data.get("response"):
-            return self.speak_dialog("device.not.found", data={"device": device})
+            return self._speak_for(origin, "device.not.found", data={"device": device})
         else:
-            return self.speak_dialog("lights.status.not.available", data={"device": device})
+            return self._speak_for(origin, "lights.status.not.available", data={"device": device})
 
     @intent_handler("lights.set.color.intent")  # pragma: no cover
     def handle_set_color_intent(self, message: Message):
@@ -402,31 +842,38 @@ class NeonHomeAssistantSkill(OVOSSkill):
         device = message.data.get("entity")
         color = message.data.get("color")
         if device and color:
-            call_data = {
-                "device": device,
-                "color": color,
-            }
-            self.log.info(call_data)
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.set.light.color",
-                    call_data,
-                )
-            )
+            palette = self._colors.palette(self._message_lang(message))
+            if palette is not None and color not in palette:
+                return self._speak_for(message, "color.not.found", data={"color": color})
+            data = self._lookup_device(message, device, command=True)
+            if data is None:
+                return self._speak_for(message, "device.not.found", data={"device": device})
+            device = data["device"]
+            announced = {}
+            if self._should_announce(data):
+                announced["color"] = color
+                self._speak_for(message, "lights.current.color", data={"color": color, "device": device})
+            self._adjustments.add(device, message, device_id=data.get("device_id"), color=color, announced=announced)
+            if announced:
+                return
             if self.verbose:
-                self.speak_dialog("acknowledge")
+                self._speak_for(message, "acknowledge")
             else:
                 self.log.info(f"Trying to set color of {device}")
         else:
-            self.speak_dialog("no.parsed.device")
+            self._speak_for(message, "no.parsed.device")
 
     def handle_set_light_color_response(self, message: Message):
         """Handle set light color response."""
-        color = message.data.get("color")
         device = message.data.get("device")
+        color = self._cache_color(device, message, state="on")
         self.log.info(f"Device {device} color is now {color}")
+        origin = self._resolve_request(message)
+        if origin is None:
+            return
         if color and device not in self.silent_entities:
-            return self.speak_dialog(
+            return self._speak_for(
+                origin,
                 "lights.current.color",
                 data={
                     "color": color,
@@ -436,41 +883,56 @@ class NeonHomeAssistantSkill(OVOSSkill):
         if device in self.silent_entities:
             return
         if message.data.get("response"):
-            return self.speak_dialog("device.not.found", data={"device": device})
+            return self._speak_for(origin, "device.not.found", data={"device": device})
         else:
-            return self.speak_dialog("lights.status.not.available", data={"device": device})
+            return self._speak_for(origin, "lights.status.not.available", data={"device": device})
+
+    def handle_call_supported_function_response(self, message: Message):
+        """Handle the response to a net brightness step sent as a Home Assistant service call."""
+        device = message.data.get("device")
+        response = message.data.get("response")
+        brightness = None
+        if isinstance(response, list):
+            # Home Assistant answers service calls with the states they changed
+            for state in response:
+                value = state.get("attributes", {}).get("brightness") if isinstance(state, dict) else None
+                if value is not None:
+                    brightness = self._get_percentage_brightness_from_ha_value(value)
+                    self._state_cache.update(device, brightness=brightness, state="on")
+                    break
+        origin = self._resolve_request(message)
+        if origin is None or device in self.silent_entities:
+            return
+        if brightness is not None:
+            return self._speak_for(
+                origin, "lights.current.brightness", data={"brightness": brightness, "device": device}
+            )
+        if isinstance(response, str):
+            return self._speak_for(origin, "device.not.found", data={"device": device})
+        # The plugin answers None when Home Assistant accepted the call without returning the changed states
+        return self._speak_for(origin, "acknowledge")
 
     @intent_handler("show.area.dashboard.intent")  # pragma: no cover
     def handle_show_area_dashboard_intent(self, message: Message):
         area = message.data.get("area")
         if area:
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.show.area.dashboard",
-                    {"area": area},
-                )
-            )
-            self.speak_dialog("area.dashboard.opened", data={"area": area})
+            self._emit_phal(message.forward(f"{PHAL_NAMESPACE}show.area.dashboard", {"area": area}))
+            self._speak_for(message, "area.dashboard.opened", data={"area": area})
         else:
-            self.speak_dialog("area.not.found")
+            self._speak_for(message, "area.not.found")
 
     @intent_handler("assist.intent")  # pragma: no cover
     def handle_assist_intent(self, message: Message):
         """Handle passthrough to Home Assistant's Assist API."""
         command = message.data.get("command")
         if command:
-            self.bus.emit(
-                message.forward(
-                    "ovos.phal.plugin.homeassistant.assist.intent",
-                    {"command": command},
-                )
-            )
+            self._emit_phal(message.forward(f"{PHAL_NAMESPACE}assist.intent", {"command": command}))
             if self.verbose:
-                self.speak_dialog("assist")
+                self._speak_for(message, "assist")
             else:
                 self.log.info(f"Trying to pass message to Home Assistant's Assist API:\n{command}")
         else:
-            self.speak_dialog("assist.not.understood")
+            self._speak_for(message, "assist.not.understood")
 
     # @intent_handler("vacuum.action.intent")  # TODO: Find an intent that doesn't conflict with OCP  # pragma: no cover
     # def handle_vacuum_action_intent(self, message: Message):
@@ -498,9 +960,717 @@ class NeonHomeAssistantSkill(OVOSSkill):
     def _handle_assist_error(self, _):
         self.speak_dialog("assist.error")
 
+    def _send_request(self, message: Message, request_type: str, data: dict, **extra) -> Optional[PendingRequest]:
+        """Forward a request to the PHAL plugin, tagged so its response can be matched back to it.
+
+        While Home Assistant is unreachable, commands are queued instead and None is returned.
+        """
+        if not self._ha_available and request_type in COMMAND_ASPECTS:
+            self._queue_commands(message, [(request_type, data)])
+            return None
+        request = self._track_request(message, request_type, data, **extra)
+        self._emit_request(request, data)
+        return request
+
+    def _send_bulk(
+        self, message: Message, request_type: str, calls: List[dict], failed: Optional[List[str]] = None
+    ) -> Optional[Batch]:
+        """Send one request per entry in `calls` without waiting between them and report the results together.
+
+        The PHAL plugin has no batch endpoint, so the requests are pipelined on the bus and every one is
+        tracked before the first is sent; replies are collected into a single summary dialog. Devices in
+        `failed` were already rejected locally and are reported as failures.
+        """
+        if not self._ha_available and request_type in COMMAND_ASPECTS and calls:
+            if failed:
+                self.log.info(f"Not queueing commands for unknown devices {failed}")
+            self._queue_commands(message, [(request_type, data) for data in calls])
+            return None
+        return self._start_batch(message, request_type, [(request_type, data) for data in calls], failed=failed)
+
+    def _start_batch(
+        self,
+        message: Message,
+        batch_type: str,
+        calls: List[Tuple[str, dict]],
+        failed: Optional[List[str]] = None,
+        replayed: Optional[List[QueuedCommand]] = None,
+    ) -> Batch:
+        """Track and send `calls`, as (request type, data) pairs, as one batch reported under `batch_type`.
+
+        `replayed` holds the queued command each call replays, so an unanswered one is queued again as it was.
+        """
+        batch_id = Batches.new_id()
+        requests = [
+            self._track_request(
+                message, request_type, data, batch=batch_id, replayed=replayed[index] if replayed else None
+            )
+            for index, (request_type, data) in enumerate(calls)
+        ]
+        batch = self._batches.start(batch_id, batch_type, message, requests, failed=failed)
+        if batch.complete:
+            self._report_batch(batch)
+        for request in requests:
+            self._emit_request(request, request.data)
+        return batch
+
+    def _queue_commands(self, message: Message, commands: List[Tuple[str, dict]], request_id: Optional[str] = None):
+        """Hold commands until Home Assistant is reachable again, and tell the user they will be sent later."""
+        queued = [self._offline_queue.add(request_type, data, message, request_id) for request_type, data in commands]
+        devices = [command.device for command in queued if command is not None]
+        if not devices:
+            return self._speak_for(message, "request.timeout", data={"device": commands[0][1].get("device", "")})
+        self.log.info(f"Home Assistant did not answer, queued {len(devices)} commands")
+        devices = join_list(devices, "and", lang=self._message_lang(message))
+        self._speak_for(message, "commands.queued", data={"devices": devices})
+
+    def _send_turn_command(self, message: Message, request_type: str):
+        """Turn one device, or a spoken list of devices, on or off."""
+        device = message.data.get("entity", "")
+        if not device:
+            return self._speak_for(message, "no.parsed.device")
+        # A device whose whole name sounds like a list, such as "salt and pepper lamp", wins over splitting it
+        devices = [device] if self._entities.get(device) else self._split_entities(device)
+        if len(devices) > 1:
+            calls, unknown = [], []
+            for name in devices:
+                data = self._lookup_device(message, name, command=True)
+                if data is None:
+                    unknown.append(name)
+                    continue
+                self._state_cache.invalidate(data["device"], "state")
+                calls.append(data)
+            return self._send_bulk(message, request_type, calls, failed=unknown)
+        data = self._lookup_device(message, device, command=True)
+        if data is None:
+            return self._speak_for(message, "device.not.found", data={"device": device})
+        self._state_cache.invalidate(data["device"], "state")
+        if self._should_announce(data):
+            action = "on" if request_type == "device.turn_on" else "off"
+            self._speak_for(message, f"device.turned.{action}", data={"device": data["device"]})
+            self._send_request(message, request_type, data, expected={})
+            return
+        if self._send_request(message, request_type, data) is None:
+            return
+        if self.verbose:
+            self._speak_for(message, "acknowledge")
+        else:
+            self.log.info(f"Trying to {request_type.split('.')[-1].replace('_', ' ')} device {data['device']}")
+
+    def _parse_step(self, message: Message) -> int:
+        """Return the brightness change in percent asked for by a brighter or dimmer intent.
+
+        An explicit amount ("by 20 percent") wins, then "a little" or "a lot", then `brightness_step`.
+        """
+        utterance, lang = message.data.get("utterance", ""), self._message_lang(message)
+        amount = extract_number(str(message.data.get("amount") or ""), lang=lang)
+        if amount and amount > 0:
+            return min(max(round(amount), 1), 100)
+        if self.voc_match(utterance, "little", lang=lang):
+            return max(round(self.brightness_step * SMALL_STEP_FACTOR), 1)
+        if self.voc_match(utterance, "lot", lang=lang):
+            return min(round(self.brightness_step * LARGE_STEP_FACTOR), 100)
+        return self.brightness_step
+
+    def _should_announce(self, data: dict) -> bool:
+        """Check whether a command for the device in `data` can be answered before Home Assistant confirms it.
+
+        Only devices found in the local entity index are announced early, and not while Home Assistant is
+        unreachable, when the command is queued instead.
+        """
+        return (
+            self.optimistic_responses
+            and self._ha_available
+            and "device_id" in data
+            and data["device"] not in self.silent_entities
+        )
+
+    def _check_announced(self, request: PendingRequest, response: Message):
+        """Compare a response to the result announced for its request, and correct the user if they differ."""
+        data = response.data
+        if not data.get("device") or isinstance(data.get("response"), str):
+            return self._speak_for(request.message, "correction.failed", data={"device": request.device})
+        lang = self._message_lang(request.message)
+        for key, expected in request.extra["expected"].items():
+            actual = self._colors.describe(lang, data) if key == "color" else data.get(key)
+            if actual is None:
+                continue
+            if isinstance(expected, (int, float)):
+                # Brightness goes through Home Assistant's 0-255 scale and back, so allow for rounding
+                try:
+                    if abs(float(actual) - expected) <= 1:
+                        continue
+                except (TypeError, ValueError):
+                    pass
+            elif str(actual).lower() == str(expected).lower():
+                continue
+            elif key == "color" and self._same_color(lang, actual, expected):
+                continue
+            self.log.info(f"Announced {key} {expected} for {request.device}, but Home Assistant reports {actual}")
+            return self._speak_for(request.message, f"correction.{key}", data={"device": request.device, key: actual})
+
+    def _lookup_device(self, message: Message, device: str, command: bool = False) -> Optional[dict]:
+        """Resolve a spoken device name to the data identifying it in a PHAL request.
+
+        Until the device list has been loaded, the name is passed through for the plugin to match. A name
+        that says what kind of device it is, such as "bedroom fan", only loosely matches devices of that
+        kind, and a `command` needs a closer match than a question. Returns None if the device list is
+        loaded and nothing in it matches.
+        """
+        if not len(self._entities):
+            return {"device": device}
+        kinds = self._spoken_kinds(device, self._message_lang(message))
+        match = self._entities.resolve(device, kinds=kinds, threshold=self._command_threshold if command else None)
+        if match is None:
+            self.log.info(f"No Home Assistant device matches {device}")
+            return None
+        self.log.debug(f"Resolved {device} to {match.entity_id} with score {match.score:.2f}")
+        return {"device": match.name, "device_id": match.entity_id}
+
+    def _spoken_kinds(self, device: str, lang: str) -> Optional[FrozenSet[str]]:
+        """Return the entity kinds a spoken device name says it is, like light for "desk lamp", or None."""
+        words = self._kind_words.get(lang)
+        if words is None:
+            resources, words = self.load_lang(lang=lang), {}
+            for vocab, kinds in DEVICE_KINDS.items():
+                for synonyms in resources.load_vocabulary_file(vocab) if kinds else ():
+                    words.update((word.lower(), kinds) for word in synonyms)
+            self._kind_words[lang] = words
+        kinds = {kind for word in clean_entity_name(device).split() for kind in words.get(word, ())}
+        return frozenset(kinds) or None
+
+    def _cache_color(self, device: Optional[str], message: Message, **state) -> Optional[str]:
+        """Cache the color a PHAL response reports for `device`, with its value when known. Returns its name."""
+        color = self._colors.describe(self._message_lang(message), message.data)
+        if color and device:
+            self._state_cache.invalidate(device, "color", "rgb_color")
+            self._state_cache.update(device, color=color, rgb_color=reported_rgb(message.data), **state)
+        return color
+
+    def _color_data(self, message: Message, target: dict, color: str) -> dict:
+        """Data for a `set.light.color` request for `target`, naming the color as the PHAL plugin parses it."""
+        palette = self._colors.palette(self._message_lang(message))
+        if palette is not None and color in palette:
+            # The plugin reads only CSS3 names, which are written without spaces
+            color = color_key(color)
+        return {**target, "color": color}
+
+    def _same_color(self, lang: str, color: str, other: str) -> bool:
+        """Check whether two color names have the same value, such as "cyan" and "aqua"."""
+        palette = self._colors.palette(lang)
+        return palette is not None and palette.rgb(color) is not None and palette.rgb(color) == palette.rgb(other)
+
+    def handle_metrics_query(self, message: Message):
+        """Answer a metrics query with per-handler counters, stage latencies and PHAL messages per route."""
+        self.bus.emit(message.response({**self._metrics.snapshot(), "routes": self._router.counts}))
+
+    def _log_metrics(self, _: Optional[Message] = None):
+        summary = self._metrics.summary()
+        if summary:
+            self.log.info(f"Home Assistant request stats:\n{summary}")
+
+    def _schedule_metrics_log(self):
+        self.cancel_scheduled_event("LogMetrics")
+        if self._metrics.enabled and self.metrics_log_interval > 0:
+            self.schedule_repeating_event(self._log_metrics, None, self.metrics_log_interval, name="LogMetrics")
+
+    def _on_event_start(
+        self, message: Message, handler_info: str, skill_data: dict, activation: Optional[bool] = None
+    ):
+        # Intents are the first stage of every traced request. This runs in the handler's thread before it
+        # starts, which the bus's handler.start event doesn't; the signature is ovos-workshop's since 0.1.0
+        intent = message.msg_type.split(":", 1)[-1]
+        if intent.endswith(".intent"):
+            self._metrics.start(message, intent)
+            self._record(INTENT, message)
+        super()._on_event_start(message, handler_info, skill_data, activation)
+
+    def _message_lang(self, message: Optional[Message]) -> str:
+        """Return the language to answer `message` in: its own, its session's, or the configured default."""
+        if message is not None:
+            lang = (
+                message.data.get("lang")
+                or message.context.get("lang")
+                or (message.context.get("session") or {}).get("lang")
+            )
+            if lang:
+                return normalize_lang(lang)
+        return normalize_lang(self.config_core.get("lang", "en-US"))
+
+    def handle_phal_ready(self, _: Message):
+        """The PHAL plugin (re)connected to Home Assistant: reload the device list and replay queued commands."""
+        self._request_device_list()
+        self._set_available(True)
+
+    def _set_available(self, available: bool):
+        """Record whether Home Assistant answers requests, probing it while it doesn't.
+
+        Queued commands are replayed as soon as it is known to be reachable.
+        """
+        if available:
+            self._consecutive_timeouts, self._probe_pending = 0, False
+        was_available, self._ha_available = self._ha_available, available
+        if available != was_available:
+            self.log.info(f"Home Assistant is {'reachable' if available else 'unreachable'}")
+            self.cancel_scheduled_event("ProbeHomeAssistant")
+            if not available and self.offline_probe_interval > 0:
+                self.schedule_repeating_event(
+                    self._probe_home_assistant, None, self.offline_probe_interval, name="ProbeHomeAssistant"
+                )
+        if available and len(self._offline_queue):
+            self._replay_offline_queue()
+
+    def _note_timeout(self):
+        """Count an unanswered request, taking Home Assistant to be unreachable after several in a row.
+
+        A single timeout may just be a device that didn't answer, so it is checked with a probe instead.
+        """
+        self._consecutive_timeouts += 1
+        if self._consecutive_timeouts >= self.offline_timeout_limit:
+            self._set_available(False)
+        elif self._ha_available and not self._probe_pending:
+            self._probe_home_assistant()
+
+    def _probe_home_assistant(self, _: Optional[Message] = None):
+        """Send a cheap request whose answer shows Home Assistant is reachable again."""
+        self._probe_pending = True
+        message = Message(f"{self.skill_id}.probe")
+        entity_id = next(iter(self._entities), None)
+        if entity_id:
+            self._send_request(message, "get.device", {"device_id": entity_id}, probe=True)
+        else:
+            self._send_request(message, "get.devices", {}, probe=True)
+
+    def _replay_offline_queue(self):
+        """Send every queued command in one batch and report the result once."""
+        commands = self._offline_queue.drain()
+        if not commands:
+            return
+        message = commands[-1].message
+        key = "queue.replaying.one" if len(commands) == 1 else "queue.replaying"
+        self._speak_for(message, key, data={"count": len(commands)})
+        self._start_batch(
+            message, "replay", [(command.request_type, command.data) for command in commands], replayed=commands
+        )
+
+    def _request_device_list(self, _: Optional[Message] = None):
+        """Ask the PHAL plugin for its device list to (re)build the entity index."""
+        self._emit_phal(Message(f"{PHAL_NAMESPACE}get.devices"))
+
+    def _schedule_resync(self):
+        """Reload the whole device list every `resync_interval` seconds, in case a state change was missed."""
+        self.cancel_scheduled_event("ResyncDeviceList")
+        if self.resync_interval > 0:
+            self.schedule_repeating_event(
+                self._request_device_list, None, self.resync_interval, name="ResyncDeviceList"
+            )
+
+    def _load_snapshot(self):
+        """Fill the entity index from the snapshot saved before the last restart, until the device list arrives.
+
+        The device list requested at startup then replaces it, and pushed state changes keep it current.
+        """
+        entities = self._snapshot.load()
+        if entities and not len(self._entities):
+            self._entities.rebuild(entities, aliases=self._entity_aliases)
+            self._snapshot.generation = self._entities.generation
+
+    def _save_snapshot(self, _: Optional[Message] = None):
+        """Save the entity index for the next startup, unless it is empty or unchanged since the last save."""
+        generation = self._entities.generation
+        if len(self._entities) and generation != self._snapshot.generation:
+            self._snapshot.save(self._entities.export(), generation)
+
+    def _schedule_snapshot(self):
+        self.cancel_scheduled_event("SaveEntitySnapshot")
+        if self.snapshot_interval > 0:
+            self.schedule_repeating_event(self._save_snapshot, None, self.snapshot_interval, name="SaveEntitySnapshot")
+
+    def _apply_state_change(self, entity_id: str, new_state: Optional[dict]):
+        """Apply one entity's new Home Assistant state to the entity index and state cache."""
+        known = self._entities.by_id(entity_id)
+        if not new_state:
+            # The entity was removed from Home Assistant
+            if known:
+                self._state_cache.invalidate(known.name)
+                self._entities.remove(entity_id)
+            return
+        attributes = new_state.get("attributes") or {}
+        device = {
+            "id": entity_id,
+            "name": attributes.get("friendly_name") or entity_id,
+            "type": entity_id.split(".", 1)[0],
+            "state": new_state.get("state"),
+            "attributes": attributes,
+        }
+        name = self._get_device_name(device)
+        if known:
+            if known.name != name:
+                self._state_cache.invalidate(known.name)
+            # The plugin only controls devices it registered, so new entities wait for the next resync
+            self._entities.upsert(device)
+        brightness = attributes.get("brightness")
+        rgb = reported_rgb(attributes)
+        self._state_cache.invalidate(name, "brightness", "color", "rgb_color")
+        self._state_cache.update(
+            name,
+            name=name,
+            type=device["type"],
+            state=device["state"],
+            brightness=self._get_percentage_brightness_from_ha_value(brightness) if brightness is not None else None,
+            color=self._colors.describe(self._message_lang(None), attributes) if rgb is not None else None,
+            rgb_color=rgb,
+        )
+
+    def _track_request(self, message: Message, request_type: str, data: dict, **extra) -> PendingRequest:
+        return self._pending_requests.add(
+            request_type,
+            message,
+            device=data.get("device", ""),
+            data=data,
+            timeout=self.request_timeouts.get(request_type, DEFAULT_REQUEST_TIMEOUT),
+            **extra,
+        )
+
+    def _emit_request(self, request: PendingRequest, data: dict):
+        """Send a tracked request as soon as the rate limits allow."""
+        device = data.get("device_id") or request.device
+        self._throttle.submit(device, request, COMMAND_ASPECTS.get(request.request_type))
+
+    def _send_now(self, request: PendingRequest):
+        outgoing = request.message.forward(f"{PHAL_NAMESPACE}{request.request_type}", request.data)
+        # forward() shares the context dict with the original message, so copy it before tagging
+        outgoing.context = {**outgoing.context, REQUEST_ID_KEY: request.request_id}
+        self._metrics.mark(outgoing, "request")
+        self._emit_phal(outgoing)
+
+    def _apply_adjustment(self, adjustment: Adjustment):
+        """Send the net result of coalesced light adjustments as a single request per attribute."""
+        device, message, announced = adjustment.device, adjustment.message, adjustment.announced
+        target = {"device": device, "device_id": adjustment.device_id} if adjustment.device_id else {"device": device}
+        if adjustment.color:
+            self._state_cache.invalidate(device, "color", "rgb_color")
+            extra = {"expected": {"color": announced["color"]}} if "color" in announced else {}
+            self._send_request(
+                message, "set.light.color", self._color_data(message, target, adjustment.color), **extra
+            )
+        if adjustment.brightness is None and not adjustment.step:
+            return
+        cached = self._state_cache.get(device, "brightness")
+        self._state_cache.invalidate(device, "brightness", "state")
+        if adjustment.brightness is not None or cached:
+            base = adjustment.brightness if adjustment.brightness is not None else cached["brightness"]
+            brightness = min(max(int(base) + adjustment.step, 0), 100)
+            call_data = {
+                **target,
+                "function_name": "turn_on",
+                "brightness": self._get_ha_value_from_percentage_brightness(brightness),
+            }
+            self.log.info(call_data)
+            extra = {"expected": {"brightness": announced["brightness"]}} if "brightness" in announced else {}
+            self._send_request(message, "set.light.brightness", call_data, **extra)
+        else:
+            # Without a known brightness, let Home Assistant apply the step itself in one service call
+            # rather than having the plugin read the brightness and write it back
+            call_data = {
+                **target,
+                "function_name": "turn_on",
+                "function_args": {"brightness_step_pct": adjustment.step},
+            }
+            self.log.info(call_data)
+            self._send_request(message, "call.supported.function", call_data)
+
+    def _send_area_command(self, message: Message, request_type: str):
+        area = message.data.get("area")
+        if not area:
+            return self._speak_for(message, "area.not.found")
+        utterance = message.data.get("utterance", "")
+        domain = "light" if self.voc_match(utterance, "lights", lang=self._message_lang(message)) else None
+        if len(self._entities):
+            self._send_area_bulk(message, request_type, area, domain)
+        else:
+            # Until the device list has loaded, ask for it and send the commands once it arrives
+            self._send_request(message, "get.devices", {}, bulk=request_type, area=area, domain=domain)
+        if self.verbose:
+            self._speak_for(message, "acknowledge")
+
+    def _send_area_bulk(self, message: Message, request_type: str, area: str, domain: Optional[str]):
+        """Send `request_type` to every device in `area` that can be turned on and off, or only to its lights."""
+        types = (domain,) if domain else TOGGLEABLE_TYPES
+        matches = [match for match in self._entities.select(kinds=types, area=area) if match.type in types]
+        if not matches:
+            return self._speak_for(message, "area.devices.not.found", data={"area": area})
+        self._send_bulk(
+            message, request_type, [{"device": match.name, "device_id": match.entity_id} for match in matches]
+        )
+
+    def _answer_aggregate(self, message: Message, listing: bool, fetch: bool = True):
+        """Count or list the devices of the spoken kind, state and area, from the entity index.
+
+        The index holds every device's last known state, kept current by the device list, pushed state
+        changes and command results. Changes the plugin signalled without their data are loaded in the
+        background, so questions are answered from the index meanwhile. The device list is fetched first
+        only if none has arrived yet, or if such changes are pending and the list is over `index_max_age`
+        seconds old.
+        """
+        outdated = self._devices_stale and monotonic() - self._devices_loaded_at > self.index_max_age
+        if fetch and (outdated or not len(self._entities)):
+            return self._send_request(message, "get.devices", {}, aggregate=listing)
+        lang = self._message_lang(message)
+        kind, state, area = (message.data.get(slot, "").strip() for slot in ("kind", "state", "area"))
+        if not kind or not state:
+            return self._speak_for(message, "no.parsed.device")
+        kinds, named = self._parse_kinds(kind, lang)
+        states = next(
+            (group for vocab, group in STATE_GROUPS.items() if self.voc_match(state, vocab, lang=lang)), (state,)
+        )
+        matches = [
+            match
+            for match in self._entities.select(kinds=kinds, states=states, area=area or None, named=named)
+            if match.name not in self.silent_entities
+        ]
+        data = {"kind": kind, "state": state, **({"area": area} if area else {})}
+        if not matches:
+            key = "devices.state.none"
+        elif len(matches) == 1:
+            key, data["device"] = "devices.state.one", matches[0].name
+        elif not listing:
+            key, data["count"] = "devices.state.count", len(matches)
+        else:
+            names = [match.name for match in matches[:MAX_LISTED_DEVICES]]
+            key = "devices.state.list" if len(matches) <= MAX_LISTED_DEVICES else "devices.state.list.more"
+            data.update(count=len(matches), devices=join_list(names, "and", lang=lang))
+        self._speak_for(message, f"{key}.area" if area else key, data=data)
+
+    def _parse_kinds(self, kind: str, lang: str) -> Tuple[Optional[Tuple[str, ...]], Optional[str]]:
+        """Return the entity kinds a spoken kind of device covers, or else the word to find in device names."""
+        for vocab, kinds in DEVICE_KINDS.items():
+            if self.voc_match(kind, vocab, lang=lang):
+                return kinds, None
+        # "heaters" -> devices with "heater" in their name
+        return None, kind[:-1] if kind.endswith("s") and len(kind) > 3 else kind
+
+    def _set_indexed_state(self, device: str, state: str):
+        match = self._entities.get(device)
+        if match is not None:
+            self._entities.set_state(match.entity_id, state)
+
+    def _resolve_request(self, message: Message) -> Optional[Message]:
+        """Match a PHAL response to its pending request.
+
+        Returns the message the response should be answered on, or None if the request already
+        timed out and the user has been told so.
+        """
+        request_id = message.context.get(REQUEST_ID_KEY)
+        if not request_id:
+            return message
+        self._metrics.mark(message, "response")
+        request = self._pending_requests.resolve(request_id)
+        if request is None and self._offline_queue.confirm(request_id):
+            self.log.info(f"Late response {message.msg_type} confirmed a queued command")
+        # Any answer, even a late one, means Home Assistant is reachable
+        self._set_available(True)
+        if request is None:
+            self.log.debug(f"Ignoring late or unknown response {message.msg_type}")
+            return None
+        if request.extra.get("probe"):
+            return None
+        if "expected" in request.extra:
+            self._check_announced(request, message)
+            return None
+        if "batch" in request.extra:
+            self._record_batch_result(request, bool(message.data.get("device")) and not message.data.get("response"))
+            return None
+        if "routine" in request.extra:
+            self._record_routine_result(request, bool(message.data.get("device")) and not message.data.get("response"))
+            return None
+        return request.message
+
+    def _handle_request_timeout(self, request: PendingRequest):
+        if request.extra.get("probe"):
+            self._probe_pending = False
+            self.log.debug("Home Assistant did not answer a probe")
+            return self._set_available(False)
+        self.log.warning(f"No response from Home Assistant for {request.request_type} {request.device}")
+        self._metrics.mark(request.message, "timeout")
+        self._note_timeout()
+        # Only queue once Home Assistant counts as unreachable. A single timeout may be a slow device, and a
+        # command it still carries out late would otherwise be sent twice.
+        offline = not self._ha_available
+        if "batch" in request.extra:
+            if offline:
+                self._offline_queue.add(
+                    request.request_type,
+                    request.data,
+                    request.message,
+                    request.request_id,
+                    replayed=request.extra.get("replayed"),
+                )
+            self._record_batch_result(request, False)
+        elif "routine" in request.extra:
+            # Later steps may depend on this one, so the routine is reported as failed rather than queued
+            self._record_routine_result(request, False)
+        elif offline and request.request_type in COMMAND_ASPECTS:
+            self._queue_commands(
+                request.message, [(request.request_type, request.data)], request_id=request.request_id
+            )
+        else:
+            self._speak_for(request.message, "request.timeout", data={"device": request.device})
+
+    def _handle_shed_request(self, request: PendingRequest):
+        """Tell the user a request was dropped because too many were already waiting for the rate limits."""
+        if not self._pending_requests.cancel(request.request_id) or request.extra.get("probe"):
+            return
+        if "batch" in request.extra:
+            return self._record_batch_result(request, False)
+        if "routine" in request.extra:
+            return self._record_routine_result(request, False)
+        self._speak_for(request.message, "busy", data={"device": request.device})
+
+    def _handle_merged_request(self, request: PendingRequest):
+        """Stop waiting for a command that a newer one for the same device replaced before it was sent."""
+        if not self._pending_requests.cancel(request.request_id):
+            return
+        if "batch" in request.extra:
+            self._record_batch_result(request, True)
+        elif "routine" in request.extra:
+            self._record_routine_result(request, True)
+
+    def _record_batch_result(self, request: PendingRequest, success: bool):
+        batch = self._batches.record(request, success)
+        if batch is not None:
+            self._report_batch(batch)
+
+    def _report_batch(self, batch: Batch):
+        action = "turned.on" if batch.request_type == "device.turn_on" else "turned.off"
+        failed = join_list(batch.failed, "and", lang=self._message_lang(batch.message))
+        if not batch.succeeded:
+            return self._speak_for(batch.message, "bulk.failed", data={"failed": failed})
+        key = "queue.replayed" if batch.request_type == "replay" else f"bulk.{action}"
+        data = {"count": len(batch.succeeded)}
+        if batch.failed:
+            key, data["failed"] = f"{key}.partial", failed
+        if len(batch.succeeded) == 1:
+            key, data["device"] = f"{key}.one", batch.succeeded[0]
+        self._speak_for(batch.message, key, data=data)
+
+    def _run_routine(self, message: Message, routine: Routine):
+        """Send every step of `routine` as soon as the steps it waits for have succeeded, and report once at the end.
+
+        Independent steps are sent together rather than one after another, so a routine takes about as long
+        as its longest chain of dependent steps. While Home Assistant is unreachable, the steps are queued. A
+        routine naming a device the index doesn't have, or a color the message's language doesn't, is not run
+        at all.
+        """
+        lang = self._message_lang(message)
+        unknown = [
+            step.device for step in routine.steps if self._lookup_device(message, step.device, command=True) is None
+        ]
+        if unknown:
+            devices = join_list(list(dict.fromkeys(unknown)), "and", lang=lang)
+            return self._speak_for(
+                message, "routine.unknown.devices", data={"routine": routine.name, "devices": devices}
+            )
+        palette = self._colors.palette(lang)
+        unknown = [
+            str(step.value)
+            for step in routine.steps
+            if step.action == "color" and palette is not None and str(step.value) not in palette
+        ]
+        if unknown:
+            colors = join_list(list(dict.fromkeys(unknown)), "and", lang=lang)
+            return self._speak_for(message, "routine.unknown.colors", data={"routine": routine.name, "colors": colors})
+        if not self._ha_available:
+            calls = [self._routine_call(message, routine.steps[index]) for index in routine.order]
+            return self._queue_commands(message, [call for call in calls if call is not None])
+        run = self._routine_runs.start(routine, message)
+        self.log.info(f"Running routine {routine.name}: {len(routine)} steps, {len(routine.roots)} at once")
+        if self.verbose:
+            self._speak_for(message, "acknowledge")
+        self._send_routine_steps(run, [routine.steps[index] for index in routine.roots])
+
+    def _routine_call(self, message: Message, step: RoutineStep) -> Optional[Tuple[str, dict]]:
+        """The request type and data for a routine step, or None if its device isn't known."""
+        target = self._lookup_device(message, step.device, command=True)
+        if target is None:
+            return None
+        device = target["device"]
+        if step.action == "brightness":
+            self._state_cache.invalidate(device, "brightness", "state")
+            brightness = self._get_ha_value_from_percentage_brightness(step.value)
+            return step.request_type, {**target, "function_name": "turn_on", "brightness": brightness}
+        if step.action == "color":
+            self._state_cache.invalidate(device, "color", "rgb_color")
+            return step.request_type, self._color_data(message, target, str(step.value))
+        self._state_cache.invalidate(device, "state")
+        return step.request_type, target
+
+    def _send_routine_steps(self, run: RoutineRun, steps: List[RoutineStep]):
+        for step in steps:
+            call = self._routine_call(run.message, step)
+            if call is None:
+                self.log.info(f"Routine {run.routine.name} step {step.index + 1}: no device matches {step.device}")
+                self._finish_routine_step(run.run_id, step.index, False)
+                continue
+            request = self._track_request(run.message, *call, routine=run.run_id, step=step.index)
+            self._emit_request(request, request.data)
+
+    def _record_routine_result(self, request: PendingRequest, success: bool):
+        self._finish_routine_step(request.extra["routine"], request.extra["step"], success)
+
+    def _finish_routine_step(self, run_id: str, index: int, success: bool):
+        run, ready, done = self._routine_runs.record(run_id, index, success)
+        if ready:
+            self._send_routine_steps(run, ready)
+        if done:
+            self._report_routine(run)
+
+    def _report_routine(self, run: RoutineRun):
+        name = run.routine.name
+        # A device with several steps that failed is only named once
+        failed = join_list(list(dict.fromkeys(run.failed)), "and", lang=self._message_lang(run.message))
+        if not run.failed:
+            self._speak_for(run.message, "routine.done", data={"routine": name})
+        elif run.succeeded:
+            self._speak_for(run.message, "routine.done.partial", data={"routine": name, "failed": failed})
+        else:
+            self._speak_for(run.message, "routine.failed", data={"routine": name})
+
+    @staticmethod
+    def _split_entities(text: str) -> List[str]:
+        """Split a spoken list of devices such as "the lamp, the fan and the TV" into device names."""
+        names = [LEADING_ARTICLE.sub("", name).strip() for name in ENTITY_LIST_SEPARATOR.split(text or "")]
+        return [name for name in names if name]
+
+    @staticmethod
+    def _get_device_name(device: dict) -> str:
+        return device.get("attributes", {}).get("friendly_name", device.get("name"))
+
+    def _speak_for(self, message: Message, key: str, data: Optional[dict] = None):
+        """Speak a dialog on the session that sent `message`, rather than whichever session is current.
+
+        `speak_dialog` picks its session and language from the nearest `Message` argument on the call stack, which
+        is `message`. The dialog is timed on the trace `message` belongs to, if it is traced.
+        """
+        self._metrics.mark(message, "dialog")
+        if self._metrics.traced(message) and self.dialog_renderer:
+            # Render here, as `speak_dialog` would, so rendering and queueing the speech are timed apart
+            data = data or {}
+            utterance = self.dialog_renderer.render(key, data)
+            self._metrics.mark(message, "rendered")
+            self.speak(utterance, meta={"dialog": key, "data": data})
+        elif data is None:
+            self.speak_dialog(key)
+        else:
+            self.speak_dialog(key, data=data)
+        self._metrics.mark(message, "spoken")
+
     def _get_ha_value_from_percentage_brightness(self, brightness):
         return round(int(brightness)) / 100 * 255
 
+    def _get_percentage_brightness_from_ha_value(self, brightness):
+        return round(int(brightness) / 255 * 100)
+
 
 if __name__ == "__main__":
     from ovos_utils.messagebus import FakeBus
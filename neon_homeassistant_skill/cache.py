@@ -0,0 +1,93 @@
+# pylint: disable=missing-module-docstring
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Callable, Optional
+
+
+def normalize_entity_name(name: Optional[str]) -> str:
+    """Lowercase and collapse whitespace so spoken names and friendly names share cache keys."""
+    return " ".join(str(name or "").lower().split())
+
+
+class EntityStateCache:
+    """Bounded LRU cache of entity state reported by the PHAL plugin.
+
+    Entries expire `ttl` seconds after they were last written. When the cache holds
+    more than `max_size` entities the least recently used one is evicted.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 10.0, clock: Callable[[], float] = monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, entity: str) -> bool:
+        return self.get(entity) is not None
+
+    def configure(self, max_size: Optional[int] = None, ttl: Optional[float] = None):
+        """Apply new limits, evicting entries if the cache shrank."""
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def get(self, entity: str, *fields: str) -> Optional[dict]:
+        """Return the cached state for `entity` if it is fresh and has every requested field."""
+        key = normalize_entity_name(entity)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            written, state = entry
+            if self._clock() - written > self.ttl:
+                del self._entries[key]
+                return None
+            if any(state.get(field) is None for field in fields):
+                return None
+            self._entries.move_to_end(key)
+            return dict(state)
+
+    def update(self, entity: str, **state) -> Optional[dict]:
+        """Merge `state` into the entry for `entity` and mark it fresh."""
+        key = normalize_entity_name(entity)
+        if not key or self.max_size <= 0 or self.ttl <= 0:
+            return None
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            merged = {}
+            if entry is not None and now - entry[0] <= self.ttl:
+                merged.update(entry[1])
+            merged.update({k: v for k, v in state.items() if v is not None})
+            self._entries[key] = (now, merged)
+            self._evict()
+            return dict(merged)
+
+    def invalidate(self, entity: str, *fields: str):
+        """Drop `fields` from the entry for `entity`, or the whole entry if no fields are given."""
+        key = normalize_entity_name(entity)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if not fields:
+                del self._entries[key]
+                return
+            for field in fields:
+                entry[1].pop(field, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        while len(self._entries) > max(self.max_size, 0):
+            self._entries.popitem(last=False)
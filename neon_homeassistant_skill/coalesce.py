@@ -0,0 +1,109 @@
+# pylint: disable=missing-module-docstring
+from dataclasses import dataclass, field
+from threading import Lock, Timer
+from typing import Callable, Dict, Optional, Tuple
+
+from ovos_bus_client import Message
+from ovos_utils.log import LOG
+
+from neon_homeassistant_skill.cache import normalize_entity_name
+from neon_homeassistant_skill.correlation import get_session_id
+
+
+@dataclass
+class Adjustment:
+    """Net light adjustment requested for one entity during a coalescing window."""
+
+    device: str
+    message: Message
+    device_id: Optional[str] = None
+    brightness: Optional[int] = None
+    step: int = 0
+    color: Optional[str] = None
+    count: int = 0
+    # Values already spoken to the user as the expected result
+    announced: dict = field(default_factory=dict)
+
+
+class AdjustmentCoalescer:
+    """Merge brightness and color adjustments for the same entity and session that arrive within `window` seconds.
+
+    Each session is coalesced on its own, so every user who asked gets an answer. The first adjustment for
+    an entity opens the window; when it closes, `on_flush` is called once with
+    the net result. An absolute brightness replaces any earlier steps, later steps are added to it, and
+    the last color wins. A value announced to the user is forgotten once a later adjustment changes it. A
+    window of 0 flushes every adjustment immediately.
+    """
+
+    def __init__(self, on_flush: Callable[[Adjustment], None], window: float = 0.5):
+        self.window = window
+        self._on_flush = on_flush
+        self._pending: Dict[Tuple[str, str], Adjustment] = {}
+        self._timers: Dict[Tuple[str, str], Timer] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(
+        self,
+        device: str,
+        message: Message,
+        device_id: Optional[str] = None,
+        brightness: Optional[int] = None,
+        step: int = 0,
+        color: Optional[str] = None,
+        announced: Optional[dict] = None,
+    ) -> Adjustment:
+        key = (normalize_entity_name(device), get_session_id(message))
+        with self._lock:
+            adjustment = self._pending.get(key)
+            if adjustment is None:
+                adjustment = self._pending[key] = Adjustment(device=device, message=message)
+                if self.window > 0:
+                    timer = self._timers[key] = Timer(self.window, self._flush, (key,))
+                    timer.daemon = True
+                    timer.start()
+            if brightness is not None:
+                adjustment.brightness = brightness
+                adjustment.step = 0
+            adjustment.step += step
+            if color:
+                adjustment.color = color
+            adjustment.message = message
+            adjustment.device = device
+            adjustment.device_id = device_id or adjustment.device_id
+            # An announcement only holds for the net result if nothing was merged into it afterwards
+            if brightness is not None or step:
+                adjustment.announced.pop("brightness", None)
+            if color:
+                adjustment.announced.pop("color", None)
+            adjustment.announced.update(announced or {})
+            adjustment.count += 1
+        if self.window <= 0:
+            self._flush(key)
+        return adjustment
+
+    def flush(self, device: str, session_id: str = "default") -> Optional[Adjustment]:
+        """Send the net adjustment for `device` in `session_id` now instead of waiting for its window to close."""
+        return self._flush((normalize_entity_name(device), session_id))
+
+    def _flush(self, key: Tuple[str, str]) -> Optional[Adjustment]:
+        with self._lock:
+            adjustment = self._pending.pop(key, None)
+            timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if adjustment is None:
+            return None
+        if adjustment.count > 1:
+            LOG.debug(f"Coalesced {adjustment.count} adjustments for {adjustment.device}")
+        try:
+            self._on_flush(adjustment)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.exception(f"Error applying adjustment for {adjustment.device}: {e}")
+        return adjustment
+
+    def flush_all(self):
+        for key in list(self._pending):
+            self._flush(key)
@@ -0,0 +1,204 @@
+# pylint: disable=missing-module-docstring
+import colorsys
+import re
+from glob import glob
+from os.path import join
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ovos_utils.log import LOG
+
+from neon_homeassistant_skill.cache import normalize_entity_name
+from neon_homeassistant_skill.lang import locale_directories, normalize_lang
+
+RGB = Tuple[int, int, int]
+Lab = Tuple[float, float, float]
+
+# "#ff8c00" or "ff8c00"
+HEX_COLOR = re.compile(r"#?([0-9a-f]{6})", re.IGNORECASE)
+# How the PHAL plugin reports a color that has no CSS3 name, such as "RGB code 255, 140, 10"
+RGB_CODE = re.compile(r"rgb code\W*(\d+)\W+(\d+)\W+(\d+)", re.IGNORECASE)
+# Distinct reported colors whose nearest name is remembered, per language
+MAX_NAMED_COLORS = 4096
+
+
+def normalize_color(word: Optional[str]) -> str:
+    """Lowercase a spoken color and treat hyphens as spaces, so "Blue-Green" and "blue green" are the same."""
+    return normalize_entity_name(str(word or "").replace("-", " "))
+
+
+def color_key(word: Optional[str]) -> str:
+    """Drop the spaces from a spoken color, giving its CSS3 name: "dark slate gray" is "darkslategray"."""
+    return normalize_color(word).replace(" ", "")
+
+
+def parse_rgb(value) -> Optional[RGB]:
+    """Read an RGB color given as "#rrggbb", "RGB code r, g, b" or three numbers from 0 to 255."""
+    if isinstance(value, str):
+        match = RGB_CODE.fullmatch(value.strip())
+        if match is not None:
+            return parse_rgb(match.groups())
+        match = HEX_COLOR.fullmatch(value.strip())
+        if match is None:
+            return None
+        return tuple(int(match.group(1)[i : i + 2], 16) for i in (0, 2, 4))
+    try:
+        red, green, blue = (min(max(round(float(channel)), 0), 255) for channel in value)
+    except (TypeError, ValueError):
+        return None
+    return red, green, blue
+
+
+def hs_to_rgb(hue: float, saturation: float) -> RGB:
+    """Convert Home Assistant's hue (0-360) and saturation (0-100) to an RGB color at full brightness."""
+    red, green, blue = colorsys.hsv_to_rgb(float(hue) / 360 % 1, min(max(float(saturation), 0), 100) / 100, 1)
+    return round(red * 255), round(green * 255), round(blue * 255)
+
+
+def _linear(channel: int) -> float:
+    value = channel / 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _lab_f(value: float) -> float:
+    return value ** (1 / 3) if value > 216 / 24389 else (24389 / 27 * value + 16) / 116
+
+
+def rgb_to_lab(rgb: RGB) -> Lab:
+    """Convert an sRGB color to CIELAB (D65), where straight-line distance follows perceived difference."""
+    red, green, blue = (_linear(channel) for channel in rgb)
+    x = _lab_f((0.4124 * red + 0.3576 * green + 0.1805 * blue) / 0.95047)
+    y = _lab_f(0.2126 * red + 0.7152 * green + 0.0722 * blue)
+    z = _lab_f((0.0193 * red + 0.1192 * green + 0.9505 * blue) / 1.08883)
+    return 116 * y - 16, 500 * (x - y), 200 * (y - z)
+
+
+def reported_rgb(data: dict) -> Optional[RGB]:
+    """Read the color from a PHAL plugin response or Home Assistant state attributes.
+
+    Uses `rgb_color`, then `hs_color`, then `color` if it holds an RGB value, as numbers or as the plugin's
+    "RGB code r, g, b", rather than a name.
+    """
+    if data.get("rgb_color") is not None:
+        return parse_rgb(data["rgb_color"])
+    if data.get("hs_color") is not None:
+        try:
+            return hs_to_rgb(*data["hs_color"])
+        except (TypeError, ValueError):
+            return None
+    color = data.get("color")
+    if isinstance(color, str):
+        return parse_rgb(color) if RGB_CODE.fullmatch(color.strip()) else None
+    return parse_rgb(color) if color is not None else None
+
+
+class ColorPalette:
+    """The color names of one language, with their RGB values and their positions in CIELAB.
+
+    Names are looked up by dictionary, ignoring the spaces between their words, so "honeydew" and
+    "honey dew" are the same color. An RGB color is named by the palette color nearest to it in
+    CIELAB; several names for the same value, such as "cyan" and "aqua", are all understood, but the
+    color is spoken as the first one listed. Names found for reported colors are remembered, so a
+    light reporting the same color again is named with one dictionary lookup.
+    """
+
+    def __init__(self, colors: Sequence[Tuple[str, RGB]]):
+        self._rgb: Dict[str, RGB] = {}
+        self._spoken: Dict[str, str] = {}
+        self._labs: List[Tuple[Lab, str]] = []
+        for name, rgb in colors:
+            name = normalize_color(name)
+            key = color_key(name)
+            if key in self._rgb:
+                continue
+            if rgb not in self._rgb.values():
+                self._labs.append((rgb_to_lab(rgb), name))
+            self._rgb[key] = rgb
+            self._spoken[key] = name
+        self._named: Dict[RGB, str] = {self._rgb[color_key(name)]: name for _, name in self._labs}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._rgb)
+
+    def __contains__(self, name: str) -> bool:
+        return color_key(name) in self._rgb
+
+    def rgb(self, name: str) -> Optional[RGB]:
+        """Return the RGB value of a spoken color name, or None if the language has no such color."""
+        return self._rgb.get(color_key(name))
+
+    def spoken(self, name: str) -> Optional[str]:
+        """Return a color name as the palette writes it, such as "dark slate gray" for "darkslategray"."""
+        return self._spoken.get(color_key(name))
+
+    def name(self, rgb: RGB) -> Optional[str]:
+        """Return the name of the palette color nearest to `rgb`."""
+        name = self._named.get(rgb)
+        if name is not None or not self._labs:
+            return name
+        l, a, b = rgb_to_lab(rgb)
+        _, name = min(((l - pl) ** 2 + (a - pa) ** 2 + (b - pb) ** 2, name) for (pl, pa, pb), name in self._labs)
+        with self._lock:
+            if len(self._named) >= MAX_NAMED_COLORS:
+                self._named.clear()
+            self._named[rgb] = name
+        return name
+
+
+class ColorNames:
+    """Color palettes for the skill's locale, read from each language's `colors.value` on first use.
+
+    Each line of `colors.value` is a name and an RGB value as `#rrggbb`, separated by a comma. Names are
+    CSS3 color names, which the PHAL plugin can parse, with spaces between their words. Languages without
+    the file have no palette, so their colors are passed to the PHAL plugin as spoken.
+    """
+
+    def __init__(self, locale_dir: str):
+        self._directories = locale_directories(locale_dir)
+        self._palettes: Dict[str, Optional[ColorPalette]] = {}
+        self._lock = Lock()
+
+    def palette(self, lang: str) -> Optional[ColorPalette]:
+        """Return the palette for `lang`, or None if the locale has no colors for it."""
+        lang = normalize_lang(lang)
+        if lang in self._palettes:
+            return self._palettes[lang]
+        with self._lock:
+            if lang not in self._palettes:
+                directory = self._directories.get(lang.lower()) or self._directories.get(lang.split("-")[0].lower())
+                colors = self._read(directory) if directory else []
+                self._palettes[lang] = ColorPalette(colors) if colors else None
+                LOG.debug(f"Loaded {len(colors)} colors for {lang}")
+            return self._palettes[lang]
+
+    def describe(self, lang: str, data: dict) -> Optional[str]:
+        """Name the color in a PHAL plugin response or Home Assistant state attributes.
+
+        A `color` that is already a name is returned as it is, or as the palette writes it, unless the
+        language has a palette and the data also has the color's value.
+        """
+        rgb, palette = reported_rgb(data), self.palette(lang)
+        if palette is not None and rgb is not None:
+            return palette.name(rgb)
+        color = data.get("color")
+        if not isinstance(color, str) or not color or RGB_CODE.fullmatch(color.strip()):
+            return None
+        return (palette.spoken(color) if palette is not None else None) or color
+
+    @staticmethod
+    def _read(directory: str) -> List[Tuple[str, RGB]]:
+        colors = []
+        for path in glob(join(directory, "**", "colors.value"), recursive=True):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    name, _, value = line.partition(",")
+                    rgb = parse_rgb(value)
+                    if not name.strip() or rgb is None:
+                        LOG.warning(f"Skipping unreadable color {line!r} in {path}")
+                        continue
+                    colors.append((name, rgb))
+        return colors
@@ -0,0 +1,277 @@
+# pylint: disable=missing-module-docstring
+from dataclasses import dataclass, field
+from heapq import heappop, heappush
+from threading import Condition, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from ovos_bus_client import Message
+from ovos_utils.log import LOG
+
+PHAL_NAMESPACE = "ovos.phal.plugin.homeassistant."
+REQUEST_ID_KEY = "homeassistant_request_id"
+
+DEFAULT_REQUEST_TIMEOUT = 10.0
+# Seconds to wait for the PHAL plugin to answer each request type. Reads are answered from
+# the plugin's device list; commands wait on a Home Assistant service call.
+REQUEST_TIMEOUTS = {
+    "get.devices": 10.0,
+    "get.device": 5.0,
+    "get.light.brightness": 5.0,
+    "get.light.color": 5.0,
+    "device.turn_on": 10.0,
+    "device.turn_off": 10.0,
+    "set.light.brightness": 10.0,
+    "increase.light.brightness": 10.0,
+    "decrease.light.brightness": 10.0,
+    "set.light.color": 10.0,
+    "call.supported.function": 10.0,
+}
+
+
+def get_session_id(message: Message) -> str:
+    """Return the ID of the session (usually a voice satellite) a message belongs to."""
+    return (message.context.get("session") or {}).get("session_id") or "default"
+
+
+@dataclass
+class PendingRequest:
+    """A request sent to the PHAL plugin that has not been answered yet."""
+
+    request_id: str
+    request_type: str
+    message: Message
+    device: str
+    deadline: float
+    session_id: str = "default"
+    data: dict = field(default_factory=dict)
+    extra: dict = field(default_factory=dict)
+
+
+class PendingRequests:
+    """Table of in-flight PHAL requests keyed by request ID and indexed by session.
+
+    Requests that are not answered before their deadline are removed and passed to `on_timeout`.
+    A background thread expires requests once `start` is called; `expire` may also be called directly.
+    Each session may have up to `max_per_session` requests in flight, so one busy satellite
+    cannot push other sessions' requests out of the table.
+    """
+
+    def __init__(
+        self,
+        on_timeout: Callable[[PendingRequest], None],
+        max_pending: int = 1000,
+        max_per_session: int = 50,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.max_pending = max_pending
+        self.max_per_session = max_per_session
+        self._on_timeout = on_timeout
+        self._clock = clock
+        self._requests: Dict[str, PendingRequest] = {}
+        self._deadlines: List[Tuple[float, str]] = []
+        # Request IDs per session, in the order they were sent
+        self._sessions: Dict[str, Dict[str, None]] = {}
+        self._condition = Condition()
+        self._running = False
+        self._thread: Optional[Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def __contains__(self, request_id: str) -> bool:
+        return request_id in self._requests
+
+    def add(
+        self,
+        request_type: str,
+        message: Message,
+        device: str = "",
+        timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        data: Optional[dict] = None,
+        **extra,
+    ) -> PendingRequest:
+        """Track a new request and return it.
+
+        If the session or the whole table is full, the oldest request of that session or table is dropped.
+        """
+        request = PendingRequest(
+            request_id=uuid4().hex,
+            request_type=request_type,
+            message=message,
+            device=device,
+            deadline=self._clock() + timeout,
+            session_id=get_session_id(message),
+            data=data or {},
+            extra=extra,
+        )
+        overflow = []
+        with self._condition:
+            session = self._sessions.get(request.session_id, {})
+            if len(session) >= max(self.max_per_session, 1):
+                overflow.append(self._pop(next(iter(session))))
+            self._requests[request.request_id] = request
+            self._sessions.setdefault(request.session_id, {})[request.request_id] = None
+            heappush(self._deadlines, (request.deadline, request.request_id))
+            while len(self._requests) > max(self.max_pending, 1):
+                overflow.append(self._pop(next(iter(self._requests))))
+            self._condition.notify()
+        for dropped in overflow:
+            LOG.warning(f"Too many pending Home Assistant requests, dropping {dropped.request_type}")
+            self._timeout(dropped)
+        return request
+
+    def resolve(self, request_id: Optional[str]) -> Optional[PendingRequest]:
+        """Remove and return the pending request with `request_id`, if it is still waiting."""
+        if not request_id:
+            return None
+        with self._condition:
+            return self._pop(request_id)
+
+    def for_session(self, session_id: str) -> List[PendingRequest]:
+        """Return the requests still waiting on a response for `session_id`."""
+        with self._condition:
+            return [self._requests[request_id] for request_id in self._sessions.get(session_id, ())]
+
+    def cancel(self, request_id: str) -> bool:
+        """Stop waiting for a request without calling the timeout handler."""
+        return self.resolve(request_id) is not None
+
+    def clear(self):
+        with self._condition:
+            self._requests.clear()
+            self._deadlines.clear()
+            self._sessions.clear()
+
+    def expire(self, now: Optional[float] = None) -> List[PendingRequest]:
+        """Remove every request past its deadline and call the timeout handler for each."""
+        expired = []
+        with self._condition:
+            now = self._clock() if now is None else now
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, request_id = heappop(self._deadlines)
+                request = self._pop(request_id)
+                if request is not None:
+                    expired.append(request)
+        for request in expired:
+            self._timeout(request)
+        return expired
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = Thread(target=self._run, name="homeassistant-pending-requests", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                wait = None
+                if self._deadlines:
+                    wait = max(self._deadlines[0][0] - self._clock(), 0)
+                self._condition.wait(wait)
+                if not self._running:
+                    return
+            self.expire()
+
+    def _pop(self, request_id: str) -> Optional[PendingRequest]:
+        request = self._requests.pop(request_id, None)
+        if request is not None:
+            session = self._sessions.get(request.session_id)
+            if session is not None:
+                session.pop(request_id, None)
+                if not session:
+                    del self._sessions[request.session_id]
+        return request
+
+    def _timeout(self, request: PendingRequest):
+        try:
+            self._on_timeout(request)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.exception(f"Error handling timeout for {request.request_type}: {e}")
+
+
+@dataclass
+class Batch:
+    """Requests sent together whose results are reported in a single dialog."""
+
+    batch_id: str
+    request_type: str
+    message: Message
+    remaining: Dict[str, str]
+    succeeded: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+
+    @property
+    def complete(self) -> bool:
+        return not self.remaining
+
+
+class Batches:
+    """Collects the results of batched requests until every request has answered or timed out."""
+
+    def __init__(self):
+        self._batches: Dict[str, Batch] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid4().hex
+
+    def start(
+        self,
+        batch_id: str,
+        request_type: str,
+        message: Message,
+        requests: List[PendingRequest],
+        failed: Optional[List[str]] = None,
+    ) -> Batch:
+        """Start collecting results for `requests`, which must all be tracked before any is sent.
+
+        `failed` lists devices that already failed without a request. A batch with no requests is
+        returned complete and not tracked.
+        """
+        batch = Batch(
+            batch_id=batch_id,
+            request_type=request_type,
+            message=message,
+            remaining={request.request_id: request.device for request in requests},
+            failed=list(failed or []),
+        )
+        if not batch.complete:
+            with self._lock:
+                self._batches[batch_id] = batch
+        return batch
+
+    def record(self, request: PendingRequest, success: bool) -> Optional[Batch]:
+        """Record the result of one request. Returns the batch once its last request has finished."""
+        with self._lock:
+            batch = self._batches.get(request.extra.get("batch"))
+            if batch is None or request.request_id not in batch.remaining:
+                return None
+            device = batch.remaining.pop(request.request_id)
+            (batch.succeeded if success else batch.failed).append(device)
+            if not batch.complete:
+                return None
+            del self._batches[batch.batch_id]
+            return batch
+
+    def clear(self):
+        with self._lock:
+            self._batches.clear()
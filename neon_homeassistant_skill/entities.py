@@ -0,0 +1,485 @@
+# pylint: disable=missing-module-docstring
+import re
+import sys
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from math import ceil
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set
+
+from neon_homeassistant_skill.cache import normalize_entity_name
+
+# "the my kitchen lamp" -> "kitchen lamp"
+LEADING_ARTICLE = re.compile(r"^(?:(?:the|my)\s+)+", re.IGNORECASE)
+# Names scored per fuzzy lookup, picked by how many of the query's rarest trigrams they share
+MAX_CANDIDATES = 50
+# Device classes counted as another, more familiar kind of device
+DEVICE_CLASS_KINDS = {"garage_door": "door", "garage": "door"}
+
+
+def clean_entity_name(text: Optional[str]) -> str:
+    """Normalize spoken or configured device text for lookups in the entity index."""
+    return normalize_entity_name(LEADING_ARTICLE.sub("", normalize_entity_name(text).replace("_", " ")))
+
+
+def entity_kinds(entity_id: str, device: dict) -> FrozenSet[str]:
+    """Return the kinds of device an entity is: its domain, its type, and what its device class describes."""
+    kinds = {entity_id.split(".", 1)[0]}
+    if device.get("type"):
+        kinds.add(device["type"])
+    device_class = (device.get("attributes") or {}).get("device_class")
+    if device_class:
+        kinds.add(DEVICE_CLASS_KINDS.get(device_class, device_class))
+    return frozenset(kinds)
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else None
+
+
+# One shared frozenset per distinct combination of kinds, as most entities have one of a few
+_KIND_SETS: Dict[FrozenSet[str], FrozenSet[str]] = {}
+
+
+def _shared_kinds(kinds: Iterable[str]) -> FrozenSet[str]:
+    kinds = frozenset(sys.intern(kind) for kind in kinds)
+    return _KIND_SETS.setdefault(kinds, kinds)
+
+
+def deep_sizeof(obj, seen: Optional[Set[int]] = None) -> int:
+    """Bytes used by `obj` and everything it holds, counting objects shared between them once."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Return the character trigrams of `text`, padded so that word boundaries count."""
+    padded = f" {text} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+class EntityRecord:
+    """What the skill keeps about one entity: the few fields it speaks or searches by, not HA's full state.
+
+    Domain, type, area and state strings are interned and kind sets shared, so thousands of records
+    hold one copy of each distinct value. `brightness` is Home Assistant's 0-255 value.
+    """
+
+    __slots__ = ("entity_id", "name", "type", "area", "state", "kinds", "brightness")
+
+    def __init__(
+        self,
+        entity_id: str,
+        name: str,
+        entity_type: Optional[str] = None,
+        area: Optional[str] = None,
+        state: Optional[str] = None,
+        kinds: Iterable[str] = (),
+        brightness: Optional[int] = None,
+    ):
+        self.entity_id = entity_id
+        self.name = name
+        self.type = _intern(entity_type)
+        self.area = _intern(area)
+        self.state = _intern(state.lower()) if state else None
+        self.kinds = _shared_kinds(kinds)
+        self.brightness = brightness
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, EntityRecord):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"EntityRecord({self.entity_id!r}, {self.name!r}, state={self.state!r})"
+
+    @classmethod
+    def from_device(cls, device: dict) -> "EntityRecord":
+        """Keep what the skill uses of a device from the PHAL plugin, dropping every other attribute."""
+        attributes = device.get("attributes") or {}
+        entity_id = device.get("id") or ""
+        brightness = attributes.get("brightness")
+        return cls(
+            entity_id,
+            attributes.get("friendly_name") or device.get("name") or entity_id,
+            device.get("type"),
+            device.get("area") or attributes.get("area"),
+            device.get("state"),
+            # Exported records carry their kinds, as the device class isn't kept
+            device["kinds"] if "kinds" in device else entity_kinds(entity_id, device) if entity_id else (),
+            int(brightness) if isinstance(brightness, (int, float)) else None,
+        )
+
+    def to_device(self) -> dict:
+        """Return the record as a device `from_device` reads back into an equal record."""
+        device = {
+            "id": self.entity_id,
+            "name": self.name,
+            "type": self.type,
+            "area": self.area,
+            "state": self.state,
+            "kinds": sorted(self.kinds),
+        }
+        if self.brightness is not None:
+            device["attributes"] = {"brightness": self.brightness}
+        return device
+
+
+@dataclass(frozen=True)
+class EntityMatch:
+    """An entity the spoken device name resolved to."""
+
+    entity_id: str
+    name: str
+    type: Optional[str]
+    area: Optional[str]
+    score: float
+    state: Optional[str] = None
+
+
+class EntityIndex:
+    """In-memory index of Home Assistant entities for resolving spoken device names locally.
+
+    Each entity is indexed under its friendly name, its entity ID without the domain, its name
+    prefixed with its area when one is known, and any configured aliases. Exact names are a dict
+    lookup; anything else is matched by trigram similarity. An inverted trigram index and prefix
+    filtering limit scoring to the few names sharing the most of the query's rarest trigrams, which
+    keeps lookups well under a millisecond with thousands of entities.
+
+    Each entity's last known state is kept too, with secondary indexes of entity IDs by kind, area
+    and state, so questions about many devices at once are answered by intersecting a few sets.
+    """
+
+    def __init__(self, threshold: float = 0.5):
+        self.threshold = threshold
+        self._aliases: Dict[str, str] = {}
+        self._entities: Dict[str, EntityRecord] = {}
+        self._by_kind: Dict[str, Set[str]] = {}
+        self._by_area: Dict[str, Set[str]] = {}
+        self._by_state: Dict[str, Set[str]] = {}
+        # Word of any indexed name -> entities with a name containing it
+        self._by_word: Dict[str, Set[str]] = {}
+        self._exact: Dict[str, str] = {}
+        self._names: List[str] = []
+        # Entity each indexed name belongs to, or None once the entity was removed
+        self._name_entities: List[Optional[str]] = []
+        # Trigram count of each indexed name; the trigrams themselves are found again in the name when scoring
+        self._name_sizes = array("H")
+        self._entity_names: Dict[str, List[int]] = {}
+        self._postings: Dict[str, array] = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self._entities
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entities))
+
+    @property
+    def generation(self) -> int:
+        """Counts changes to the index, so callers can tell whether it changed since they last looked."""
+        return self._generation
+
+    def rebuild(self, devices: Iterable[dict], aliases: Optional[Dict[str, str]] = None):
+        """Replace the index with `devices` from the PHAL plugin's device list.
+
+        `aliases` maps extra spoken names to an entity ID or friendly name. The new index is built
+        aside and swapped in at once, so lookups running on other threads never see a partial index.
+        """
+        fresh = EntityIndex(self.threshold)
+        fresh._aliases = dict(aliases or {})
+        for device in devices:
+            fresh._add_device(device)
+        with self._lock:
+            self._aliases, self._entities, self._exact = fresh._aliases, fresh._entities, fresh._exact
+            self._names, self._name_entities, self._name_sizes = fresh._names, fresh._name_entities, fresh._name_sizes
+            self._entity_names, self._postings = fresh._entity_names, fresh._postings
+            self._by_kind, self._by_area, self._by_state = fresh._by_kind, fresh._by_area, fresh._by_state
+            self._by_word = fresh._by_word
+            self._generation += 1
+
+    def upsert(self, device: dict) -> bool:
+        """Add or update one device without rebuilding the index. Returns True if the index changed.
+
+        A device without an area keeps the area it was indexed with, since state updates don't carry one.
+        """
+        if not device.get("id"):
+            return False
+        record = EntityRecord.from_device(device)
+        with self._lock:
+            current = self._entities.get(record.entity_id)
+            if current is not None:
+                record.area = record.area or current.area
+                if (record.name, record.type, record.area, record.kinds) == (
+                    current.name,
+                    current.type,
+                    current.area,
+                    current.kinds,
+                ):
+                    changed = current.brightness != record.brightness
+                    current.brightness = record.brightness
+                    return self._set_state(current, record.state) or changed
+                self._remove(record.entity_id)
+            self._add_record(record)
+            self._generation += 1
+            return True
+
+    def set_state(self, entity_id: str, state: Optional[str]) -> bool:
+        """Record a device's new state, such as after a command. Returns True if it changed."""
+        with self._lock:
+            record = self._entities.get(entity_id)
+            return record is not None and self._set_state(record, state)
+
+    def select(
+        self,
+        kinds: Optional[Iterable[str]] = None,
+        states: Optional[Iterable[str]] = None,
+        area: Optional[str] = None,
+        named: Optional[str] = None,
+    ) -> List[EntityMatch]:
+        """Return every entity of any of `kinds`, in any of `states`, in `area` and with `named` in its name.
+
+        Each criterion left out matches every entity. Devices not assigned to any area are in `area` if
+        their name contains it. Results are sorted by name.
+        """
+        with self._lock:
+            sets = []
+            if kinds is not None:
+                sets.append(self._union(self._by_kind, (kind.lower() for kind in kinds)))
+            if states is not None:
+                sets.append(self._union(self._by_state, (state.lower() for state in states)))
+            if area:
+                area = clean_entity_name(area)
+                unassigned = {entity_id for entity_id in self._named(area) if not self._entities[entity_id].area}
+                sets.append(self._by_area.get(area, set()) | unassigned)
+            if named:
+                sets.append(self._named(clean_entity_name(named)))
+            if sets:
+                sets.sort(key=len)
+                matched = sets[0].intersection(*sets[1:])
+            else:
+                matched = self._entities.keys()
+            matches = [self._match(entity_id, 1.0) for entity_id in matched]
+        return sorted(matches, key=lambda match: match.name.lower())
+
+    def export(self) -> List[dict]:
+        """Return every entity as a device `rebuild` accepts, to rebuild the same index from later."""
+        with self._lock:
+            return [record.to_device() for record in self._entities.values()]
+
+    def footprint(self) -> Dict[str, int]:
+        """Measure the memory the index holds, in total and per entity. Walks every object, so not for hot paths."""
+        with self._lock:
+            seen: Set[int] = set()
+            records = deep_sizeof(self._entities, seen)
+            indexes = (
+                self._aliases,
+                self._by_kind,
+                self._by_area,
+                self._by_state,
+                self._by_word,
+                self._exact,
+                self._names,
+                self._name_entities,
+                self._name_sizes,
+                self._entity_names,
+                self._postings,
+            )
+            total = records + sum(deep_sizeof(index, seen) for index in indexes)
+            count = len(self._entities)
+        return {
+            "entities": count,
+            "bytes": total,
+            "record_bytes": records,
+            "bytes_per_entity": total // count if count else 0,
+        }
+
+    def remove(self, entity_id: str) -> bool:
+        """Drop a device that no longer exists in Home Assistant."""
+        with self._lock:
+            if not self._remove(entity_id):
+                return False
+            self._generation += 1
+            return True
+
+    def clear(self):
+        self.rebuild([])
+
+    def get(self, text: str) -> Optional[EntityMatch]:
+        """Return the entity indexed under exactly `text`, ignoring case, spacing and leading articles."""
+        with self._lock:
+            return self._get(clean_entity_name(text))
+
+    def by_id(self, entity_id: str) -> Optional[EntityMatch]:
+        """Return the indexed entity with ID `entity_id`."""
+        with self._lock:
+            return self._match(entity_id, 1.0) if entity_id in self._entities else None
+
+    def resolve(
+        self, text: str, kinds: Optional[Iterable[str]] = None, threshold: Optional[float] = None
+    ) -> Optional[EntityMatch]:
+        """Return the entity whose name best matches `text`, or None if nothing is similar enough.
+
+        An exact name always matches. A similar name only matches an entity of one of `kinds`, when given,
+        and with a score of at least `threshold`, which defaults to the index's own.
+        """
+        query = clean_entity_name(text)
+        kinds = frozenset(kinds) if kinds is not None else None
+        threshold = min(max(self.threshold if threshold is None else threshold, 0.01), 1.0)
+        with self._lock:
+            match = self._get(query)
+            if match or not self._names or not query:
+                return match
+            return self._resolve(query, kinds, threshold)
+
+    def _get(self, name: str) -> Optional[EntityMatch]:
+        entity_id = self._exact.get(name)
+        return self._match(entity_id, 1.0) if entity_id else None
+
+    def _resolve(self, query: str, kinds: Optional[FrozenSet[str]], threshold: float) -> Optional[EntityMatch]:
+        grams = trigrams(query)
+        postings, names, sizes = self._postings, self._names, self._name_sizes
+        # A name needs at least this many trigrams in common with the query to reach the threshold,
+        # so any match must share one of the rarest (len(grams) - min_overlap + 1) query trigrams
+        min_overlap = max(ceil(threshold * len(grams) / (2 - threshold)), 1)
+        rarest = sorted(grams, key=lambda gram: len(postings.get(gram, ())))[: len(grams) - min_overlap + 1]
+        # Count how many of those trigrams each name shares, then only score the names sharing the most
+        hits = Counter()
+        for gram in rarest:
+            hits.update(postings.get(gram, ()))
+        best, best_key = None, (threshold, float("-inf"))
+        for candidate, _ in hits.most_common(MAX_CANDIDATES):
+            entity_id = self._name_entities[candidate]
+            if entity_id is None or (kinds is not None and not kinds & self._entities[entity_id].kinds):
+                continue
+            # A trigram is in a name's trigram set exactly when it is a substring of the padded name
+            padded = f" {names[candidate]} "
+            common = sum(1 for gram in grams if gram in padded)
+            # Dice coefficient; ties go to the shorter name
+            key = (2 * common / (len(grams) + sizes[candidate]), -sizes[candidate])
+            if key >= best_key:
+                best, best_key = candidate, key
+        if best is None:
+            return None
+        return self._match(self._name_entities[best], best_key[0])
+
+    @staticmethod
+    def _union(index: Dict[str, Set[str]], keys: Iterable[str]) -> Set[str]:
+        result = set()
+        for key in keys:
+            result |= index.get(key, set())
+        return result
+
+    def _named(self, text: str) -> Set[str]:
+        """Entities with `text` as consecutive whole words in one of their indexed names."""
+        words = text.split()
+        if not words:
+            return set(self._entities)
+        postings = sorted((self._by_word.get(word, set()) for word in words), key=len)
+        found = postings[0].intersection(*postings[1:])
+        if len(words) == 1:
+            return found
+        # Every word is there; check they are together and in order
+        padded = f" {text} "
+        return {
+            entity_id
+            for entity_id in found
+            if any(padded in f" {self._names[position]} " for position in self._entity_names[entity_id])
+        }
+
+    def _set_state(self, record: EntityRecord, state: Optional[str]) -> bool:
+        state = _intern(state.lower()) if state else None
+        if state == record.state:
+            return False
+        self._unindex(self._by_state, record.state, record.entity_id)
+        record.state = state
+        if state:
+            self._by_state.setdefault(state, set()).add(record.entity_id)
+        self._generation += 1
+        return True
+
+    @staticmethod
+    def _unindex(index: Dict[str, Set[str]], key: Optional[str], entity_id: str):
+        entities = index.get(key) if key else None
+        if entities is not None:
+            entities.discard(entity_id)
+            if not entities:
+                del index[key]
+
+    def _add_device(self, device: dict):
+        if device.get("id"):
+            self._add_record(EntityRecord.from_device(device))
+
+    def _add_record(self, record: EntityRecord):
+        entity_id, name, area = record.entity_id, record.name, record.area
+        self._entities[entity_id] = record
+        for kind in record.kinds:
+            self._by_kind.setdefault(kind, set()).add(entity_id)
+        if area:
+            self._by_area.setdefault(clean_entity_name(area), set()).add(entity_id)
+        if record.state:
+            self._by_state.setdefault(record.state, set()).add(entity_id)
+        self._add_name(name, entity_id)
+        self._add_name(entity_id.split(".", 1)[-1], entity_id)
+        if area:
+            self._add_name(f"{area} {name}", entity_id)
+        for alias, target in self._aliases.items():
+            if target == entity_id or clean_entity_name(target) == clean_entity_name(name):
+                self._add_name(alias, entity_id)
+
+    def _add_name(self, name: str, entity_id: str):
+        name = clean_entity_name(name)
+        if not name or name in self._exact:
+            return
+        position = len(self._names)
+        grams = trigrams(name)
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[sys.intern(gram)] = array("I")
+            posting.append(position)
+        self._names.append(name)
+        self._name_entities.append(entity_id)
+        self._name_sizes.append(min(len(grams), 0xFFFF))
+        self._entity_names.setdefault(entity_id, []).append(position)
+        self._exact[name] = entity_id
+        for word in name.split():
+            self._by_word.setdefault(word, set()).add(entity_id)
+
+    def _remove(self, entity_id: str) -> bool:
+        # Names stay in the trigram index as tombstones until the next rebuild
+        record = self._entities.pop(entity_id, None)
+        if record is None:
+            return False
+        for kind in record.kinds:
+            self._unindex(self._by_kind, kind, entity_id)
+        self._unindex(self._by_area, clean_entity_name(record.area) if record.area else None, entity_id)
+        self._unindex(self._by_state, record.state, entity_id)
+        for position in self._entity_names.pop(entity_id, ()):
+            self._name_entities[position] = None
+            for word in self._names[position].split():
+                self._unindex(self._by_word, word, entity_id)
+            if self._exact.get(self._names[position]) == entity_id:
+                del self._exact[self._names[position]]
+        return True
+
+    def _match(self, entity_id: str, score: float) -> EntityMatch:
+        record = self._entities[entity_id]
+        return EntityMatch(
+            entity_id=entity_id, name=record.name, type=record.type, area=record.area, score=score, state=record.state
+        )
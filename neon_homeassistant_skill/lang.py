@@ -0,0 +1,23 @@
+# pylint: disable=missing-module-docstring
+from functools import lru_cache
+from os import listdir
+from os.path import isdir, join
+from typing import Dict
+
+from ovos_utils.lang import standardize_lang_tag
+
+
+@lru_cache(maxsize=64)
+def normalize_lang(lang: str) -> str:
+    """Standardize a BCP-47 tag once per distinct tag; the lookup behind it is slow."""
+    return standardize_lang_tag(lang)
+
+
+def locale_directories(locale_dir: str) -> Dict[str, str]:
+    """Map each locale directory by lowercase tag, and by its primary subtag if that is unambiguous."""
+    if not isdir(locale_dir):
+        return {}
+    directories = {name.lower(): join(locale_dir, name) for name in listdir(locale_dir)}
+    for name, path in list(directories.items()):
+        directories.setdefault(name.split("-")[0], path)
+    return directories
@@ -0,0 +1,202 @@
+# pylint: disable=missing-module-docstring
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from random import random
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Optional
+from uuid import uuid4
+
+from ovos_bus_client import Message
+
+TRACE_ID_KEY = "homeassistant_trace_id"
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+# Durations recorded for each traced intent, as (stage, from mark, to mark)
+STAGES = (
+    ("skill", "intent", "request"),
+    ("phal", "request", "response"),
+    ("render", "dialog", "rendered"),
+    ("speech", "rendered", "spoken"),
+    ("total", "intent", "spoken"),
+)
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, cheap enough to update on every traced request."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """Return the upper bound of the bucket holding the `q` quantile (0-1), or the maximum if it overflowed."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0,
+            "p50_ms": round(self.percentile(0.5), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.max, 3),
+        }
+
+
+@dataclass
+class Trace:
+    """Timestamps of the stages one sampled intent went through."""
+
+    handler: str
+    marks: Dict[str, float] = field(default_factory=dict)
+    pending: int = 0
+
+
+class Metrics:
+    """Per-handler counters and stage latency histograms for intents and the PHAL requests they make.
+
+    Every intent is counted; a `sample_rate` fraction of them is traced. A traced intent carries a trace ID
+    in its message context, which requests, responses and speech forwarded from it keep, so each stage can
+    be timestamped with `mark`. A trace is finished once it has spoken and every request it sent has been
+    answered or timed out. Traces that never finish are dropped after `trace_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        max_traces: int = 1000,
+        trace_ttl: float = 60.0,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.sample_rate = sample_rate
+        self.max_traces = max_traces
+        self.trace_ttl = trace_ttl
+        self._clock = clock
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._counters: Dict[str, Counter] = {}
+        self._histograms: Dict[str, Dict[str, Histogram]] = {}
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self, message: Message, handler: str) -> Optional[str]:
+        """Count an intent and, if it is sampled, start tracing it. Returns the trace ID."""
+        with self._lock:
+            counters = self._counters.setdefault(handler, Counter())
+            counters["calls"] += 1
+            if not self.enabled or random() >= self.sample_rate:
+                return None
+            counters["sampled"] += 1
+            now = self._clock()
+            self._expire(now)
+            trace_id = uuid4().hex
+            self._traces[trace_id] = Trace(handler=handler, marks={"intent": now})
+        message.context[TRACE_ID_KEY] = trace_id
+        return trace_id
+
+    def traced(self, message: Optional[Message]) -> bool:
+        """Check whether `message` belongs to an open trace."""
+        trace_id = message.context.get(TRACE_ID_KEY) if message is not None else None
+        if not trace_id:
+            return False
+        with self._lock:
+            return trace_id in self._traces
+
+    def mark(self, message: Optional[Message], stage: str):
+        """Timestamp `stage` on the trace `message` belongs to, if any.
+
+        Stages are "request" and "response" or "timeout" for PHAL requests, then "dialog", "rendered"
+        and "spoken" for speech. Only the first "request" and the last "response" are kept.
+        """
+        trace_id = message.context.get(TRACE_ID_KEY) if message is not None else None
+        if not trace_id:
+            return
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                return
+            now = self._clock()
+            if stage == "request":
+                trace.pending += 1
+                trace.marks.setdefault("request", now)
+                return
+            if stage in ("response", "timeout"):
+                trace.pending -= 1
+                trace.marks["response"] = now
+                if stage == "timeout":
+                    self._counters[trace.handler]["timeouts"] += 1
+                return
+            trace.marks.setdefault(stage, now)
+            if stage == "spoken" and trace.pending <= 0:
+                del self._traces[trace_id]
+                self._finish(trace)
+
+    def snapshot(self) -> dict:
+        """Return counters and latency percentiles per handler and stage."""
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "open_traces": len(self._traces),
+                "handlers": {
+                    handler: {
+                        **counters,
+                        "stages": {
+                            stage: histogram.to_dict()
+                            for stage, histogram in self._histograms.get(handler, {}).items()
+                        },
+                    }
+                    for handler, counters in self._counters.items()
+                },
+            }
+
+    def summary(self) -> str:
+        """One line per traced handler with its total and PHAL latency, for the periodic stats log."""
+        lines = []
+        for handler, stats in sorted(self.snapshot()["handlers"].items()):
+            parts = [f"{handler}: {stats.get('calls', 0)} calls"]
+            for stage in ("total", "phal"):
+                histogram = stats["stages"].get(stage)
+                if histogram:
+                    parts.append(f"{stage} p50 {histogram['p50_ms']}ms p95 {histogram['p95_ms']}ms")
+            if stats.get("timeouts"):
+                parts.append(f"{stats['timeouts']} timeouts")
+            lines.append(", ".join(parts))
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._traces.clear()
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _finish(self, trace: Trace):
+        self._counters[trace.handler]["completed"] += 1
+        histograms = self._histograms.setdefault(trace.handler, {})
+        for stage, start, end in STAGES:
+            if start in trace.marks and end in trace.marks:
+                histograms.setdefault(stage, Histogram()).add((trace.marks[end] - trace.marks[start]) * 1000)
+
+    def _expire(self, now: float):
+        while self._traces:
+            trace_id, trace = next(iter(self._traces.items()))
+            if len(self._traces) < self.max_traces and now - trace.marks["intent"] <= self.trace_ttl:
+                return
+            del self._traces[trace_id]
+            self._counters[trace.handler]["abandoned"] += 1
@@ -0,0 +1,201 @@
+# pylint: disable=missing-module-docstring
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from os import replace
+from threading import Lock
+from time import time
+from typing import Callable, List, Optional, Tuple
+
+from ovos_bus_client import Message
+from ovos_utils.log import LOG
+
+from neon_homeassistant_skill.cache import normalize_entity_name
+
+# Commands that can be queued while Home Assistant is unreachable, by the part of the device state they set
+COMMAND_ASPECTS = {
+    "device.turn_on": "power",
+    "device.turn_off": "power",
+    "set.light.brightness": "brightness",
+    "increase.light.brightness": "brightness",
+    "decrease.light.brightness": "brightness",
+    "call.supported.function": "brightness",
+    "set.light.color": "color",
+}
+
+
+@dataclass
+class QueuedCommand:
+    """A command that Home Assistant did not confirm, to be sent again once it is reachable."""
+
+    request_type: str
+    data: dict
+    message: Message
+    queued_at: float
+    # ID of the request that timed out, in case its response still turns up
+    request_id: Optional[str] = None
+    # Replays of the command that went unanswered
+    attempts: int = 0
+
+    @property
+    def device(self) -> str:
+        return self.data.get("device") or self.data.get("device_id") or ""
+
+
+class OfflineQueue:
+    """Bounded queue of unconfirmed commands, persisted to `path` so it survives a restart.
+
+    Only the last intended state of each device is kept: a command replaces an earlier one that sets the
+    same part of the device state, turning a device off discards its other queued commands, and any other
+    command discards a queued turn off. Commands older than `ttl` seconds, counted from when they were first
+    queued, are dropped instead of replayed, and so are commands whose replay went unanswered `max_attempts`
+    times.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_size: int = 100,
+        ttl: float = 3600,
+        max_attempts: int = 3,
+        clock: Callable = time,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._commands: "OrderedDict[Tuple[str, str], QueuedCommand]" = OrderedDict()
+        self._lock = Lock()
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def add(
+        self,
+        request_type: str,
+        data: dict,
+        message: Message,
+        request_id: Optional[str] = None,
+        replayed: Optional[QueuedCommand] = None,
+    ) -> Optional[QueuedCommand]:
+        """Queue a command, replacing queued commands for the same device that it supersedes.
+
+        A command whose replay of `replayed` went unanswered keeps that command's age and counts the attempt.
+        It is dropped after `max_attempts`, or if a newer command for the device was queued in the meantime.
+        """
+        aspect = COMMAND_ASPECTS.get(request_type)
+        if aspect is None or self.max_size <= 0:
+            return None
+        attempts = replayed.attempts + 1 if replayed is not None else 0
+        if attempts >= self.max_attempts:
+            LOG.warning(f"Dropping {request_type} for {replayed.device} after {attempts} unanswered replays")
+            return None
+        command = QueuedCommand(
+            request_type=request_type,
+            data=dict(data),
+            message=replayed.message if replayed is not None else message,
+            queued_at=replayed.queued_at if replayed is not None else self._clock(),
+            request_id=request_id,
+            attempts=attempts,
+        )
+        entity = normalize_entity_name(command.device)
+        with self._lock:
+            superseded = [
+                key
+                for key, queued in self._commands.items()
+                if key[0] == entity
+                and (key[1] == aspect or request_type == "device.turn_off" or queued.request_type == "device.turn_off")
+            ]
+            if any(self._commands[key].queued_at > command.queued_at for key in superseded):
+                return None
+            for key in superseded:
+                del self._commands[key]
+            self._commands[(entity, aspect)] = command
+            while len(self._commands) > self.max_size:
+                dropped = self._commands.popitem(last=False)[1]
+                LOG.warning(f"Offline queue is full, dropping {dropped.request_type} for {dropped.device}")
+            self._save()
+        return command
+
+    def confirm(self, request_id: str) -> bool:
+        """Drop the command sent as `request_id`, whose response arrived after it was queued."""
+        with self._lock:
+            for key, command in self._commands.items():
+                if command.request_id == request_id:
+                    del self._commands[key]
+                    self._save()
+                    return True
+        return False
+
+    def drain(self) -> List[QueuedCommand]:
+        """Remove and return every queued command that is not too old to replay, oldest first."""
+        with self._lock:
+            commands = list(self._commands.values())
+            self._commands.clear()
+            self._save()
+        now = self._clock()
+        fresh = [command for command in commands if now - command.queued_at <= self.ttl]
+        if len(fresh) < len(commands):
+            LOG.info(f"Dropped {len(commands) - len(fresh)} queued commands older than {self.ttl} seconds")
+        return fresh
+
+    def clear(self):
+        with self._lock:
+            self._commands.clear()
+            self._save()
+
+    def load(self):
+        """Restore the queue saved at `path`, if any."""
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                saved = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            LOG.warning(f"Could not read offline command queue {self.path}: {e}")
+            return
+        with self._lock:
+            self._commands.clear()
+            for entry in saved.get("commands", []):
+                if entry.get("request_type") not in COMMAND_ASPECTS or "data" not in entry:
+                    continue
+                command = QueuedCommand(
+                    request_type=entry["request_type"],
+                    data=entry["data"],
+                    message=Message(entry.get("msg_type", "homeassistant.queued"), {}, entry.get("context", {})),
+                    queued_at=entry.get("queued_at", 0),
+                    request_id=entry.get("request_id"),
+                    attempts=entry.get("attempts", 0),
+                )
+                self._commands[(normalize_entity_name(command.device), COMMAND_ASPECTS[command.request_type])] = (
+                    command
+                )
+
+    def _save(self):
+        if not self.path:
+            return
+        saved = {
+            "commands": [
+                {
+                    "request_type": command.request_type,
+                    "data": command.data,
+                    "msg_type": command.message.msg_type,
+                    "context": command.message.context,
+                    "queued_at": command.queued_at,
+                    "request_id": command.request_id,
+                    "attempts": command.attempts,
+                }
+                for command in self._commands.values()
+            ]
+        }
+        try:
+            # Write aside and rename, so a crash mid-write never leaves a truncated queue behind
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(saved, file)
+            replace(f"{self.path}.tmp", self.path)
+        except (OSError, TypeError, ValueError) as e:
+            LOG.warning(f"Could not save offline command queue {self.path}: {e}")
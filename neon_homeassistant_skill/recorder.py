@@ -0,0 +1,139 @@
+# pylint: disable=missing-module-docstring
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from os import makedirs
+from os.path import dirname, getsize
+from threading import Lock
+from time import monotonic
+from typing import Callable, Iterator, List, Optional
+
+from ovos_bus_client import Message
+from ovos_utils.log import LOG
+
+from neon_homeassistant_skill.correlation import PHAL_NAMESPACE, REQUEST_ID_KEY
+
+# Bump when the line format changes, so replays can tell old recordings apart
+RECORDING_VERSION = 1
+# Recording stops once the file reaches this size
+MAX_RECORDING_BYTES = 50 * 1024 * 1024
+# Directions of recorded messages
+INTENT, REQUEST, RESPONSE = "intent", "out", "in"
+
+
+@dataclass
+class Record:
+    """One recorded message. `time` is seconds since the start of the recording."""
+
+    time: float
+    direction: str
+    msg_type: str
+    data: dict = field(default_factory=dict)
+    session_id: str = "default"
+    request_id: Optional[str] = None
+
+
+class TrafficRecorder:
+    """Append the PHAL plugin traffic of the skill, and the intents that caused it, to a JSON lines file.
+
+    Each line is one message: seconds since recording started, its direction (`intent`, `out` to the plugin
+    or `in` from it), its type without the plugin namespace, the session and request IDs, and its data.
+    Every time recording starts, a header line with the format version and wall clock time is appended
+    first, so one file can hold several recordings. The file holds device names and states, so it should be
+    treated like the Home Assistant logs.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = MAX_RECORDING_BYTES,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = Lock()
+        makedirs(dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        self._size = getsize(path)
+        self._start = clock()
+        self._write({"version": RECORDING_VERSION, "started": datetime.now(timezone.utc).isoformat()})
+
+    @property
+    def closed(self) -> bool:
+        return self._file is None
+
+    def record(self, direction: str, message: Message):
+        """Append `message`, sent or received in `direction`."""
+        if self._file is None:
+            return
+        msg_type = message.msg_type
+        if msg_type.startswith(PHAL_NAMESPACE):
+            msg_type = msg_type[len(PHAL_NAMESPACE) :]
+        elif direction == INTENT:
+            msg_type = msg_type.split(":", 1)[-1]
+        line = {"t": round(self._clock() - self._start, 4), "d": direction, "type": msg_type}
+        session_id = (message.context.get("session") or {}).get("session_id")
+        if session_id:
+            line["s"] = session_id
+        request_id = message.context.get(REQUEST_ID_KEY)
+        if request_id:
+            line["r"] = request_id
+        if message.data:
+            line["data"] = message.data
+        self._write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, line: dict):
+        try:
+            text = json.dumps(line, separators=(",", ":"), default=str) + "\n"
+        except (TypeError, ValueError) as e:
+            LOG.warning(f"Could not record {line.get('type')}: {e}")
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            if self._size + len(text) > self.max_bytes:
+                LOG.warning(f"Traffic recording {self.path} reached {self.max_bytes} bytes; stopping")
+                self._file.close()
+                self._file = None
+                return
+            self._file.write(text)
+            self._file.flush()
+            self._size += len(text)
+
+
+def read_recording(path: str) -> List[Record]:
+    """Load every record in a recording file, with later recordings in it placed after earlier ones."""
+    return list(_iter_records(path))
+
+
+def _iter_records(path: str) -> Iterator[Record]:
+    offset = last = 0.0
+    with open(path, encoding="utf-8") as file:
+        for number, text in enumerate(file, 1):
+            try:
+                line = json.loads(text)
+            except ValueError:
+                # A recording cut off mid-write leaves a partial last line
+                LOG.warning(f"Skipping unreadable line {number} of {path}")
+                continue
+            if "version" in line:
+                if line["version"] > RECORDING_VERSION:
+                    raise ValueError(f"{path} was recorded in a newer format ({line['version']})")
+                offset = last
+                continue
+            last = offset + line["t"]
+            yield Record(
+                time=last,
+                direction=line["d"],
+                msg_type=line["type"],
+                data=line.get("data") or {},
+                session_id=line.get("s", "default"),
+                request_id=line.get("r"),
+            )
@@ -0,0 +1,201 @@
+# pylint: disable=missing-module-docstring
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from ovos_bus_client import Message
+from ovos_utils.log import LOG
+
+from neon_homeassistant_skill.cache import normalize_entity_name
+
+# Actions a routine step can take, and the PHAL request each is sent as
+ROUTINE_ACTIONS = {
+    "turn_on": "device.turn_on",
+    "turn_off": "device.turn_off",
+    "brightness": "set.light.brightness",
+    "color": "set.light.color",
+}
+# Actions that need a value
+VALUE_ACTIONS = ("brightness", "color")
+
+
+@dataclass(frozen=True)
+class RoutineStep:
+    """One command of a routine, and the steps it waits for, by position."""
+
+    index: int
+    action: str
+    device: str
+    value: Optional[object] = None
+    after: Tuple[int, ...] = ()
+
+    @property
+    def request_type(self) -> str:
+        return ROUTINE_ACTIONS[self.action]
+
+
+class Routine:
+    """A named list of commands, compiled into a graph of which step waits for which.
+
+    A step waits for the steps listed in its `after`, by their 1-based position, and for the step before
+    it on the same device, so two commands for one light are never sent at once. Every other step is
+    independent and is sent together with the rest. Raises ValueError for a step that can't be run or
+    steps that wait for each other.
+    """
+
+    def __init__(self, name: str, steps: List[dict]):
+        self.name = name
+        if not isinstance(steps, list) or not steps:
+            raise ValueError(f"Routine {name} has no steps")
+        self.steps = [self._parse(name, index, step, len(steps)) for index, step in enumerate(steps)]
+        last_on_device: Dict[str, int] = {}
+        waits_for: List[set] = []
+        for step in self.steps:
+            after = set(step.after)
+            device = normalize_entity_name(step.device)
+            if device in last_on_device:
+                after.add(last_on_device[device])
+            last_on_device[device] = step.index
+            waits_for.append(after)
+        # Steps to check when each step finishes, and how many steps each one waits for
+        self.dependents: List[Tuple[int, ...]] = [
+            tuple(index for index, after in enumerate(waits_for) if step.index in after) for step in self.steps
+        ]
+        self.dependencies: Tuple[int, ...] = tuple(len(after) for after in waits_for)
+        self.roots: Tuple[int, ...] = tuple(index for index, count in enumerate(self.dependencies) if not count)
+        self.order: Tuple[int, ...] = self._sort(name)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def _sort(self, name: str) -> Tuple[int, ...]:
+        """Order the steps so each comes after the steps it waits for."""
+        remaining = list(self.dependencies)
+        ready = list(self.roots)
+        order = []
+        while ready:
+            index = ready.pop(0)
+            order.append(index)
+            for dependent in self.dependents[index]:
+                remaining[dependent] -= 1
+                if not remaining[dependent]:
+                    ready.append(dependent)
+        if len(order) != len(self.steps):
+            raise ValueError(f"Steps of routine {name} wait for each other")
+        return tuple(order)
+
+    @staticmethod
+    def _parse(name: str, index: int, step: dict, count: int) -> RoutineStep:
+        if not isinstance(step, dict):
+            raise ValueError(f"Step {index + 1} of routine {name} is not a command")
+        action, device, value = step.get("action"), step.get("device"), step.get("value")
+        if action not in ROUTINE_ACTIONS:
+            raise ValueError(f"Step {index + 1} of routine {name} has unknown action {action}")
+        if not device or not isinstance(device, str):
+            raise ValueError(f"Step {index + 1} of routine {name} has no device")
+        if action in VALUE_ACTIONS and value in (None, ""):
+            raise ValueError(f"Step {index + 1} of routine {name} has no {action}")
+        if action == "brightness":
+            try:
+                value = min(max(int(value), 0), 100)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Step {index + 1} of routine {name} has brightness {value}") from e
+        after = step.get("after") or []
+        after = [after] if isinstance(after, int) else after
+        if not isinstance(after, list) or any(
+            not isinstance(position, int) or not 0 < position <= count or position == index + 1 for position in after
+        ):
+            raise ValueError(f"Step {index + 1} of routine {name} waits for unknown steps {after}")
+        return RoutineStep(index, action, device, value, tuple(position - 1 for position in after))
+
+
+def compile_routines(routines: Dict[str, List[dict]]) -> Dict[str, Routine]:
+    """Compile the routines in settings by their normalized names, skipping any that can't be run."""
+    compiled = {}
+    for name, steps in (routines or {}).items():
+        try:
+            compiled[normalize_entity_name(name)] = Routine(name, steps)
+        except ValueError as e:
+            LOG.warning(f"Skipping routine: {e}")
+    return compiled
+
+
+@dataclass
+class RoutineRun:
+    """One run of a routine: which steps are still waiting, sent, or finished."""
+
+    run_id: str
+    routine: Routine
+    message: Message
+    # Steps each step still waits for; -1 once it has finished or been skipped
+    waiting: List[int]
+    succeeded: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    finished: int = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.finished == len(self.routine)
+
+    def finish(self, index: int, success: bool) -> List[RoutineStep]:
+        """Record a step's result and return the steps it was the last to hold up.
+
+        A failed step's dependents are not run, and are reported as failed with it.
+        """
+        if self.waiting[index] < 0:
+            return []
+        steps, ready, failed = self.routine.steps, [], [] if success else [index]
+        self.waiting[index] = -1
+        self.finished += 1
+        (self.succeeded if success else self.failed).append(steps[index].device)
+        for dependent in self.routine.dependents[index]:
+            self.waiting[dependent] -= 1
+            if not self.waiting[dependent] and success:
+                ready.append(steps[dependent])
+        while failed:
+            for dependent in self.routine.dependents[failed.pop()]:
+                if self.waiting[dependent] >= 0:
+                    self.waiting[dependent] = -1
+                    self.finished += 1
+                    self.failed.append(steps[dependent].device)
+                    failed.append(dependent)
+        return ready
+
+
+class RoutineRuns:
+    """Routines in progress, advanced as the results of their steps come in."""
+
+    def __init__(self):
+        self._runs: Dict[str, RoutineRun] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def start(self, routine: Routine, message: Message) -> RoutineRun:
+        """Start a run of `routine`; its first steps are `routine.roots`."""
+        run = RoutineRun(run_id=uuid4().hex, routine=routine, message=message, waiting=list(routine.dependencies))
+        with self._lock:
+            self._runs[run.run_id] = run
+        return run
+
+    def record(self, run_id: str, index: int, success: bool) -> Tuple[Optional[RoutineRun], List[RoutineStep], bool]:
+        """Record the result of step `index` of a run.
+
+        Returns the run, the steps now ready to send, and whether this was the run's last step to finish.
+        A finished run is forgotten, so it is reported as finished only once.
+        """
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return None, [], False
+            ready = run.finish(index, success)
+            if not run.complete:
+                return run, ready, False
+            del self._runs[run_id]
+            return run, ready, True
+
+    def clear(self):
+        with self._lock:
+            self._runs.clear()
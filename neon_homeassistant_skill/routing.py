@@ -0,0 +1,76 @@
+# pylint: disable=missing-module-docstring
+from collections import Counter
+from threading import Lock
+from typing import Callable, Dict, Optional
+
+from ovos_bus_client import Message
+from ovos_utils.log import LOG
+
+from neon_homeassistant_skill.correlation import PHAL_NAMESPACE
+
+
+class ResponseRouter:
+    """Dispatch messages from the PHAL plugin to skill handlers through one lookup table.
+
+    Routes are keyed by message type without the plugin's namespace, so several types can share a
+    handler and a new response type is one table entry. Every route is subscribed to the same
+    `dispatch` method; the bus already selects listeners by exact message type, so this avoids
+    inspecting unrelated messages while keeping a single place that counts and forwards them.
+    If set, `observer` is called with every routed message before its handler.
+    """
+
+    def __init__(
+        self, bus, routes: Optional[Dict[str, Callable[[Message], None]]] = None, namespace: str = PHAL_NAMESPACE
+    ):
+        self.bus = bus
+        self.namespace = namespace
+        self._routes: Dict[str, Callable[[Message], None]] = {}
+        self._counts: Counter = Counter()
+        self._attached = False
+        self._lock = Lock()
+        self.observer: Optional[Callable[[Message], None]] = None
+        for route, handler in (routes or {}).items():
+            self.add(route, handler)
+
+    def __contains__(self, route: str) -> bool:
+        return f"{self.namespace}{route}" in self._routes
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        """Messages dispatched per route since the router was created."""
+        with self._lock:
+            return {msg_type[len(self.namespace) :]: count for msg_type, count in self._counts.items()}
+
+    def add(self, route: str, handler: Callable[[Message], None]):
+        """Route `route` (a message type relative to the namespace) to `handler`."""
+        msg_type = f"{self.namespace}{route}"
+        if self._attached and msg_type not in self._routes:
+            self.bus.on(msg_type, self.dispatch)
+        self._routes[msg_type] = handler
+
+    def attach(self):
+        """Subscribe the dispatcher to every routed message type."""
+        if self._attached:
+            return
+        for msg_type in self._routes:
+            self.bus.on(msg_type, self.dispatch)
+        self._attached = True
+
+    def detach(self):
+        """Unsubscribe the dispatcher, so a shut down skill no longer receives plugin messages."""
+        if not self._attached:
+            return
+        for msg_type in self._routes:
+            self.bus.remove(msg_type, self.dispatch)
+        self._attached = False
+
+    def dispatch(self, message: Message):
+        handler = self._routes.get(message.msg_type)
+        if handler is None:
+            LOG.debug(f"No route for {message.msg_type}")
+            return
+        with self._lock:
+            self._counts[message.msg_type] += 1
+        if self.observer is not None:
+            self.observer(message)
+        handler(message)
@@ -0,0 +1,97 @@
+# pylint: disable=missing-module-docstring
+import json
+from datetime import datetime, timezone
+from os import makedirs, remove, replace
+from os.path import dirname
+from typing import Iterable, Iterator, List, Optional
+
+from ovos_utils.log import LOG
+
+# Bump when the line format changes; snapshots in a newer format are ignored rather than misread
+SNAPSHOT_VERSION = 1
+
+
+class EntitySnapshot:
+    """The entity index saved to `path`, so a restarted skill knows the home before the device list arrives.
+
+    The file is JSON lines: a header with the format version, save time and entity count, then one line
+    per entity with its name, type, area, kinds and last known state, as `EntityIndex.export` returns
+    them. Loading reads one line at a time, and a line that can't be read only loses that entity. A save
+    is written aside and renamed, so a crash mid-write leaves the previous snapshot in place.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        # Index generation last saved or loaded, so an unchanged index isn't written again
+        self.generation: Optional[int] = None
+
+    def save(self, entities: Iterable[dict], generation: Optional[int] = None) -> bool:
+        """Replace the snapshot with `entities`. Returns False if it could not be written."""
+        if not self.path:
+            return False
+        entities = list(entities)
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "saved": datetime.now(timezone.utc).isoformat(),
+            "entities": len(entities),
+        }
+        try:
+            makedirs(dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+                for line in [header, *entities]:
+                    file.write(json.dumps(line, separators=(",", ":")) + "\n")
+            replace(f"{self.path}.tmp", self.path)
+        except (OSError, TypeError, ValueError) as e:
+            LOG.warning(f"Could not save entity snapshot {self.path}: {e}")
+            return False
+        self.generation = generation
+        LOG.debug(f"Saved {len(entities)} entities to {self.path}")
+        return True
+
+    def load(self) -> List[dict]:
+        """Return the entities in the snapshot, or an empty list if there is none that can be read."""
+        entities = list(self._read())
+        if entities:
+            LOG.info(f"Loaded {len(entities)} entities from {self.path}")
+        return entities
+
+    def clear(self):
+        """Delete the snapshot. It is written again the next time the index is saved with changes."""
+        if not self.path:
+            return
+        try:
+            remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            LOG.warning(f"Could not delete entity snapshot {self.path}: {e}")
+
+    def _read(self) -> Iterator[dict]:
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                header = self._parse(file.readline())
+                if header is None or header.get("version") != SNAPSHOT_VERSION:
+                    LOG.warning(
+                        f"Ignoring entity snapshot {self.path} in unknown format {(header or {}).get('version')}"
+                    )
+                    return
+                for number, text in enumerate(file, 2):
+                    entity = self._parse(text)
+                    if entity is None or not entity.get("id"):
+                        LOG.warning(f"Skipping unreadable line {number} of {self.path}")
+                        continue
+                    yield entity
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            LOG.warning(f"Could not read entity snapshot {self.path}: {e}")
+
+    @staticmethod
+    def _parse(text: str) -> Optional[dict]:
+        try:
+            line = json.loads(text)
+        except ValueError:
+            return None
+        return line if isinstance(line, dict) else None
@@ -0,0 +1,215 @@
+# pylint: disable=missing-module-docstring
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import count
+from threading import Lock, Timer
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional
+
+from ovos_utils.log import LOG
+
+from neon_homeassistant_skill.cache import normalize_entity_name
+
+# Requests a full bucket allows at once, in seconds' worth of its rate
+BURST_SECONDS = 2
+# Per-device buckets kept before idle ones are forgotten
+MAX_DEVICE_BUCKETS = 1024
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average, and up to `capacity` at once."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    @property
+    def full(self) -> bool:
+        return self.tokens >= self.capacity
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is now."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+@dataclass
+class _Waiting:
+    device: str
+    request: Any
+    command: bool
+
+
+class CommandThrottle:
+    """Token buckets in front of requests to the PHAL plugin: one for all requests, one per device for commands.
+
+    A request is sent right away while its buckets have a token. Otherwise it waits in a backlog that is
+    sent in order as tokens refill, keeping each device's requests in order. A command that sets the same
+    thing on a device as one already waiting replaces it, so a repeated command is only sent once, and
+    `on_merged` is called with the replaced request. Once `max_backlog` requests are waiting, new ones are
+    passed to `on_shed` instead. A rate of 0 turns that limit off.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Any], None],
+        on_shed: Callable[[Any], None],
+        on_merged: Optional[Callable[[Any], None]] = None,
+        rate: float = 10.0,
+        entity_rate: float = 2.0,
+        max_backlog: int = 20,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.rate = rate
+        self.entity_rate = entity_rate
+        self.max_backlog = max_backlog
+        self._send = send
+        self._on_shed = on_shed
+        self._on_merged = on_merged
+        self._clock = clock
+        self._bucket: Optional[TokenBucket] = None
+        self._device_buckets: Dict[str, TokenBucket] = {}
+        self._backlog: "OrderedDict[Any, _Waiting]" = OrderedDict()
+        self._order = count()
+        self._timer: Optional[Timer] = None
+        self._due = 0.0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._backlog)
+
+    def configure(self, rate: float, entity_rate: float, max_backlog: int):
+        """Apply new limits; buckets are rebuilt on their next use."""
+        with self._lock:
+            if (rate, entity_rate) != (self.rate, self.entity_rate):
+                self._bucket = None
+                self._device_buckets.clear()
+            self.rate, self.entity_rate, self.max_backlog = rate, entity_rate, max_backlog
+
+    def submit(self, device: str, request: Any, aspect: Optional[str] = None) -> bool:
+        """Send `request` for `device` now or once the limits allow. Returns False if it was shed.
+
+        `aspect` is the part of the device state a command sets, such as "power"; requests without one
+        are counted against the overall limit only and are never merged.
+        """
+        device = normalize_entity_name(device)
+        command = aspect is not None
+        key = (device, aspect) if command else next(self._order)
+        replaced = None
+        with self._lock:
+            if key in self._backlog:
+                action = "merged"
+                replaced, self._backlog[key].request = self._backlog[key].request, request
+            elif not self._backlog and self._delay(device, command, self._clock()) == 0:
+                action = "send"
+                self._take(device, command)
+            elif len(self._backlog) >= self.max_backlog:
+                action = "shed"
+            else:
+                action = "wait"
+                self._backlog[key] = _Waiting(device, request, command)
+        if action == "merged":
+            LOG.debug(f"Merged waiting {aspect} command for {device}")
+            if self._on_merged is not None:
+                self._on_merged(replaced)
+        elif action == "send":
+            self._send(request)
+        elif action == "shed":
+            LOG.warning(f"Shedding request for {device}: {self.max_backlog} requests already waiting")
+            self._on_shed(request)
+            return False
+        else:
+            self.drain()
+        return True
+
+    def drain(self):
+        """Send every waiting request the limits allow now, and schedule the rest."""
+        with self._lock:
+            now = self._clock()
+            ready: List[Any] = []
+            blocked = set()
+            wait = None
+            for key, waiting in list(self._backlog.items()):
+                if waiting.device in blocked:
+                    continue
+                delay = self._delay(waiting.device, waiting.command, now)
+                if delay > 0:
+                    blocked.add(waiting.device)
+                    wait = delay if wait is None else min(wait, delay)
+                    if self._bucket is not None and self._bucket.tokens < 1:
+                        break
+                    continue
+                self._take(waiting.device, waiting.command)
+                del self._backlog[key]
+                ready.append(waiting.request)
+            if self._backlog and wait is not None:
+                self._schedule(now, wait)
+        for request in ready:
+            try:
+                self._send(request)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.exception(f"Error sending throttled request: {e}")
+
+    def clear(self) -> List[Any]:
+        """Drop every waiting request and return them."""
+        with self._lock:
+            waiting = [item.request for item in self._backlog.values()]
+            self._backlog.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return waiting
+
+    def _delay(self, device: str, command: bool, now: float) -> float:
+        """Seconds until both of a request's buckets have a token."""
+        delay = 0.0
+        if self.rate > 0:
+            if self._bucket is None:
+                self._bucket = TokenBucket(self.rate, max(1.0, self.rate * BURST_SECONDS), now)
+            delay = self._bucket.delay(now)
+        if command and self.entity_rate > 0:
+            bucket = self._device_buckets.get(device)
+            if bucket is None:
+                if len(self._device_buckets) >= MAX_DEVICE_BUCKETS:
+                    self._forget_idle(now)
+                bucket = self._device_buckets[device] = TokenBucket(
+                    self.entity_rate, max(1.0, self.entity_rate * BURST_SECONDS), now
+                )
+            delay = max(delay, bucket.delay(now))
+        return delay
+
+    def _take(self, device: str, command: bool):
+        if self._bucket is not None and self.rate > 0:
+            self._bucket.take()
+        if command and device in self._device_buckets:
+            self._device_buckets[device].take()
+
+    def _forget_idle(self, now: float):
+        for device, bucket in list(self._device_buckets.items()):
+            bucket.delay(now)
+            if bucket.full:
+                del self._device_buckets[device]
+
+    def _schedule(self, now: float, wait: float):
+        due = now + wait
+        if self._timer is not None and self._timer.is_alive() and self._due <= due:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._due = due
+        self._timer = Timer(wait, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        self.drain()
@@ -1,6 +1,31 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring,protected-access
+import pytest
+from mock import Mock, call, patch
+from ovos_bus_client import Message
 from ovos_utils.messagebus import FakeBus
+
 from neon_homeassistant_skill import NeonHomeAssistantSkill
+from neon_homeassistant_skill.correlation import REQUEST_ID_KEY
+
+
+@pytest.fixture(autouse=True)
+def shutdown_skills(monkeypatch, tmp_path):
+    """Stop each test's skills afterwards, so their unanswered requests can't time out during later tests.
+
+    The files they save, such as the offline queue and entity snapshot, go to a temporary directory.
+    """
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    skills = []
+    initialize = NeonHomeAssistantSkill.initialize
+
+    def track(skill):
+        skills.append(skill)
+        initialize(skill)
+
+    monkeypatch.setattr(NeonHomeAssistantSkill, "initialize", track)
+    yield
+    for skill in skills:
+        skill.shutdown()
 
 
 def test_default_enabled_state():
@@ -10,7 +35,6 @@ def test_default_enabled_state():
     assert skill._intents_enabled is True
 
 
-
 def test_intent_disable_setting():
     bus = FakeBus()
     skill = NeonHomeAssistantSkill(
@@ -28,6 +52,659 @@ def test_reenabling():
     assert skill.disable_intents is True
     assert not set(skill.connected_intents).issubset({intent[0] for intent in skill.intent_service.registered_intents})
     skill.settings["disable_intents"] = False
+    skill.settings_change_callback()
     assert skill.disable_intents is False
     assert skill._intents_enabled is True
     assert set(skill.connected_intents).issubset({intent[0] for intent in skill.intent_service.registered_intents})
+
+
+def test_responses_spoken_on_requesting_session():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    requests, spoken = [], []
+    bus.on("ovos.phal.plugin.homeassistant.device.turn_on", requests.append)
+    bus.on("speak", lambda message: spoken.append(message.context["session"]["session_id"]))
+    for session_id, entity in (("kitchen", "kettle"), ("bedroom", "lamp"), ("office", "fan")):
+        skill.handle_turn_on_intent(
+            Message("turn.on.intent", {"entity": entity}, {"session": {"session_id": session_id}})
+        )
+    assert len(skill._pending_requests) == 3
+    assert [request.session_id for request in skill._pending_requests.for_session("bedroom")] == ["bedroom"]
+    # Answer out of order, without the session in the response context
+    for request in reversed(requests):
+        response = request.response(data={"device": request.data["device"]})
+        response.context.pop("session")
+        bus.emit(response)
+    assert spoken == ["office", "bedroom", "kitchen"]
+    assert len(skill._pending_requests) == 0
+
+
+def test_settings_applied_on_change():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill.settings["silent_entities"] = ["freezer switch"]
+    skill.settings["disable_intents"] = True
+    # Settings are only re-read when the skill is told they changed
+    assert skill.silent_entities == frozenset()
+    assert skill._intents_enabled is True
+    skill.settings_change_callback()
+    assert skill.silent_entities == frozenset({"freezer switch"})
+    assert skill.disable_intents is True
+    assert skill._intents_enabled is False
+    skill.settings["silent_entities"] = []
+    skill.settings["disable_intents"] = False
+    skill.settings_change_callback()
+    assert skill._intents_enabled is True
+
+
+def test_intent_toggling_is_idempotent():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    detached, registered = [], []
+    bus.on("detach_intent", detached.append)
+    bus.on("padatious:register_intent", registered.append)
+    assert skill.enable_ha_intents() is True
+    assert registered == []
+    assert skill.disable_ha_intents() is True
+    assert len(detached) == len(skill.connected_intents)
+    assert skill.disable_ha_intents() is True
+    assert len(detached) == len(skill.connected_intents)
+    assert skill.enable_ha_intents() is True
+    assert {message.data["name"].split(":")[-1] for message in registered} == set(skill.connected_intents)
+    assert set(skill.connected_intents).issubset({intent[0] for intent in skill.intent_service.registered_intents})
+
+
+def test_bulk_commands_report_one_summary():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill.speak_dialog = Mock()
+    turned_off = []
+
+    def turn_off(message):
+        turned_off.append(message.data["device"])
+        bus.emit(message.response(data={"device": message.data["device"]} if message.data["device"] != "TV" else {}))
+
+    bus.on("ovos.phal.plugin.homeassistant.device.turn_off", turn_off)
+    skill.handle_turn_off_intent(Message("turn.off.intent", {"entity": "lamp, the fan and the TV"}))
+    assert turned_off == ["lamp", "fan", "TV"]
+    skill.speak_dialog.assert_called_once_with("bulk.turned.off.partial", data={"count": 2, "failed": "TV"})
+
+
+def test_area_command_resolves_devices():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill._offline_queue.clear()
+    skill.speak_dialog = Mock()
+    devices = [
+        {"id": "light.kitchen_ceiling", "name": "Kitchen Ceiling", "type": "light", "attributes": {}},
+        {"id": "switch.kitchen_kettle", "name": "Kitchen Kettle", "type": "switch", "attributes": {}},
+        {"id": "light.porch", "name": "Porch", "type": "light", "attributes": {"area": "kitchen"}},
+        {"id": "light.den", "name": "Den Lamp", "type": "light", "attributes": {}},
+        {"id": "sensor.kitchen_temperature", "name": "Kitchen Temperature", "type": "sensor", "attributes": {}},
+    ]
+    turned_on, fetched = [], []
+    bus.on("ovos.phal.plugin.homeassistant.get.devices", fetched.append)
+    bus.on("ovos.phal.plugin.homeassistant.get.devices", lambda m: bus.emit(m.response(data={"devices": devices})))
+    bus.on("ovos.phal.plugin.homeassistant.device.turn_on", lambda m: turned_on.append(m.data["device_id"]))
+    skill.handle_turn_on_area_intent(
+        Message("turn.on.area.intent", {"area": "kitchen", "utterance": "turn on all the lights in the kitchen"})
+    )
+    assert turned_on == ["light.kitchen_ceiling", "light.porch"]
+    skill._pending_requests.expire(now=float("inf"))
+    skill.speak_dialog.assert_called_once_with("bulk.failed", data={"failed": "Kitchen Ceiling and Porch"})
+    # Two unanswered commands aren't enough to take Home Assistant for unreachable, so they aren't queued either
+    assert skill._ha_available is True
+    assert len(skill._offline_queue) == 0
+    turned_on.clear()
+    skill.handle_turn_on_area_intent(
+        Message("turn.on.area.intent", {"area": "kitchen", "utterance": "turn on everything in the kitchen"})
+    )
+    assert turned_on == ["light.kitchen_ceiling", "switch.kitchen_kettle", "light.porch"]
+    # Once the device list has loaded, area members come from the entity index
+    assert len(fetched) == 1
+
+
+def test_aggregate_questions_answered_from_index():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill.speak_dialog = Mock()
+    devices = [
+        {"id": "light.kitchen_ceiling", "name": "Kitchen Ceiling", "type": "light", "state": "on", "attributes": {}},
+        {"id": "light.porch", "name": "Porch", "type": "light", "state": "on", "attributes": {"area": "kitchen"}},
+        {"id": "light.den", "name": "Den Lamp", "type": "light", "state": "off", "attributes": {}},
+        {
+            "id": "binary_sensor.back_window",
+            "name": "Back Window",
+            "type": "binary_sensor",
+            "state": "on",
+            "attributes": {"device_class": "window"},
+        },
+    ]
+    requests = []
+    bus.on("ovos.phal.plugin.homeassistant.get.devices", requests.append)
+    bus.on("ovos.phal.plugin.homeassistant.get.devices", lambda m: bus.emit(m.response(data={"devices": devices})))
+    bus.on("ovos.phal.plugin.homeassistant.device.turn_off", lambda m: bus.emit(m.response(data=m.data)))
+    # The first question fetches the device list, since none has arrived yet
+    skill.handle_list_devices_intent(Message("list.devices.intent", {"kind": "lights", "state": "on"}))
+    skill.speak_dialog.assert_called_once_with(
+        "devices.state.list",
+        data={"kind": "lights", "state": "on", "count": 2, "devices": "Kitchen Ceiling and Porch"},
+    )
+    assert len(requests) == 1
+    skill.speak_dialog.reset_mock()
+    skill.handle_count_devices_intent(Message("count.devices.intent", {"kind": "windows", "state": "open"}))
+    skill.speak_dialog.assert_called_once_with(
+        "devices.state.one", data={"kind": "windows", "state": "open", "device": "Back Window"}
+    )
+    skill.speak_dialog.reset_mock()
+    skill.handle_turn_off_intent(Message("turn.off.intent", {"entity": "porch"}))
+    skill.speak_dialog.reset_mock()
+    skill.handle_count_devices_intent(
+        Message("count.devices.intent", {"kind": "lights", "state": "on", "area": "kitchen"})
+    )
+    skill.speak_dialog.assert_called_once_with(
+        "devices.state.one.area",
+        data={"kind": "lights", "state": "on", "area": "kitchen", "device": "Kitchen Ceiling"},
+    )
+    skill.speak_dialog.reset_mock()
+    skill.handle_list_devices_intent(Message("list.devices.intent", {"kind": "doors", "state": "unlocked"}))
+    skill.speak_dialog.assert_called_once_with("devices.state.none", data={"kind": "doors", "state": "unlocked"})
+    # Answered locally, without asking Home Assistant again
+    assert len(requests) == 1
+    # A change the plugin signalled without its data is loaded in the background, answering from the index meanwhile
+    devices[2] = {**devices[2], "state": "on"}
+    bus.emit(Message("ovos.phal.plugin.homeassistant.device.state.updated"))
+    skill.speak_dialog.reset_mock()
+    skill.handle_count_devices_intent(Message("count.devices.intent", {"kind": "lights", "state": "on"}))
+    skill.speak_dialog.assert_called_once_with(
+        "devices.state.one", data={"kind": "lights", "state": "on", "device": "Kitchen Ceiling"}
+    )
+    assert len(requests) == 1
+    # Unless the device list is too old to trust, when it is fetched first
+    skill._devices_loaded_at -= skill.index_max_age + 1
+    skill.speak_dialog.reset_mock()
+    skill.handle_count_devices_intent(Message("count.devices.intent", {"kind": "lights", "state": "on"}))
+    skill.speak_dialog.assert_called_once_with(
+        "devices.state.count", data={"kind": "lights", "state": "on", "count": 3}
+    )
+    assert len(requests) == 2
+
+
+def test_restart_is_served_from_snapshot():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    devices = [
+        {"id": "light.porch", "name": "Porch", "type": "light", "state": "on", "attributes": {"area": "outside"}},
+        {"id": "switch.kettle", "name": "Kettle", "type": "switch", "state": "off", "attributes": {}},
+    ]
+    skill.handle_get_devices_response(Message("get.devices.response", {"devices": devices}))
+    skill.shutdown()
+
+    # After a restart, nothing answers until Home Assistant is back, but the home is already known
+    bus = FakeBus()
+    requests = []
+    bus.on("ovos.phal.plugin.homeassistant.get.devices", requests.append)
+    restarted = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    restarted.speak_dialog = Mock()
+    assert len(requests) == 1
+    assert restarted._entities.resolve("the porch").entity_id == "light.porch"
+    restarted.handle_list_devices_intent(Message("list.devices.intent", {"kind": "lights", "state": "on"}))
+    restarted.speak_dialog.assert_called_once_with(
+        "devices.state.one", data={"kind": "lights", "state": "on", "device": "Porch"}
+    )
+    assert len(requests) == 1
+    # The device list replaces the snapshot once it arrives
+    restarted.handle_get_devices_response(Message("get.devices.response", {"devices": devices[1:]}))
+    assert restarted._entities.by_id("light.porch") is None
+
+
+def test_rapid_brightness_adjustments_are_coalesced():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill._adjustments.window = 60
+    sent = []
+    bus.on("ovos.phal.plugin.homeassistant.call.supported.function", sent.append)
+    bus.on("ovos.phal.plugin.homeassistant.set.light.brightness", sent.append)
+    for _ in range(3):
+        skill.handle_increase_brightness_intent(Message("lights.increase.brightness.intent", {"entity": "lamp"}))
+    assert sent == []
+    skill._adjustments.flush("lamp")
+    assert len(sent) == 1
+    assert sent[0].data["function_args"] == {"brightness_step_pct": 30}
+    # With a known brightness the net change is sent as an absolute value
+    skill._state_cache.update("lamp", brightness=50)
+    skill.handle_decrease_brightness_intent(Message("lights.decrease.brightness.intent", {"entity": "lamp"}))
+    skill.handle_decrease_brightness_intent(Message("lights.decrease.brightness.intent", {"entity": "lamp"}))
+    skill._adjustments.flush("lamp")
+    assert sent[1].msg_type == "ovos.phal.plugin.homeassistant.set.light.brightness"
+    assert sent[1].data["brightness"] == 0.3 * 255
+
+
+def test_relative_brightness_computed_locally():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill._adjustments.window = 0
+    sent = []
+    bus.on("ovos.phal.plugin.homeassistant.call.supported.function", sent.append)
+    bus.on("ovos.phal.plugin.homeassistant.set.light.brightness", sent.append)
+    skill._state_cache.update("lamp", brightness=40)
+    skill.handle_increase_brightness_intent(
+        Message(
+            "lights.increase.brightness.intent", {"entity": "lamp", "amount": "twenty", "utterance": "brighten lamp"}
+        )
+    )
+    assert sent[-1].data["brightness"] == 0.6 * 255
+    for utterance, brightness in (("make the lamp a little dimmer", 35), ("make the lamp a lot dimmer", 10)):
+        skill._state_cache.update("lamp", brightness=40)
+        skill.handle_decrease_brightness_intent(
+            Message("lights.decrease.brightness.intent", {"entity": "lamp", "utterance": utterance})
+        )
+        assert sent[-1].data["brightness"] == brightness / 100 * 255
+    # Without a cached brightness, Home Assistant applies the step in a single service call
+    skill.handle_increase_brightness_intent(
+        Message("lights.increase.brightness.intent", {"entity": "lamp", "utterance": "make the lamp brighter"})
+    )
+    assert sent[-1].msg_type == "ovos.phal.plugin.homeassistant.call.supported.function"
+    assert sent[-1].data["function_args"] == {"brightness_step_pct": 10}
+    assert len(sent) == 4
+    # A call Home Assistant accepted without returning the changed states is acknowledged, not reported as failed
+    skill.speak_dialog = Mock()
+    bus.emit(sent[-1].response(data={"device": "lamp", "response": None}))
+    skill.speak_dialog.assert_called_once_with("acknowledge")
+
+
+def test_devices_are_resolved_locally():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill.speak_dialog = Mock()
+    sent = []
+    bus.on("ovos.phal.plugin.homeassistant.device.turn_on", sent.append)
+    bus.emit(
+        Message(
+            "ovos.phal.plugin.homeassistant.get.devices.response",
+            {
+                "devices": [
+                    {"id": "light.kitchen_lamp", "name": "Kitchen Lamp", "type": "light", "attributes": {}},
+                    {"id": "switch.kitchen_heater", "name": "Kitchen Heater", "type": "switch", "attributes": {}},
+                ]
+            },
+        )
+    )
+    skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": "the kitchen lamb"}))
+    assert sent[0].data == {"device": "Kitchen Lamp", "device_id": "light.kitchen_lamp"}
+    for entity in ("spaceship", "kitchen fan"):
+        skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": entity}))
+        skill.speak_dialog.assert_called_once_with("device.not.found", data={"device": entity})
+        skill.speak_dialog.reset_mock()
+    assert len(sent) == 1
+    skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": "kitchen lamp and spaceship"}))
+    assert len(sent) == 2
+    bus.emit(sent[1].response({"device": "Kitchen Lamp"}))
+    skill.speak_dialog.assert_called_once_with(
+        "bulk.turned.on.partial.one", data={"count": 1, "failed": "spaceship", "device": "Kitchen Lamp"}
+    )
+
+
+def test_state_changes_are_applied_incrementally():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill.speak_dialog = Mock()
+    requests = []
+    bus.on("ovos.phal.plugin.homeassistant.get.device", requests.append)
+    bus.emit(
+        Message(
+            "ovos.phal.plugin.homeassistant.get.devices.response",
+            {"devices": [{"id": "light.porch", "name": "Porch Light", "type": "light", "attributes": {}}]},
+        )
+    )
+    new_state = {"entity_id": "light.porch", "state": "on", "attributes": {"friendly_name": "Porch Light"}}
+    bus.emit(
+        Message(
+            "ovos.phal.plugin.homeassistant.device.state.updated",
+            {"event": {"event_type": "state_changed", "data": {"entity_id": "light.porch", "new_state": new_state}}},
+        )
+    )
+    skill.get_device_intent(Message("sensor.intent", {"entity": "porch light"}))
+    assert requests == []
+    skill.speak_dialog.assert_called_once_with(
+        "device.status", data={"device": "Porch Light", "type": "light", "state": "on"}
+    )
+    # A renamed device is found under its new name
+    new_state = {"entity_id": "light.porch", "state": "off", "attributes": {"friendly_name": "Front Door"}}
+    bus.emit(
+        Message(
+            "ovos.phal.plugin.homeassistant.device.state.updated",
+            {"entity_id": "light.porch", "new_state": new_state},
+        )
+    )
+    assert skill._entities.get("front door").entity_id == "light.porch"
+    assert skill._state_cache.get("front door")["state"] == "off"
+    # The plugin's own signal doesn't say what changed, so the device list is reloaded once for a burst of
+    # them, no sooner than stale_refresh_interval after the last reload, and cached states are kept
+    fetched = []
+    bus.on("ovos.phal.plugin.homeassistant.get.devices", fetched.append)
+    with patch.object(skill, "schedule_event") as schedule:
+        for _ in range(3):
+            bus.emit(Message("ovos.phal.plugin.homeassistant.device.state.updated"))
+    schedule.assert_called_once()
+    assert schedule.call_args.args[1] > skill.stale_refresh_interval - 5
+    assert skill._state_cache.get("front door")["state"] == "off"
+    assert skill._devices_stale and fetched == []
+    skill._refresh_stale_devices()
+    assert len(fetched) == 1
+    bus.emit(fetched[0].response({"devices": [{"id": "light.porch", "name": "Front Door", "type": "light"}]}))
+    assert not skill._devices_stale
+    bus.emit(
+        Message(
+            "ovos.phal.plugin.homeassistant.device.state.updated",
+            {"entity_id": "light.porch", "new_state": None},
+        )
+    )
+    assert len(skill._entities) == 0
+    # Home Assistant state_changed events relayed on another message are applied the same way
+    skill.settings["state_changed_message"] = "homeassistant.state_changed"
+    skill.settings_change_callback()
+    new_state = {"entity_id": "light.den", "state": "on", "attributes": {"friendly_name": "Den Lamp"}}
+    bus.emit(Message("homeassistant.state_changed", {"entity_id": "light.den", "new_state": new_state}))
+    assert skill._state_cache.get("den lamp")["state"] == "on"
+
+
+def test_colors_resolved_locally():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill._adjustments.window = 0
+    skill.speak_dialog = Mock()
+    sent = []
+    bus.on("ovos.phal.plugin.homeassistant.set.light.color", sent.append)
+    bus.on("ovos.phal.plugin.homeassistant.get.light.color", sent.append)
+    # An unknown color is turned down before anything is sent
+    skill.handle_set_color_intent(Message("lights.set.color.intent", {"entity": "lamp", "color": "spaceship"}))
+    skill.speak_dialog.assert_called_once_with("color.not.found", data={"color": "spaceship"})
+    assert sent == []
+    # A known one is sent by the CSS3 name the PHAL plugin parses, and a reported name is spoken as words
+    skill.handle_set_color_intent(Message("lights.set.color.intent", {"entity": "lamp", "color": "Dark Slate Gray"}))
+    assert sent[0].data == {"device": "lamp", "color": "darkslategray"}
+    skill.speak_dialog.reset_mock()
+    bus.emit(sent[0].response({"device": "lamp", "color": "darkslategray"}))
+    skill.speak_dialog.assert_called_once_with(
+        "lights.current.color", data={"color": "dark slate gray", "device": "lamp"}
+    )
+    # A reported value is spoken as the nearest color name, and kept for the next question
+    bus.emit(
+        Message(
+            "ovos.phal.plugin.homeassistant.get.light.color.response", {"device": "lamp", "rgb_color": [5, 250, 255]}
+        )
+    )
+    assert skill.speak_dialog.call_args == call("lights.current.color", data={"color": "cyan", "device": "lamp"})
+    skill.handle_get_color_intent(Message("lights.get.color.intent", {"entity": "lamp"}))
+    assert len(sent) == 1
+    assert skill.speak_dialog.call_args == call("lights.current.color", data={"color": "cyan", "device": "lamp"})
+    # So is a color the plugin reports as an RGB code because it has no CSS3 name
+    bus.emit(
+        Message(
+            "ovos.phal.plugin.homeassistant.get.light.color.response",
+            {"device": "lamp", "color": "RGB code 250, 5, 8"},
+        )
+    )
+    assert skill.speak_dialog.call_args == call("lights.current.color", data={"color": "red", "device": "lamp"})
+    # So is a color pushed with a state change
+    new_state = {
+        "entity_id": "light.lamp",
+        "state": "on",
+        "attributes": {"friendly_name": "Lamp", "hs_color": [0, 100]},
+    }
+    bus.emit(
+        Message(
+            "ovos.phal.plugin.homeassistant.device.state.updated", {"entity_id": "light.lamp", "new_state": new_state}
+        )
+    )
+    skill.handle_get_color_intent(Message("lights.get.color.intent", {"entity": "lamp"}))
+    assert skill.speak_dialog.call_args == call("lights.current.color", data={"color": "red", "device": "lamp"})
+    assert len(sent) == 1
+
+
+def test_routine_runs_independent_steps_together():
+    bus = FakeBus()
+    routines = {
+        "Movie Time": [
+            {"action": "brightness", "device": "living room lamp", "value": 20},
+            {"action": "turn_off", "device": "kitchen lights"},
+            {"action": "turn_on", "device": "tv"},
+            {"action": "turn_on", "device": "soundbar", "after": 3},
+        ],
+        "Night": [{"action": "turn_off", "device": "tv"}, {"action": "turn_off", "device": "porch"}],
+        "Reading": [
+            {"action": "color", "device": "living room lamp", "value": "warm white"},
+            {"action": "turn_on", "device": "tv"},
+        ],
+    }
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test", settings={"routines": routines})
+    skill.speak_dialog = Mock()
+    devices = [
+        {"id": "light.living_room_lamp", "name": "Living Room Lamp", "type": "light", "attributes": {}},
+        {"id": "light.kitchen", "name": "Kitchen Lights", "type": "light", "attributes": {}},
+        {"id": "media_player.tv", "name": "TV", "type": "media_player", "attributes": {}},
+        {"id": "media_player.soundbar", "name": "Soundbar", "type": "media_player", "attributes": {}},
+    ]
+    bus.emit(Message("ovos.phal.plugin.homeassistant.get.devices.response", {"devices": devices}))
+    sent = []
+    for request_type in ("device.turn_on", "device.turn_off", "set.light.brightness"):
+        bus.on(f"ovos.phal.plugin.homeassistant.{request_type}", sent.append)
+    skill.handle_run_routine_intent(Message("run.routine.intent", {"routine": "the movie time"}))
+    # Every step that waits for nothing is sent before any answer
+    assert [message.data["device"] for message in sent] == ["Living Room Lamp", "Kitchen Lights", "TV"]
+    assert sent[0].data["brightness"] == 0.2 * 255
+    for message in sent[:2]:
+        bus.emit(message.response({"device": message.data["device"]}))
+    assert len(sent) == 3
+    # The soundbar waits for the TV
+    bus.emit(sent[2].response({"device": "TV"}))
+    assert sent[3].data == {"device": "Soundbar", "device_id": "media_player.soundbar"}
+    skill.speak_dialog.assert_not_called()
+    bus.emit(sent[3].response({"device": "Soundbar"}))
+    skill.speak_dialog.assert_called_once_with("routine.done", data={"routine": "Movie Time"})
+    # A failed step's dependents are skipped, and the whole routine is reported once
+    skill.speak_dialog.reset_mock()
+    skill.handle_run_routine_intent(Message("run.routine.intent", {"routine": "movie time"}))
+    for message in sent[4:7]:
+        bus.emit(message.response({"device": message.data["device"]} if message.data["device"] != "TV" else {}))
+    assert len(sent) == 7
+    skill.speak_dialog.assert_called_once_with(
+        "routine.done.partial", data={"routine": "Movie Time", "failed": "tv and soundbar"}
+    )
+    skill.handle_run_routine_intent(Message("run.routine.intent", {"routine": "bedtime"}))
+    assert skill.speak_dialog.call_args == call("routine.not.found", data={"routine": "bedtime"})
+    # A routine naming a device Home Assistant doesn't have is not run
+    skill.handle_run_routine_intent(Message("run.routine.intent", {"routine": "night"}))
+    assert skill.speak_dialog.call_args == call(
+        "routine.unknown.devices", data={"routine": "Night", "devices": "porch"}
+    )
+    # Neither is one with a color the palette doesn't have
+    skill.handle_run_routine_intent(Message("run.routine.intent", {"routine": "reading"}))
+    assert skill.speak_dialog.call_args == call(
+        "routine.unknown.colors", data={"routine": "Reading", "colors": "warm white"}
+    )
+    assert len(sent) == 7
+    assert len(skill._pending_requests) == 0
+
+
+def test_traced_intent_stages():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill.settings["metrics_sample_rate"] = 1
+    skill.settings_change_callback()
+    requests = []
+    bus.on("ovos.phal.plugin.homeassistant.get.device", requests.append)
+    intent = Message("neon_homeassistant_skill.test:sensor.intent", {"entity": "porch light"})
+    bus.emit(intent)
+    bus.emit(requests[0].response({"name": "Porch Light", "type": "light", "state": "on", "attributes": {}}))
+    # The request is tagged on its own copy of the intent's context
+    assert REQUEST_ID_KEY in requests[0].context and REQUEST_ID_KEY not in intent.context
+    snapshots = []
+    bus.on("neon_homeassistant_skill.test.metrics.response", snapshots.append)
+    bus.emit(Message("neon_homeassistant_skill.test.metrics"))
+    stats = snapshots[0].data["handlers"]["sensor.intent"]
+    assert (stats["calls"], stats["completed"]) == (1, 1)
+    assert {"skill", "phal", "render", "speech", "total"} <= set(stats["stages"])
+    assert snapshots[0].data["routes"]["get.device.response"] == 1
+
+
+def test_commands_queued_while_offline_are_replayed():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill._offline_queue.clear()
+    skill.speak_dialog = Mock()
+    sent, online = [], []
+
+    def handle(message):
+        sent.append((message.msg_type.rsplit(".", 1)[-1], message.data["device"]))
+        if online:
+            bus.emit(message.response(data={"device": message.data["device"]}))
+
+    for request_type in ("device.turn_on", "device.turn_off", "set.light.brightness"):
+        bus.on(f"ovos.phal.plugin.homeassistant.{request_type}", handle)
+    skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": "porch light"}))
+    skill._pending_requests.expire(now=float("inf"))
+    # One unanswered command only prompts a probe; Home Assistant is unreachable once that goes unanswered too
+    skill.speak_dialog.assert_called_once_with("request.timeout", data={"device": "porch light"})
+    assert skill._ha_available is True
+    assert len(skill._offline_queue) == 0
+    skill._pending_requests.expire(now=float("inf"))
+    assert skill._ha_available is False
+    # Retries while Home Assistant is down are queued rather than sent, keeping only the last intent per device
+    skill.handle_turn_off_intent(Message("turn.off.intent", {"entity": "porch light"}))
+    skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": "porch light"}))
+    skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": "fan"}))
+    assert sent == [("turn_on", "porch light")]
+    assert len(skill._offline_queue) == 2
+    skill.speak_dialog.reset_mock()
+    sent.clear()
+    online.append(True)
+    bus.emit(Message("ovos.phal.plugin.homeassistant.ready"))
+    assert sent == [("turn_on", "porch light"), ("turn_on", "fan")]
+    assert skill._ha_available is True
+    assert len(skill._offline_queue) == 0
+    assert skill.speak_dialog.call_args_list == [
+        call("queue.replaying", data={"count": 2}),
+        call("queue.replayed", data={"count": 2}),
+    ]
+
+
+def test_unanswered_replays_are_dropped():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    skill.speak_dialog = Mock()
+    sent = []
+    # Home Assistant answers probes, but the porch light never answers
+    bus.on("ovos.phal.plugin.homeassistant.get.devices", lambda m: bus.emit(m.response(data={"devices": []})))
+    bus.on("ovos.phal.plugin.homeassistant.device.turn_on", lambda m: sent.append(m.data["device"]))
+    skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": "porch light"}))
+    skill._pending_requests.expire(now=float("inf"))
+    # Home Assistant is reachable, so the command isn't queued to be sent again
+    assert sent == ["porch light"]
+    assert len(skill._offline_queue) == 0
+    skill.speak_dialog.assert_called_once_with("request.timeout", data={"device": "porch light"})
+    # A command queued while Home Assistant was down is replayed once it is back, and dropped if that goes unanswered
+    skill._set_available(False)
+    skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": "porch light"}))
+    assert len(skill._offline_queue) == 1
+    bus.emit(Message("ovos.phal.plugin.homeassistant.ready"))
+    assert sent == ["porch light"] * 2
+    skill._pending_requests.expire(now=float("inf"))
+    assert len(skill._offline_queue) == 0
+    assert skill._ha_available is True
+    skill.speak_dialog.assert_called_with("bulk.failed", data={"failed": "porch light"})
+
+
+def test_optimistic_responses_are_corrected():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(
+        bus=bus, skill_id="neon_homeassistant_skill.test", settings={"optimistic_responses": True}
+    )
+    skill._offline_queue.clear()
+    skill._adjustments.window = 60
+    skill.speak_dialog = Mock()
+    devices = [
+        {"id": "light.porch", "name": "Porch Light", "type": "light", "attributes": {}},
+        {"id": "fan.den", "name": "Den Fan", "type": "fan", "attributes": {}},
+    ]
+    bus.on("ovos.phal.plugin.homeassistant.get.devices", lambda m: bus.emit(m.response(data={"devices": devices})))
+    skill._request_device_list()
+    responses = []
+    for request_type in ("device.turn_on", "device.turn_off", "set.light.brightness"):
+        bus.on(f"ovos.phal.plugin.homeassistant.{request_type}", responses.append)
+    # The expected result is spoken before Home Assistant answers, and a matching answer is not repeated
+    skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": "porch light"}))
+    skill.speak_dialog.assert_called_once_with("device.turned.on", data={"device": "Porch Light"})
+    bus.emit(responses[-1].response(data={"device": "Porch Light"}))
+    skill.speak_dialog.assert_called_once()
+    # A command that fails after all is corrected
+    skill.handle_turn_off_intent(Message("turn.off.intent", {"entity": "den fan"}))
+    bus.emit(responses[-1].response())
+    assert skill.speak_dialog.call_args_list[1:] == [
+        call("device.turned.off", data={"device": "Den Fan"}),
+        call("correction.failed", data={"device": "Den Fan"}),
+    ]
+    # So is a brightness that Home Assistant did not apply as announced
+    skill.speak_dialog.reset_mock()
+    skill.handle_set_brightness_intent(
+        Message("lights.set.brightness.intent", {"entity": "porch", "brightness": "50"})
+    )
+    skill._adjustments.flush("Porch Light")
+    bus.emit(responses[-1].response(data={"device": "Porch Light", "brightness": 40}))
+    assert skill.speak_dialog.call_args_list == [
+        call("lights.current.brightness", data={"brightness": 50, "device": "Porch Light"}),
+        call("correction.brightness", data={"device": "Porch Light", "brightness": 40}),
+    ]
+    # A brightness changed by a later adjustment in the same window is reported, not corrected
+    skill.speak_dialog.reset_mock()
+    skill.handle_set_brightness_intent(
+        Message("lights.set.brightness.intent", {"entity": "porch", "brightness": "50"})
+    )
+    skill.handle_increase_brightness_intent(Message("lights.increase.brightness.intent", {"entity": "porch"}))
+    skill._adjustments.flush("Porch Light")
+    assert responses[-1].data["brightness"] == skill._get_ha_value_from_percentage_brightness(60)
+    bus.emit(responses[-1].response(data={"device": "Porch Light", "brightness": 60}))
+    assert skill.speak_dialog.call_args_list == [
+        call("lights.current.brightness", data={"brightness": 50, "device": "Porch Light"}),
+        call("lights.current.brightness", data={"brightness": 60, "device": "Porch Light"}),
+    ]
+    assert len(skill._pending_requests) == 0
+
+
+def test_dialog_spoken_in_session_language():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.test")
+    spoken = []
+    bus.on("speak", spoken.append)
+    skill._state_cache.update("porch light", name="Porch Light", type="light", state="on")
+    skill.get_device_intent(
+        Message("sensor.intent", {"entity": "porch light"}, {"session": {"session_id": "porch", "lang": "en-US"}})
+    )
+    assert spoken[0].data["lang"] == "en-US"
+    assert "Porch Light" in spoken[0].data["utterance"]
+    assert spoken[0].data["meta"]["dialog"] == "device.status"
+    assert spoken[0].context["session"]["session_id"] == "porch"
+
+
+def test_command_flood_is_rate_limited():
+    bus = FakeBus()
+    skill = NeonHomeAssistantSkill(
+        bus=bus,
+        skill_id="neon_homeassistant_skill.test",
+        settings={"rate_limit": 1, "entity_rate_limit": 0, "rate_limit_backlog": 2},
+    )
+    skill.speak_dialog = Mock()
+    sent = []
+    bus.on("ovos.phal.plugin.homeassistant.device.turn_on", sent.append)
+    bus.on("ovos.phal.plugin.homeassistant.device.turn_off", sent.append)
+    for device in ("lamp", "fan", "kettle", "kettle", "heater", "radio"):
+        skill.handle_turn_on_intent(Message("turn.on.intent", {"entity": device}))
+    skill.handle_turn_off_intent(Message("turn.off.intent", {"entity": "kettle"}))
+    # Two go out at once, the kettle waits and its repeats merge, and the rest are dropped
+    assert [message.data["device"] for message in sent] == ["lamp", "fan"]
+    assert skill.speak_dialog.call_args_list == [
+        call("busy", data={"device": "radio"}),
+    ]
+    assert len(skill._throttle) == 2
+    skill._throttle.clear()
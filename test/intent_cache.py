@@ -0,0 +1,103 @@
+# pylint: disable=missing-module-docstring
+import pickle
+from glob import glob
+from hashlib import sha256
+from importlib.metadata import PackageNotFoundError, version
+from os import makedirs, remove, replace
+from os.path import basename, dirname, exists, isdir, join
+from typing import Callable, Dict, Iterable, List, TypeVar
+
+from ovos_utils.bracket_expansion import expand_template
+from ovos_utils.log import LOG
+
+LOCALE_DIR = join(dirname(dirname(__file__)), "neon_homeassistant_skill", "locale")
+# Bump when the format of cached values changes, so old caches are rebuilt
+CACHE_VERSION = 1
+
+T = TypeVar("T")
+
+
+def _library_version(name: str) -> str:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return "none"
+
+
+# Compiled matchers are pickled padacioso objects, which another padacioso release may not load or may
+# load with different behavior, so its version is part of every cache key
+PADACIOSO_VERSION = _library_version("padacioso")
+
+
+def fingerprint(paths: Iterable[str]) -> str:
+    """Hash the contents of `paths`, recursing into directories, so any edit to them changes the result."""
+    digest = sha256(f"v{CACHE_VERSION} padacioso {PADACIOSO_VERSION}".encode())
+    for path in paths:
+        files = sorted(glob(join(path, "**", "*"), recursive=True)) if isdir(path) else [path]
+        for file in files:
+            if isdir(file):
+                continue
+            digest.update(file[len(path) :].encode())
+            with open(file, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def expand_samples(templates: Iterable[str]) -> List[str]:
+    """Expand `(a|b|)` alternations in intent templates into every sample sentence they stand for."""
+    samples = {}
+    for template in templates:
+        template = template.strip()
+        if not template or template.startswith("#"):
+            continue
+        for sample in expand_template(template):
+            samples.setdefault(" ".join(sample.split()), None)
+    return list(samples)
+
+
+def load_intent_samples(lang: str, locale_dir: str = LOCALE_DIR) -> Dict[str, List[str]]:
+    """Return the expanded samples of every `.intent` file for `lang`, by file name."""
+    samples = {}
+    for path in sorted(glob(join(locale_dir, lang, "**", "*.intent"), recursive=True)):
+        with open(path, encoding="utf-8") as f:
+            samples[basename(path)] = expand_samples(f.read().splitlines())
+    return samples
+
+
+class IntentCache:
+    """On-disk cache of values derived from intent files, such as expanded samples or compiled matchers.
+
+    Each value is stored under its name and a hash of the files it was built from and the padacioso
+    version, so it is rebuilt only after one of them changes. Values are pickled; the cache directory
+    must only be writable by whoever runs the skill or tests.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def get(self, name: str, sources: Iterable[str], build: Callable[[], T]) -> T:
+        """Return the cached value of `name` if `sources` are unchanged, otherwise `build` and cache it."""
+        key = fingerprint(sources)[:16]
+        path = join(self.cache_dir, f"{name}.{key}.pickle")
+        if exists(path):
+            try:
+                with open(path, "rb") as f:
+                    return pickle.load(f)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning(f"Rebuilding unreadable intent cache {path}: {e}")
+        value = build()
+        self._save(name, path, value)
+        return value
+
+    def _save(self, name: str, path: str, value):
+        try:
+            makedirs(self.cache_dir, exist_ok=True)
+            with open(f"{path}.tmp", "wb") as f:
+                pickle.dump(value, f)
+            replace(f"{path}.tmp", path)
+            # Drop values built from earlier versions of the sources
+            for stale in glob(join(self.cache_dir, f"{name}.*.pickle")):
+                if stale != path:
+                    remove(stale)
+        except (OSError, pickle.PicklingError) as e:
+            LOG.warning(f"Could not save intent cache {path}: {e}")
@@ -0,0 +1,312 @@
+"""Offline benchmarks for NeonHomeAssistantSkill.
+
+Drives the skill through a FakeBus and a simulated ovos-PHAL-plugin-homeassistant, and measures:
+
+- latency from intent to spoken dialog for each handler (p50/p95/p99)
+- throughput with several sessions sending intents at once
+- startup time, the time to index the device list, and the time to compile the intents cold and from cache
+- the time to save the device index to a snapshot and to load it again, as a restarted skill does
+- the memory the device index holds per entity
+
+Run with `poe bench` or `python -m test.perf.bench`. Results are written as JSON to
+`test/perf/results/<version>.json`; pass `--compare <old.json>` to print the change against an earlier run.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+import argparse
+import json
+import platform
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from importlib.metadata import PackageNotFoundError, version
+from os import makedirs
+from os.path import dirname, join
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from test.intent_cache import LOCALE_DIR, IntentCache, load_intent_samples
+from test.perf.simulator import PHALSimulator, make_devices
+from test.utils import temporary_skill_data
+from threading import Event, Lock
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from ovos_bus_client import Message
+from ovos_utils.messagebus import FakeBus
+from padacioso import IntentContainer
+
+from neon_homeassistant_skill import NeonHomeAssistantSkill
+from neon_homeassistant_skill.entities import EntityIndex
+from neon_homeassistant_skill.snapshot import EntitySnapshot
+
+RESULTS_DIR = join(dirname(__file__), "results")
+
+
+class DialogWatcher:
+    """Records when each session last heard a dialog, so intents can be timed until they are answered."""
+
+    def __init__(self, bus: FakeBus):
+        self._events: Dict[str, Event] = {}
+        self._lock = Lock()
+        bus.on("speak", self._on_speak)
+
+    def expect(self, session_id: str) -> Event:
+        with self._lock:
+            event = self._events[session_id] = Event()
+        return event
+
+    def _on_speak(self, message: Message):
+        session_id = (message.context.get("session") or {}).get("session_id", "default")
+        with self._lock:
+            event = self._events.pop(session_id, None)
+        if event is not None:
+            event.set()
+
+
+def _intents(devices: List[dict]) -> Dict[str, tuple]:
+    """Intent name -> (handler name, message data) for each benchmarked handler."""
+    light = next(device for device in devices if device["type"] == "light")["name"]
+    switch = next(device for device in devices if device["type"] == "switch")["name"]
+    return {
+        "sensor.intent": ("get_device_intent", {"entity": light}),
+        "turn.on.intent": ("handle_turn_on_intent", {"entity": switch}),
+        "turn.off.intent": ("handle_turn_off_intent", {"entity": switch}),
+        "turn.off.intent (list)": ("handle_turn_off_intent", {"entity": f"{light} and {switch}"}),
+        "turn.off.area.intent": (
+            "handle_turn_off_area_intent",
+            {"area": "kitchen", "utterance": "turn off all the lights in the kitchen"},
+        ),
+        "lights.get.brightness.intent": ("handle_get_brightness_intent", {"entity": light}),
+        "lights.set.brightness.intent": ("handle_set_brightness_intent", {"entity": light, "brightness": "50"}),
+        "lights.increase.brightness.intent": ("handle_increase_brightness_intent", {"entity": light}),
+        "lights.get.color.intent": ("handle_get_color_intent", {"entity": light}),
+        "lights.set.color.intent": ("handle_set_color_intent", {"entity": light, "color": "red"}),
+    }
+
+
+def _percentiles(samples: List[float]) -> dict:
+    count, samples = len(samples), sorted(samples)
+    # quantiles() needs at least two samples
+    cuts = quantiles(samples * 2 if count < 2 else samples, n=100, method="inclusive")
+    return {
+        "count": count,
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def _message(intent: str, data: dict, session_id: str) -> Message:
+    return Message(intent, dict(data), {"session": {"session_id": session_id}})
+
+
+def _create_skill(entities: int, latency: float):
+    bus = FakeBus()
+    devices = make_devices(entities)
+    PHALSimulator(bus, devices, latency=latency)
+    start = perf_counter()
+    skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.bench")
+    startup = perf_counter() - start
+    # Send every adjustment right away, so brightness and color intents are timed like the others
+    skill.settings["coalesce_window"] = 0
+    # Time the skill itself rather than the rate limits in front of Home Assistant
+    skill.settings["rate_limit"] = 0
+    skill.settings["entity_rate_limit"] = 0
+    skill.settings_change_callback()
+    return bus, skill, devices, startup
+
+
+def _compile_intents(lang: str = "en-us") -> IntentContainer:
+    container = IntentContainer()
+    for name, samples in load_intent_samples(lang).items():
+        container.add_intent(name, samples)
+    return container
+
+
+def _time_intent_compile() -> tuple:
+    """Time expanding and compiling the locale's intents, then loading the same result from a warm cache."""
+    with TemporaryDirectory() as cache_dir:
+        cache = IntentCache(cache_dir)
+        start = perf_counter()
+        cache.get("intents.en-us", [LOCALE_DIR], _compile_intents)
+        cold = perf_counter() - start
+        start = perf_counter()
+        cache.get("intents.en-us", [LOCALE_DIR], _compile_intents)
+        return cold, perf_counter() - start
+
+
+def _time_snapshot(index: EntityIndex) -> tuple:
+    """Time saving the entity index to a snapshot, then rebuilding an index from it as a restarted skill does."""
+    with TemporaryDirectory() as snapshot_dir:
+        snapshot = EntitySnapshot(join(snapshot_dir, "entities.jsonl"))
+        start = perf_counter()
+        snapshot.save(index.export())
+        saved = perf_counter() - start
+        start = perf_counter()
+        EntityIndex().rebuild(snapshot.load())
+        return saved, perf_counter() - start
+
+
+def run_benchmarks(
+    entities: int = 1000, iterations: int = 200, sessions: int = 8, latency: float = 0.0, timeout: float = 10.0
+) -> dict:
+    """Run every benchmark and return the results as a JSON-serializable dict."""
+    intents_cold, intents_cached = _time_intent_compile()
+    # A fresh skill data directory for every run, so startup is cold and times stay comparable
+    with temporary_skill_data():
+        bus, skill, devices, startup = _create_skill(entities, latency)
+        try:
+            watcher = DialogWatcher(bus)
+            start = perf_counter()
+            skill._entities.rebuild(devices)
+            index_time = perf_counter() - start
+            snapshot_save, snapshot_load = _time_snapshot(skill._entities)
+            memory = skill._entities.footprint()
+
+            handlers = {}
+            for intent, (handler, data) in _intents(devices).items():
+                samples = []
+                for i in range(iterations):
+                    # Each status query should reach the plugin rather than the state cache
+                    skill._state_cache.clear()
+                    session_id = f"{intent}-{i}"
+                    answered = watcher.expect(session_id)
+                    start = perf_counter()
+                    getattr(skill, handler)(_message(intent, data, session_id))
+                    if not answered.wait(timeout):
+                        raise TimeoutError(f"No dialog for {intent}")
+                    samples.append(perf_counter() - start)
+                handlers[intent] = _percentiles(samples)
+
+            throughput = _run_concurrent(skill, watcher, devices, iterations, sessions, timeout)
+        finally:
+            skill.shutdown()
+    return {
+        "version": _version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"entities": entities, "iterations": iterations, "sessions": sessions, "latency": latency},
+        "startup": {
+            "skill_ms": round(startup * 1000, 3),
+            "index_ms": round(index_time * 1000, 3),
+            "snapshot_save_ms": round(snapshot_save * 1000, 3),
+            "snapshot_load_ms": round(snapshot_load * 1000, 3),
+            "intents_ms": round(intents_cold * 1000, 3),
+            "intents_cached_ms": round(intents_cached * 1000, 3),
+        },
+        "memory": memory,
+        "handlers": handlers,
+        "throughput": throughput,
+    }
+
+
+def _run_concurrent(
+    skill: NeonHomeAssistantSkill, watcher: DialogWatcher, devices: List[dict], iterations: int, sessions: int, timeout
+) -> dict:
+    """Send status and turn on/off intents from `sessions` sessions at once and count answers per second."""
+    intents = [(name, *_intents(devices)[name]) for name in ("sensor.intent", "turn.on.intent", "turn.off.intent")]
+
+    def session(number: int) -> List[float]:
+        samples = []
+        for i in range(iterations):
+            intent, handler, data = intents[i % len(intents)]
+            session_id = f"session-{number}"
+            answered = watcher.expect(session_id)
+            start = perf_counter()
+            getattr(skill, handler)(_message(intent, data, session_id))
+            if not answered.wait(timeout):
+                raise TimeoutError(f"No dialog for {intent} on {session_id}")
+            samples.append(perf_counter() - start)
+        return samples
+
+    skill._state_cache.clear()
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        samples = [sample for result in executor.map(session, range(sessions)) for sample in result]
+    elapsed = perf_counter() - start
+    return {
+        "sessions": sessions,
+        "requests": len(samples),
+        "per_second": round(len(samples) / elapsed, 1),
+        **_percentiles(samples),
+    }
+
+
+def compare(old: dict, new: dict) -> List[str]:
+    """Describe the change in latency and throughput between two result files."""
+    lines = [f"{old.get('version')} -> {new.get('version')}"]
+    for intent, stats in new["handlers"].items():
+        before = old.get("handlers", {}).get(intent)
+        if not before:
+            lines.append(f"{intent}: new")
+            continue
+        changes = ", ".join(f"{key} {_change(before[key], stats[key])}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        lines.append(f"{intent}: {changes}")
+    if old.get("throughput"):
+        lines.append(
+            f"throughput: {_change(old['throughput']['per_second'], new['throughput']['per_second'])} per second"
+        )
+    lines.append(f"startup: {_change(old['startup']['skill_ms'], new['startup']['skill_ms'])}")
+    if old.get("memory"):
+        lines.append(
+            f"memory: {_change(old['memory']['bytes_per_entity'], new['memory']['bytes_per_entity'])} bytes per entity"
+        )
+    return lines
+
+
+def _change(before: float, after: float) -> str:
+    if not before:
+        return f"{after}"
+    return f"{before} -> {after} ({(after - before) / before * 100:+.1f}%)"
+
+
+def _version() -> str:
+    try:
+        return version("neon-homeassistant-skill")
+    except PackageNotFoundError:
+        return "dev"
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entities", type=int, default=1000, help="devices reported by the simulated plugin")
+    parser.add_argument("--iterations", type=int, default=200, help="intents timed per handler and session")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions for the throughput run")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the simulated plugin waits to answer")
+    parser.add_argument("--output", help="result file, defaults to test/perf/results/<version>.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.entities, args.iterations, args.sessions, args.latency)
+    output = args.output or join(RESULTS_DIR, f"{results['version']}.json")
+    makedirs(dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    for intent, stats in results["handlers"].items():
+        print(
+            f"{intent:36} p50 {stats['p50_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms"
+        )
+    print(f"throughput: {results['throughput']['per_second']} intents/s over {args.sessions} sessions")
+    print(
+        f"startup: {results['startup']['skill_ms']} ms, indexing {args.entities} devices: "
+        f"{results['startup']['index_ms']} ms"
+    )
+    print(
+        f"intent compile: {results['startup']['intents_ms']} ms, "
+        f"from cache: {results['startup']['intents_cached_ms']} ms"
+    )
+    print(f"device index: {results['memory']['bytes_per_entity']} bytes per entity")
+    print(
+        f"snapshot save: {results['startup']['snapshot_save_ms']} ms, "
+        f"load: {results['startup']['snapshot_load_ms']} ms"
+    )
+    print(f"results written to {output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            print("\n".join(compare(json.load(file), results)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
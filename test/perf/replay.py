@@ -0,0 +1,244 @@
+"""Replay recorded Home Assistant traffic into NeonHomeAssistantSkill.
+
+Plays the intents from a recording made with the `record_traffic` setting back into the skill on a FakeBus,
+with a stand-in for ovos-PHAL-plugin-homeassistant that answers each request with the response recorded for
+the same request type and device, after the same delay. Device state events are sent at their recorded time.
+The recording can be played at real speed, faster, or with no delays at all, and multiplied across several
+simulated sessions. Reports latency from intent to first spoken dialog and everything the skill said.
+
+Run with `python -m test.perf.replay <traffic.jsonl>`; see `--help` for options.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+import argparse
+import json
+import sys
+from collections import Counter, defaultdict, deque
+from dataclasses import asdict, dataclass
+from test.perf.bench import _percentiles
+from test.utils import temporary_skill_data
+from threading import Event, Lock, Timer
+from time import perf_counter, sleep
+from typing import Deque, Dict, List, Optional, Tuple
+
+from ovos_bus_client import Message
+from ovos_utils.messagebus import FakeBus
+
+from neon_homeassistant_skill import NeonHomeAssistantSkill
+from neon_homeassistant_skill.correlation import PHAL_NAMESPACE
+from neon_homeassistant_skill.recorder import (
+    INTENT,
+    REQUEST,
+    RESPONSE,
+    Record,
+    read_recording,
+)
+
+RESPONSE_SUFFIX = ".response"
+
+
+def _device_key(data: dict) -> Optional[str]:
+    return data.get("device_id") or data.get("device")
+
+
+class RecordedPHAL:
+    """Stand-in for the PHAL plugin that answers requests with the responses from a recording.
+
+    Responses are looked up by request type and device and handed out in recorded order, starting over
+    once they run out. A request that went unanswered in the recording goes unanswered here too, so
+    timeouts replay as well.
+    """
+
+    def __init__(self, bus: FakeBus, records: List[Record], speed: float = 1.0):
+        self.bus = bus
+        self.speed = speed
+        self._answers: Dict[Tuple[str, Optional[str]], List[Tuple[float, Optional[dict]]]] = defaultdict(list)
+        self._next: Counter = Counter()
+        self._lock = Lock()
+        responses = {record.request_id: record for record in records if record.direction == RESPONSE}
+        # Requests the skill doesn't track, such as get.devices, are paired with the next response of their type
+        untracked: Dict[str, Deque[Record]] = defaultdict(deque)
+        for record in records:
+            if record.direction == RESPONSE and record.msg_type.endswith(RESPONSE_SUFFIX) and not record.request_id:
+                untracked[record.msg_type[: -len(RESPONSE_SUFFIX)]].append(record)
+        for record in records:
+            if record.direction != REQUEST:
+                continue
+            if record.request_id:
+                response = responses.get(record.request_id)
+            else:
+                pending = untracked[record.msg_type]
+                while pending and pending[0].time < record.time:
+                    pending.popleft()
+                response = pending.popleft() if pending else None
+            self._answers[(record.msg_type, _device_key(record.data))].append(
+                (response.time - record.time, response.data) if response is not None else (0.0, None)
+            )
+        for request_type in {request_type for request_type, _ in self._answers}:
+            bus.on(f"{PHAL_NAMESPACE}{request_type}", self._respond)
+
+    def _respond(self, message: Message):
+        request_type = message.msg_type[len(PHAL_NAMESPACE) :]
+        key = (request_type, _device_key(message.data))
+        with self._lock:
+            answers = self._answers.get(key)
+            if not answers:
+                return
+            delay, data = answers[self._next[key] % len(answers)]
+            self._next[key] += 1
+        if data is None:
+            return
+        response = message.response(data)
+        if self.speed and delay > 0:
+            Timer(delay / self.speed, self.bus.emit, (response,)).start()
+        else:
+            self.bus.emit(response)
+
+
+@dataclass
+class Spoken:
+    session_id: str
+    intent: Optional[str]
+    dialog: Optional[str]
+    utterance: str
+    latency_ms: Optional[float] = None
+
+
+@dataclass
+class _Outstanding:
+    intent: str
+    sent: float
+
+
+class SpeechLog:
+    """Matches spoken dialog to the intent that is waiting for an answer on the same session."""
+
+    def __init__(self):
+        self.spoken: List[Spoken] = []
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self._waiting: Dict[str, Deque[_Outstanding]] = defaultdict(deque)
+        self._last: Dict[str, _Outstanding] = {}
+        self._lock = Lock()
+        self._idle = Event()
+
+    def sent(self, session_id: str, intent: str):
+        with self._lock:
+            self._waiting[session_id].append(_Outstanding(intent, perf_counter()))
+            self._idle.clear()
+
+    def on_speak(self, message: Message):
+        now = perf_counter()
+        session_id = (message.context.get("session") or {}).get("session_id", "default")
+        meta = message.data.get("meta") or {}
+        with self._lock:
+            waiting = self._waiting.get(session_id)
+            latency = None
+            if waiting:
+                outstanding = self._last[session_id] = waiting.popleft()
+                latency = now - outstanding.sent
+                self.latencies[outstanding.intent].append(latency)
+            outstanding = self._last.get(session_id)
+            self.spoken.append(
+                Spoken(
+                    session_id=session_id,
+                    intent=outstanding.intent if outstanding else None,
+                    dialog=meta.get("dialog"),
+                    utterance=message.data.get("utterance", ""),
+                    latency_ms=round(latency * 1000, 3) if latency is not None else None,
+                )
+            )
+            if not any(self._waiting.values()):
+                self._idle.set()
+
+    def wait(self, timeout: float) -> int:
+        """Wait until every intent has been answered; returns how many were not."""
+        with self._lock:
+            if not any(self._waiting.values()):
+                return 0
+        self._idle.wait(timeout)
+        with self._lock:
+            return sum(len(waiting) for waiting in self._waiting.values())
+
+
+def replay(records: List[Record], speed: float = 1.0, sessions: int = 1, timeout: float = 10.0) -> dict:
+    """Play `records` into a new skill and return latency and dialog statistics.
+
+    `speed` divides every recorded delay; 0 plays the recording with no delays at all. Each intent is sent
+    once for each of `sessions` simulated sessions; device state events are sent once.
+    """
+    bus = FakeBus()
+    RecordedPHAL(bus, records, speed)
+    log = SpeechLog()
+    bus.on("speak", log.on_speak)
+    with temporary_skill_data():
+        skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.replay")
+        events = [record for record in records if record.direction == INTENT or _is_event(record)]
+        start = perf_counter()
+        try:
+            for record in events:
+                if speed:
+                    delay = start + record.time / speed - perf_counter()
+                    if delay > 0:
+                        sleep(delay)
+                if record.direction == RESPONSE:
+                    bus.emit(Message(f"{PHAL_NAMESPACE}{record.msg_type}", dict(record.data)))
+                    continue
+                for number in range(sessions):
+                    session_id = f"{record.session_id}-{number}" if sessions > 1 else record.session_id
+                    log.sent(session_id, record.msg_type)
+                    bus.emit(
+                        Message(
+                            f"{skill.skill_id}:{record.msg_type}",
+                            dict(record.data),
+                            {"session": {"session_id": session_id}},
+                        )
+                    )
+            unanswered = log.wait(timeout)
+            elapsed = perf_counter() - start
+        finally:
+            skill.shutdown()
+    intents = sum(1 for record in events if record.direction == INTENT) * sessions
+    return {
+        "config": {"speed": speed, "sessions": sessions},
+        "intents": intents,
+        "unanswered": unanswered,
+        "elapsed_s": round(elapsed, 3),
+        "latency": {intent: _percentiles(samples) for intent, samples in sorted(log.latencies.items())},
+        "dialogs": dict(Counter(spoken.dialog or "(plain)" for spoken in log.spoken)),
+        "spoken": [asdict(spoken) for spoken in log.spoken],
+    }
+
+
+def _is_event(record: Record) -> bool:
+    """Messages the plugin sends on its own, such as state changes, rather than in answer to a request."""
+    return record.direction == RESPONSE and not record.msg_type.endswith(RESPONSE_SUFFIX)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recording", help="traffic.jsonl written by the record_traffic setting")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed; 0 plays without delays")
+    parser.add_argument("--sessions", type=int, default=1, help="simulated sessions each intent is sent from")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for the last answers")
+    parser.add_argument("--output", help="file to write the full report to as JSON")
+    args = parser.parse_args(argv)
+
+    results = replay(read_recording(args.recording), args.speed, args.sessions, args.timeout)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    for intent, stats in results["latency"].items():
+        print(
+            f"{intent:36} n {stats['count']:5}  p50 {stats['p50_ms']:8.3f} ms  "
+            f"p95 {stats['p95_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms"
+        )
+    for dialog, count in sorted(results["dialogs"].items(), key=lambda item: -item[1]):
+        print(f"{dialog:36} spoken {count} times")
+    print(
+        f"{results['intents']} intents in {results['elapsed_s']} s over {args.sessions} sessions, "
+        f"{results['unanswered']} unanswered"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
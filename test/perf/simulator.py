@@ -0,0 +1,299 @@
+"""Offline stand-in for ovos-PHAL-plugin-homeassistant, serving a synthetic Home Assistant installation.
+
+`PHALSimulator` answers every message type NeonHomeAssistantSkill sends on a FakeBus, with responses shaped
+like the plugin's. Commands change the simulated devices and are pushed back as `device.state.updated`
+signals, which carry no data unless `rich_updates` is set; `churn` changes devices behind the skill's back. Latency, jitter and the share of requests that fail
+or go unanswered are configurable, so caches, concurrency and error paths can be exercised at the size of a
+real installation without a network or Home Assistant.
+"""
+
+# pylint: disable=missing-function-docstring
+import heapq
+import itertools
+from collections import Counter
+from copy import deepcopy
+from os.path import dirname, join
+from random import Random
+from threading import Condition, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ovos_bus_client import Message
+from ovos_utils.messagebus import FakeBus
+
+import neon_homeassistant_skill
+from neon_homeassistant_skill.colors import ColorNames, color_key
+from neon_homeassistant_skill.correlation import PHAL_NAMESPACE
+
+AREAS = ("kitchen", "living room", "bedroom", "office", "garage", "porch", "basement", "hallway", "bathroom")
+KINDS = ("lamp", "light", "ceiling light", "fan", "switch", "heater", "speaker", "outlet")
+LIGHT_KINDS = ("lamp", "light", "ceiling light")
+# The plugin parses CSS3 color names, which are the names in the skill's English color list
+CSS3_COLORS = ColorNames(join(dirname(neon_homeassistant_skill.__file__), "locale")).palette("en-us")
+RED = list(CSS3_COLORS.rgb("red"))
+HOST = "http://homeassistant.local:8123"
+
+
+def area_names(count: int) -> List[str]:
+    """`count` distinct area names, numbering them once the common room names run out."""
+    return [AREAS[i] if i < len(AREAS) else f"room {i + 1}" for i in range(count)]
+
+
+def make_devices(count: int, areas: int = len(AREAS)) -> List[dict]:
+    """Build a device list shaped like the PHAL plugin's `get.devices` response, spread evenly over `areas`."""
+    names = area_names(areas)
+    devices = []
+    for i in range(count):
+        kind = KINDS[i // len(names) % len(KINDS)]
+        area = names[i % len(names)]
+        name = f"{area} {kind} {i}".title()
+        device_type = "light" if kind in LIGHT_KINDS else "switch"
+        devices.append(
+            {
+                "id": f"{device_type}.{name.lower().replace(' ', '_')}",
+                "name": name,
+                "state": "off",
+                "type": device_type,
+                "area": area,
+                "attributes": {"friendly_name": name, "brightness": 128, "rgb_color": RED},
+                "host": HOST,
+            }
+        )
+    return devices
+
+
+class _Scheduler:
+    """Sends delayed responses from one thread, in order of their due time."""
+
+    def __init__(self):
+        self._queue: List[Tuple[float, int, Callable[[], None]]] = []
+        self._order = itertools.count()
+        self._condition = Condition()
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True, name="PHALSimulator")
+        self._thread.start()
+
+    def call_later(self, delay: float, callback: Callable[[], None]):
+        with self._condition:
+            heapq.heappush(self._queue, (monotonic() + delay, next(self._order), callback))
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._queue.clear()
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._queue or self._queue[0][0] > monotonic()):
+                    self._condition.wait(self._queue[0][0] - monotonic() if self._queue else None)
+                if not self._running:
+                    return
+                _, _, callback = heapq.heappop(self._queue)
+            callback()
+
+
+class PHALSimulator:
+    """Stand-in for ovos-PHAL-plugin-homeassistant answering from a simulated installation.
+
+    Each request is answered after `latency` seconds plus up to `jitter` more. A `failure_rate` fraction
+    of requests gets the plugin's failure response, and a `drop_rate` fraction is never answered, as when
+    Home Assistant is unreachable. Set `push_updates` to send a `device.state.updated` signal for every
+    change a command makes. Like the plugin's, the signal carries no data; set `rich_updates` to send
+    Home Assistant's `state_changed` event with it instead. Pass `seed` for repeatable runs.
+    """
+
+    def __init__(
+        self,
+        bus: FakeBus,
+        devices: Optional[List[dict]] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        push_updates: bool = False,
+        rich_updates: bool = False,
+        seed: Optional[int] = None,
+    ):
+        self.bus = bus
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.push_updates = push_updates
+        self.rich_updates = rich_updates
+        self.devices: Dict[str, dict] = {device["id"]: device for device in deepcopy(devices or make_devices(100))}
+        self.requests: Counter = Counter()
+        self.failed: Counter = Counter()
+        self.dropped: Counter = Counter()
+        self._by_name = {device["name"].lower(): device for device in self.devices.values()}
+        self._random = Random(seed)
+        self._lock = Lock()
+        self._scheduler = _Scheduler() if latency or jitter else None
+        self._handlers: Dict[str, Callable[[Optional[dict], Message], Optional[dict]]] = {
+            "get.devices": lambda _, __: {"devices": deepcopy(list(self.devices.values()))},
+            "get.device": lambda device, _: deepcopy(device),
+            "device.turn_on": lambda device, message: self._set_state(device, message, "on"),
+            "device.turn_off": lambda device, message: self._set_state(device, message, "off"),
+            "get.light.brightness": self._get_brightness,
+            "set.light.brightness": self._set_brightness,
+            "get.light.color": self._get_color,
+            "set.light.color": self._set_color,
+            "call.supported.function": self._call_function,
+            "assist.intent": lambda _, __: None,
+            "rebuild.device.list": lambda _, __: None,
+            "show.area.dashboard": lambda _, __: None,
+        }
+        for request_type in self._handlers:
+            bus.on(f"{PHAL_NAMESPACE}{request_type}", self._handle)
+
+    @classmethod
+    def with_installation(cls, bus: FakeBus, entities: int, areas: int, **kwargs) -> "PHALSimulator":
+        """Simulate an installation of `entities` devices across `areas` areas."""
+        return cls(bus, make_devices(entities, areas), **kwargs)
+
+    def close(self):
+        """Stop answering requests and drop any responses not yet sent."""
+        for request_type in self._handlers:
+            self.bus.remove(f"{PHAL_NAMESPACE}{request_type}", self._handle)
+        if self._scheduler is not None:
+            self._scheduler.stop()
+
+    def churn(self, changes: int = 1) -> List[str]:
+        """Toggle `changes` random devices outside the skill, as people do with wall switches and apps.
+
+        Each change is sent as a `device.state.updated` signal. Returns the changed entity IDs.
+        """
+        with self._lock:
+            devices = self._random.sample(list(self.devices.values()), min(changes, len(self.devices)))
+            updates = []
+            for device in devices:
+                old = self._state(device)
+                device["state"] = "off" if device["state"] == "on" else "on"
+                updates.append((device, old))
+        for device, old in updates:
+            self._push(device, old)
+        return [device["id"] for device, _ in updates]
+
+    def ready(self):
+        """Announce that the plugin has (re)connected to Home Assistant."""
+        self.bus.emit(Message(f"{PHAL_NAMESPACE}ready"))
+
+    def _handle(self, message: Message):
+        request_type = message.msg_type[len(PHAL_NAMESPACE) :]
+        changed = None
+        with self._lock:
+            self.requests[request_type] += 1
+            roll = self._random.random()
+            delay = self.latency + (self._random.random() * self.jitter if self.jitter else 0)
+            if roll < self.drop_rate:
+                self.dropped[request_type] += 1
+                return
+            device = self._find(message.data)
+            if roll < self.drop_rate + self.failure_rate:
+                self.failed[request_type] += 1
+                response = self._failure(request_type, message)
+            elif device is None and request_type not in ("get.devices", "assist.intent", "rebuild.device.list"):
+                response = self._failure(request_type, message)
+            else:
+                old = self._state(device) if device else None
+                data = self._handlers[request_type](device, message)
+                response = message.response(data) if data is not None else None
+                if device and self.push_updates and self._state(device) != old:
+                    changed = (device, old)
+        # Send outside the lock; the skill may answer a response with another request
+        if changed is not None:
+            self._later(delay, lambda: self._push(*changed))
+        if response is not None:
+            self._later(delay, lambda: self.bus.emit(response))
+
+    def _later(self, delay: float, callback: Callable[[], None]):
+        if self._scheduler is not None and delay > 0:
+            self._scheduler.call_later(delay, callback)
+        else:
+            callback()
+
+    def _find(self, data: dict) -> Optional[dict]:
+        device_id = data.get("device_id")
+        if device_id:
+            return self.devices.get(device_id)
+        return self._by_name.get(str(data.get("device", "")).lower())
+
+    @staticmethod
+    def _failure(request_type: str, message: Message) -> Optional[Message]:
+        """The plugin's answer to a request it could not carry out."""
+        if request_type == "assist.intent":
+            return Message(f"{PHAL_NAMESPACE}assist.message.response", {}, message.context)
+        if request_type in ("rebuild.device.list", "show.area.dashboard"):
+            return None
+        if request_type == "call.supported.function":
+            return message.response({"device": message.data.get("device"), "response": "Device not found"})
+        return message.response({})
+
+    @staticmethod
+    def _state(device: dict) -> dict:
+        return {"state": device["state"], "attributes": dict(device["attributes"])}
+
+    def _push(self, device: dict, old: dict):
+        if not self.rich_updates:
+            self.bus.emit(Message(f"{PHAL_NAMESPACE}device.state.updated"))
+            return
+        self.bus.emit(
+            Message(
+                f"{PHAL_NAMESPACE}device.state.updated",
+                {"event": {"data": {"entity_id": device["id"], "old_state": old, "new_state": self._state(device)}}},
+            )
+        )
+
+    @staticmethod
+    def _spoken(device: dict, message: Message) -> str:
+        return message.data.get("device") or device["name"]
+
+    def _set_state(self, device: dict, message: Message, state: str) -> dict:
+        device["state"] = state
+        return {"device": self._spoken(device, message)}
+
+    def _get_brightness(self, device: dict, message: Message) -> dict:
+        return {
+            "device": self._spoken(device, message),
+            "brightness": round(device["attributes"]["brightness"] / 255 * 100),
+        }
+
+    def _set_brightness(self, device: dict, message: Message) -> dict:
+        device["attributes"]["brightness"] = min(max(int(message.data.get("brightness", 0)), 0), 255)
+        device["state"] = "on" if device["attributes"]["brightness"] else "off"
+        return self._get_brightness(device, message)
+
+    def _get_color(self, device: dict, message: Message) -> dict:
+        rgb = tuple(device["attributes"].get("rgb_color") or RED)
+        # Like the plugin, name the color if it can and give its RGB code otherwise
+        name = CSS3_COLORS.name(rgb)
+        color = color_key(name) if CSS3_COLORS.rgb(name) == rgb else "RGB code {}, {}, {}".format(*rgb)
+        return {"device": self._spoken(device, message), "color": color}
+
+    def _set_color(self, device: dict, message: Message) -> dict:
+        color = str(message.data.get("color", "")).lower()
+        rgb = CSS3_COLORS.rgb(color) if color == color_key(color) else None
+        if rgb is None:
+            # The plugin fails a color that isn't a CSS3 name
+            return {}
+        device["attributes"]["rgb_color"] = list(rgb)
+        device["state"] = "on"
+        return {"device": self._spoken(device, message), "color": color}
+
+    def _call_function(self, device: dict, message: Message) -> dict:
+        args = message.data.get("function_args") or {}
+        function = message.data.get("function_name")
+        if function == "turn_on" and "brightness_step_pct" in args:
+            step = round(float(args["brightness_step_pct"]) / 100 * 255)
+            device["attributes"]["brightness"] = min(max(device["attributes"]["brightness"] + step, 0), 255)
+            device["state"] = "on" if device["attributes"]["brightness"] else "off"
+        elif function in ("turn_on", "turn_off"):
+            device["state"] = function[len("turn_") :]
+        return {
+            "device": self._spoken(device, message),
+            "response": [{"entity_id": device["id"], **self._state(device)}],
+        }
@@ -0,0 +1,17 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+
+from test.perf.bench import compare, run_benchmarks
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_benchmarks_run(self):
+        results = run_benchmarks(entities=50, iterations=3, sessions=2)
+        self.assertEqual(len(results["handlers"]), 10)
+        for stats in results["handlers"].values():
+            self.assertEqual(stats["count"], 3)
+            self.assertLessEqual(stats["p50_ms"], stats["p99_ms"])
+        self.assertEqual(results["throughput"]["requests"], 6)
+        self.assertGreater(results["startup"]["skill_ms"], 0)
+        self.assertEqual(results["memory"]["entities"], 50)
+        self.assertIn("turn.on.intent: p50_ms", "\n".join(compare(results, results)))
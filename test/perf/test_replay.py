@@ -0,0 +1,70 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring,protected-access
+import unittest
+from os import remove
+from os.path import exists, join
+from shutil import move
+from tempfile import TemporaryDirectory
+from test.perf.replay import replay
+from test.perf.simulator import PHALSimulator, make_devices
+from test.utils import temporary_skill_data
+
+from ovos_bus_client import Message
+from ovos_utils.messagebus import FakeBus
+
+from neon_homeassistant_skill import NeonHomeAssistantSkill
+from neon_homeassistant_skill.recorder import read_recording
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = join(self._dir.name, "traffic.jsonl")
+
+    def _record(self):
+        """Record a short session against the simulated plugin, as the skill would at home."""
+        with temporary_skill_data():
+            bus = FakeBus()
+            devices = make_devices(20)
+            PHALSimulator(bus, devices)
+            skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.record")
+            # Start from an empty recording, even if an earlier run left recording on
+            skill._set_recording(False)
+            recording = join(skill.file_system.path, "traffic.jsonl")
+            if exists(recording):
+                remove(recording)
+            skill.settings["record_traffic"] = True
+            skill.settings_change_callback()
+            skill._request_device_list()
+            light = next(device for device in devices if device["type"] == "light")["name"]
+            for intent, data in (
+                ("sensor.intent", {"entity": light}),
+                ("turn.off.intent", {"entity": light}),
+                ("lights.get.brightness.intent", {"entity": light}),
+            ):
+                bus.emit(Message(f"{skill.skill_id}:{intent}", data, {"session": {"session_id": "kitchen"}}))
+            skill.shutdown()
+            skill.settings["record_traffic"] = False
+            move(recording, self.path)
+        return light
+
+    def test_recorded_traffic_replayed(self):
+        light = self._record()
+        records = read_recording(self.path)
+        self.assertEqual(
+            [record.msg_type for record in records if record.direction == "intent"],
+            ["sensor.intent", "turn.off.intent", "lights.get.brightness.intent"],
+        )
+        results = replay(records, speed=0, sessions=3, timeout=5)
+        self.assertEqual((results["intents"], results["unanswered"]), (9, 0))
+        self.assertEqual(set(results["latency"]), {"sensor.intent", "turn.off.intent", "lights.get.brightness.intent"})
+        self.assertEqual(results["latency"]["sensor.intent"]["count"], 3)
+        self.assertEqual(results["dialogs"]["lights.current.brightness"], 3)
+        self.assertEqual(
+            {spoken["session_id"] for spoken in results["spoken"]}, {"kitchen-0", "kitchen-1", "kitchen-2"}
+        )
+        self.assertTrue(any(light in spoken["utterance"] for spoken in results["spoken"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring,protected-access
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from test.perf.simulator import PHALSimulator, area_names, make_devices
+from test.utils import temporary_skill_data
+from threading import Event
+
+from ovos_bus_client import Message
+from ovos_utils.messagebus import FakeBus
+
+from neon_homeassistant_skill import NeonHomeAssistantSkill
+from neon_homeassistant_skill.correlation import PHAL_NAMESPACE
+
+
+class TestPHALSimulator(unittest.TestCase):
+    def setUp(self):
+        self.bus = FakeBus()
+        self.responses = []
+        self.bus.on("message", lambda serialized: self.responses.append(Message.deserialize(serialized)))
+
+    def _request(self, request_type: str, data: dict) -> Message:
+        self.responses.clear()
+        self.bus.emit(Message(f"{PHAL_NAMESPACE}{request_type}", data))
+        return next(message for message in self.responses if message.msg_type.endswith(".response"))
+
+    def test_installation_spread_over_areas(self):
+        devices = make_devices(5000, areas=20)
+        self.assertEqual(len({device["id"] for device in devices}), 5000)
+        self.assertEqual({device["area"] for device in devices}, set(area_names(20)))
+
+    def test_commands_change_state(self):
+        simulator = PHALSimulator.with_installation(self.bus, 50, 5, push_updates=True, rich_updates=True)
+        self.addCleanup(simulator.close)
+        lamp = next(device for device in simulator.devices.values() if device["type"] == "light")
+        self.assertEqual(self._request("device.turn_on", {"device_id": lamp["id"]}).data, {"device": lamp["name"]})
+        self.assertEqual(lamp["state"], "on")
+        update = next(message for message in self.responses if message.msg_type.endswith("device.state.updated"))
+        self.assertEqual(update.data["event"]["data"]["new_state"]["state"], "on")
+        brightness = self._request("set.light.brightness", {"device": lamp["name"], "brightness": 255})
+        self.assertEqual(brightness.data["brightness"], 100)
+        stepped = self._request(
+            "call.supported.function",
+            {"device_id": lamp["id"], "function_name": "turn_on", "function_args": {"brightness_step_pct": -50}},
+        )
+        self.assertEqual(stepped.data["response"][0]["attributes"]["brightness"], 127)
+        self.assertEqual(
+            self._request("set.light.color", {"device": lamp["name"], "color": "blue"}).data["color"], "blue"
+        )
+        self.assertEqual(self._request("get.light.color", {"device": lamp["name"]}).data["color"], "blue")
+        # Like the plugin, only CSS3 color names are understood
+        self.assertEqual(self._request("set.light.color", {"device": lamp["name"], "color": "warm white"}).data, {})
+        self._request("set.light.color", {"device": lamp["name"], "color": "darkslategray"})
+        self.assertEqual(self._request("get.light.color", {"device": lamp["name"]}).data["color"], "darkslategray")
+        self.assertEqual(self._request("get.device", {"device": "nothing"}).data, {})
+
+    def test_failures_and_drops(self):
+        simulator = PHALSimulator(self.bus, make_devices(10), failure_rate=0.3, drop_rate=0.2, seed=1)
+        self.addCleanup(simulator.close)
+        for _ in range(200):
+            self.bus.emit(Message(f"{PHAL_NAMESPACE}get.device", {"device": "Kitchen Lamp 0"}))
+        self.assertEqual(simulator.requests["get.device"], 200)
+        self.assertTrue(20 < simulator.dropped["get.device"] < 60)
+        self.assertTrue(40 < simulator.failed["get.device"] < 80)
+
+    def test_churn_pushes_changes(self):
+        simulator = PHALSimulator(self.bus, make_devices(10), seed=1)
+        self.addCleanup(simulator.close)
+        self.responses.clear()
+        changed = simulator.churn(3)
+        self.assertEqual(len(changed), 3)
+        self.assertEqual(len(self.responses), 3)
+        # Like the plugin's, the signals don't say what changed
+        self.assertTrue(all(message.data == {} for message in self.responses))
+        self.assertTrue(all(simulator.devices[entity_id]["state"] == "on" for entity_id in changed))
+
+
+class TestSkillUnderLoad(unittest.TestCase):
+    def test_concurrent_sessions_with_failures(self):
+        """Every intent is answered, even when Home Assistant is slow, fails or doesn't answer."""
+        bus = FakeBus()
+        simulator = PHALSimulator.with_installation(
+            bus, 2000, 20, latency=0.005, jitter=0.01, failure_rate=0.1, drop_rate=0.05, push_updates=True, seed=7
+        )
+        skill_data = ExitStack()
+        skill_data.enter_context(temporary_skill_data())
+        self.addCleanup(skill_data.close)
+        skill = NeonHomeAssistantSkill(bus=bus, skill_id="neon_homeassistant_skill.simulated")
+        self.addCleanup(simulator.close)
+        self.addCleanup(skill.shutdown)
+        skill.settings["request_timeouts"] = {"get.device": 0.3, "device.turn_on": 0.3, "device.turn_off": 0.3}
+        skill.settings_change_callback()
+        skill._entities.rebuild(list(simulator.devices.values()))
+        answered = {}
+        bus.on("speak", lambda message: answered[message.context["session"]["session_id"]].set())
+        names = [device["name"] for device in simulator.devices.values()]
+
+        def session(number: int):
+            for i in range(10):
+                session_id = f"{number}-{i}"
+                answered[session_id] = Event()
+                intent = ("sensor.intent", "turn.on.intent", "turn.off.intent")[i % 3]
+                entity = names[(number * 10 + i) * 7 % len(names)]
+                skill._set_available(True)
+                bus.emit(
+                    Message(f"{skill.skill_id}:{intent}", {"entity": entity}, {"session": {"session_id": session_id}})
+                )
+                simulator.churn(2)
+                self.assertTrue(answered[session_id].wait(5), f"{intent} for {entity} was not answered")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(session, range(8)))
+        self.assertEqual(len(answered), 80)
+        self.assertGreater(sum(simulator.dropped.values()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
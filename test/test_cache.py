@@ -0,0 +1,46 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+
+from neon_homeassistant_skill.cache import EntityStateCache
+from test.utils import FakeClock
+
+
+class TestEntityStateCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = EntityStateCache(max_size=2, ttl=5, clock=self.clock)
+
+    def test_names_are_normalized(self):
+        self.cache.update("Kitchen  Lamp", state="on")
+        self.assertEqual(self.cache.get("kitchen lamp"), {"state": "on"})
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.update("kitchen lamp", state="on")
+        self.clock.now = 5
+        self.assertIsNotNone(self.cache.get("kitchen lamp"))
+        self.clock.now = 5.1
+        self.assertIsNone(self.cache.get("kitchen lamp"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.update("kitchen lamp", state="on")
+        self.cache.update("porch light", state="off")
+        self.cache.get("kitchen lamp")
+        self.cache.update("garage door", state="closed")
+        self.assertIn("kitchen lamp", self.cache)
+        self.assertIn("garage door", self.cache)
+        self.assertNotIn("porch light", self.cache)
+
+    def test_updates_merge_and_require_fields(self):
+        self.cache.update("kitchen lamp", state="on")
+        self.cache.update("kitchen lamp", brightness=40)
+        self.assertEqual(self.cache.get("kitchen lamp", "state", "brightness"), {"state": "on", "brightness": 40})
+        self.assertIsNone(self.cache.get("kitchen lamp", "type"))
+        self.cache.invalidate("kitchen lamp", "brightness")
+        self.assertIsNone(self.cache.get("kitchen lamp", "brightness"))
+        self.assertEqual(self.cache.get("kitchen lamp"), {"state": "on"})
+
+    def test_zero_ttl_disables_caching(self):
+        self.cache.configure(ttl=0)
+        self.cache.update("kitchen lamp", state="on")
+        self.assertIsNone(self.cache.get("kitchen lamp"))
@@ -0,0 +1,72 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+from threading import Event
+
+from mock import Mock
+from ovos_bus_client import Message
+
+from neon_homeassistant_skill.coalesce import AdjustmentCoalescer
+
+
+class TestAdjustmentCoalescer(unittest.TestCase):
+    def test_steps_are_summed_within_window(self):
+        on_flush = Mock()
+        coalescer = AdjustmentCoalescer(on_flush=on_flush, window=60)
+        for _ in range(3):
+            coalescer.add("Kitchen Lamp", Message("test"), step=10)
+        coalescer.add("kitchen lamp", Message("test"), step=-10)
+        on_flush.assert_not_called()
+        adjustment = coalescer.flush("kitchen lamp")
+        on_flush.assert_called_once_with(adjustment)
+        self.assertEqual((adjustment.step, adjustment.brightness, adjustment.count), (20, None, 4))
+        self.assertEqual(len(coalescer), 0)
+
+    def test_absolute_brightness_resets_steps_and_last_color_wins(self):
+        coalescer = AdjustmentCoalescer(on_flush=Mock(), window=60)
+        latest = Message("test")
+        coalescer.add("lamp", Message("test"), step=10, color="red")
+        coalescer.add("lamp", Message("test"), brightness=50)
+        coalescer.add("lamp", latest, step=10, color="blue")
+        adjustment = coalescer.flush("lamp")
+        self.assertEqual((adjustment.brightness, adjustment.step, adjustment.color), (50, 10, "blue"))
+        self.assertIs(adjustment.message, latest)
+
+    def test_sessions_are_coalesced_separately(self):
+        on_flush = Mock()
+        coalescer = AdjustmentCoalescer(on_flush=on_flush, window=60)
+        bedroom = Message("test", context={"session": {"session_id": "bedroom"}})
+        kitchen = Message("test", context={"session": {"session_id": "kitchen"}})
+        coalescer.add("lamp", bedroom, step=10)
+        coalescer.add("lamp", kitchen, step=-10)
+        coalescer.add("lamp", bedroom, step=10)
+        self.assertEqual(len(coalescer), 2)
+        coalescer.flush_all()
+        adjustments = {
+            call.args[0].message.context["session"]["session_id"]: call.args[0] for call in on_flush.mock_calls
+        }
+        self.assertEqual((adjustments["bedroom"].step, adjustments["bedroom"].count), (20, 2))
+        self.assertEqual((adjustments["kitchen"].step, adjustments["kitchen"].count), (-10, 1))
+
+    def test_announced_values_dropped_when_changed_later(self):
+        coalescer = AdjustmentCoalescer(on_flush=Mock(), window=60)
+        coalescer.add(
+            "lamp", Message("test"), brightness=50, color="red", announced={"brightness": 50, "color": "red"}
+        )
+        coalescer.add("lamp", Message("test"), step=10)
+        self.assertEqual(coalescer.flush("lamp").announced, {"color": "red"})
+        coalescer.add("lamp", Message("test"), step=10)
+        coalescer.add("lamp", Message("test"), brightness=30, announced={"brightness": 30})
+        self.assertEqual(coalescer.flush("lamp").announced, {"brightness": 30})
+
+    def test_window_closes_on_its_own(self):
+        flushed = Event()
+        coalescer = AdjustmentCoalescer(on_flush=lambda _: flushed.set(), window=0.05)
+        coalescer.add("lamp", Message("test"), step=10)
+        self.assertTrue(flushed.wait(2))
+
+    def test_zero_window_flushes_immediately(self):
+        on_flush = Mock()
+        coalescer = AdjustmentCoalescer(on_flush=on_flush, window=0)
+        coalescer.add("lamp", Message("test"), step=10)
+        coalescer.add("lamp", Message("test"), step=10)
+        self.assertEqual(on_flush.call_count, 2)
@@ -0,0 +1,89 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+from colorsys import rgb_to_hsv
+from os.path import dirname, join
+from time import perf_counter
+
+from neon_homeassistant_skill.colors import (
+    ColorNames,
+    ColorPalette,
+    hs_to_rgb,
+    parse_rgb,
+    reported_rgb,
+)
+
+LOCALE = join(dirname(dirname(__file__)), "neon_homeassistant_skill", "locale")
+
+
+class TestColors(unittest.TestCase):
+    def setUp(self):
+        self.colors = ColorNames(LOCALE)
+        self.palette = self.colors.palette("en-US")
+
+    def test_names(self):
+        self.assertEqual(self.palette.rgb("Red"), (255, 0, 0))
+        self.assertEqual(self.palette.rgb("dark  slate gray"), (47, 79, 79))
+        self.assertEqual(self.palette.rgb("blue-violet"), (138, 43, 226))
+        # Spaces between words don't matter, so CSS3 names are understood as written and as spoken
+        self.assertEqual(self.palette.rgb("darkslategray"), (47, 79, 79))
+        self.assertEqual(self.palette.rgb("honey dew"), self.palette.rgb("honeydew"))
+        self.assertEqual(self.palette.spoken("DarkSlateGray"), "dark slate gray")
+        for name in ("aqua", "gray", "olive", "maroon", "silver", "beige", "tan"):
+            self.assertIn(name, self.palette)
+        self.assertEqual(len(self.palette), 147)
+        self.assertNotIn("mauve", self.palette)
+        self.assertNotIn("warm white", self.palette)
+        self.assertIsNone(self.palette.rgb("spaceship"))
+        # Palettes are loaded once per language, and languages without colors have none
+        self.assertIs(self.colors.palette("en-us"), self.palette)
+        self.assertIsNone(self.colors.palette("de-DE"))
+
+    def test_nearest_name(self):
+        self.assertEqual(self.palette.name((250, 5, 10)), "red")
+        self.assertEqual(self.palette.name((10, 10, 255)), "blue")
+        self.assertEqual(self.palette.name((128, 126, 2)), "olive")
+        # A color with several names is spoken as the first one listed
+        self.assertEqual(self.palette.name((0, 255, 255)), "cyan")
+        self.assertEqual(self.palette.name((128, 128, 128)), "gray")
+        # Lights report their color at full brightness
+        self.assertEqual(self.palette.name(hs_to_rgb(*self._hs("dark orange"))), "dark orange")
+        self.assertIsNone(ColorPalette([]).name((1, 2, 3)))
+
+    def test_reported_colors(self):
+        self.assertEqual(self.colors.describe("en-us", {"rgb_color": [0, 0, 250]}), "blue")
+        self.assertEqual(self.colors.describe("en-us", {"hs_color": [120, 100]}), "lime")
+        self.assertEqual(self.colors.describe("en-us", {"color": [255, 0, 0]}), "red")
+        # The plugin reports colors without a CSS3 name as an RGB code
+        self.assertEqual(self.colors.describe("en-us", {"color": "RGB code 250, 5, 8"}), "red")
+        self.assertIsNone(self.colors.describe("de-de", {"color": "RGB code 250, 5, 8"}))
+        # A name reported by the plugin is spoken as the palette writes it, or as it is if the palette lacks it
+        self.assertEqual(self.colors.describe("en-us", {"color": "lightgoldenrodyellow"}), "light goldenrod yellow")
+        self.assertEqual(self.colors.describe("en-us", {"color": "mauve"}), "mauve")
+        self.assertEqual(self.colors.describe("de-de", {"color": "rot", "rgb_color": [255, 0, 0]}), "rot")
+        self.assertIsNone(self.colors.describe("en-us", {"hs_color": "bad"}))
+        self.assertEqual(reported_rgb({"rgb_color": "#FF8C00"}), (255, 140, 0))
+        self.assertEqual(parse_rgb("rgb code 255,140, 0"), (255, 140, 0))
+        self.assertIsNone(parse_rgb([1, 2]))
+        self.assertIsNone(parse_rgb("blue"))
+        self.assertEqual(parse_rgb([300, -1, 127.6]), (255, 0, 128))
+
+    def test_naming_speed(self):
+        colors = [(r, g, b) for r in range(0, 256, 51) for g in range(0, 256, 51) for b in range(0, 256, 51)]
+        start = perf_counter()
+        for rgb in colors:
+            self.palette.name(rgb)
+        cold = (perf_counter() - start) / len(colors)
+        start = perf_counter()
+        for rgb in colors:
+            self.palette.name(rgb)
+        warm = (perf_counter() - start) / len(colors)
+        self.assertLess(cold, 0.001)
+        self.assertLess(warm, 0.0001)
+
+    def _hs(self, name):
+        hue, saturation, _ = rgb_to_hsv(*(channel / 255 for channel in self.palette.rgb(name)))
+        return hue * 360, saturation * 100
+
+
+if __name__ == "__main__":
+    unittest.main()
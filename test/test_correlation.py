@@ -0,0 +1,61 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+from threading import Event
+
+from mock import Mock
+from ovos_bus_client import Message
+
+from neon_homeassistant_skill.correlation import PendingRequests
+
+
+class TestPendingRequests(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.on_timeout = Mock()
+        self.pending = PendingRequests(on_timeout=self.on_timeout, max_pending=3, clock=lambda: self.now)
+
+    def test_resolve_removes_request(self):
+        request = self.pending.add("device.turn_on", Message("test"), device="lamp", timeout=5)
+        self.assertIn(request.request_id, self.pending)
+        self.assertIs(self.pending.resolve(request.request_id), request)
+        self.assertIsNone(self.pending.resolve(request.request_id))
+        self.assertEqual(self.pending.expire(now=10), [])
+        self.on_timeout.assert_not_called()
+
+    def test_expired_requests_time_out(self):
+        fast = self.pending.add("get.device", Message("test"), device="lamp", timeout=5)
+        slow = self.pending.add("device.turn_on", Message("test"), device="fan", timeout=10)
+        self.assertEqual(self.pending.expire(now=6), [fast])
+        self.on_timeout.assert_called_once_with(fast)
+        self.assertIsNone(self.pending.resolve(fast.request_id))
+        self.assertIn(slow.request_id, self.pending)
+
+    def test_table_is_bounded(self):
+        requests = [self.pending.add("get.device", Message("test"), device=str(i)) for i in range(4)]
+        self.assertEqual(len(self.pending), 3)
+        self.assertNotIn(requests[0].request_id, self.pending)
+        self.on_timeout.assert_called_once_with(requests[0])
+
+    def test_background_expiry(self):
+        timed_out = Event()
+        pending = PendingRequests(on_timeout=lambda _: timed_out.set())
+        pending.start()
+        try:
+            pending.add("get.device", Message("test"), device="lamp", timeout=0.05)
+            self.assertTrue(timed_out.wait(2))
+            self.assertEqual(len(pending), 0)
+        finally:
+            pending.stop()
+
+    def test_sessions_are_bounded_independently(self):
+        self.pending.max_per_session = 2
+        self.pending.max_pending = 10
+        kitchen = [
+            self.pending.add("get.device", Message("test", context={"session": {"session_id": "kitchen"}}))
+            for _ in range(3)
+        ]
+        office = self.pending.add("get.device", Message("test", context={"session": {"session_id": "office"}}))
+        self.assertEqual(len(self.pending.for_session("kitchen")), 2)
+        self.assertNotIn(kitchen[0].request_id, self.pending)
+        self.assertEqual(self.pending.for_session("office"), [office])
+        self.assertEqual(office.session_id, "office")
@@ -0,0 +1,223 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import sys
+import unittest
+from threading import Event, Thread
+from time import perf_counter
+
+from neon_homeassistant_skill.entities import EntityIndex, EntityRecord
+
+DEVICES = [
+    {"id": "light.kitchen_lamp", "name": "Kitchen Lamp", "type": "light", "attributes": {}},
+    {"id": "light.salt_and_pepper", "name": "Salt and Pepper Lamp", "type": "light", "attributes": {}},
+    {"id": "fan.ceiling", "name": "ceiling", "type": "fan", "attributes": {"friendly_name": "Ceiling Fan"}},
+    {"id": "light.hue_1", "name": "Hue 1", "type": "light", "attributes": {"area": "office"}},
+]
+
+
+class TestEntityIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = EntityIndex()
+        self.index.rebuild(DEVICES, aliases={"big light": "fan.ceiling", "reading lamp": "hue 1"})
+
+    def test_exact_names(self):
+        self.assertEqual(self.index.resolve("the my Kitchen  Lamp").entity_id, "light.kitchen_lamp")
+        self.assertEqual(self.index.resolve("ceiling fan").name, "Ceiling Fan")
+        self.assertEqual(self.index.get("salt_and_pepper").entity_id, "light.salt_and_pepper")
+        self.assertEqual(self.index.get("office hue 1").entity_id, "light.hue_1")
+        self.assertEqual(self.index.get("kitchen lamp").score, 1.0)
+
+    def test_aliases(self):
+        self.assertEqual(self.index.get("the big light").entity_id, "fan.ceiling")
+        self.assertEqual(self.index.get("reading lamp").entity_id, "light.hue_1")
+
+    def test_fuzzy_names(self):
+        match = self.index.resolve("kitchen lamb")
+        self.assertEqual(match.entity_id, "light.kitchen_lamp")
+        self.assertLess(match.score, 1.0)
+        self.assertIsNone(self.index.get("kitchen lamb"))
+        self.assertEqual(self.index.resolve("salt and peper lamp").entity_id, "light.salt_and_pepper")
+
+    def test_fuzzy_names_of_another_kind(self):
+        self.index.upsert({"id": "switch.kitchen_heater", "name": "Kitchen Heater", "type": "switch"})
+        self.assertEqual(self.index.resolve("kitchen heat").entity_id, "switch.kitchen_heater")
+        # A name saying it is a fan only loosely matches fans; an exact name matches whatever its kind
+        self.assertIsNone(self.index.resolve("kitchen heat", kinds=("fan",)))
+        self.assertEqual(self.index.resolve("kitchen lamp", kinds=("fan",)).entity_id, "light.kitchen_lamp")
+        self.assertEqual(self.index.resolve("ceiling fans", kinds=("fan",)).entity_id, "fan.ceiling")
+        # A stricter threshold for this lookup only
+        self.assertIsNone(self.index.resolve("kitchen lamb", threshold=0.9))
+        self.assertIsNotNone(self.index.resolve("kitchen lamb"))
+
+    def test_lookups_during_rebuilds(self):
+        devices = [
+            {"id": f"light.lamp_{i}", "name": f"Lamp {i}", "type": "light", "attributes": {}} for i in range(300)
+        ]
+        done, errors = Event(), []
+
+        def rebuild():
+            for count in (300, 10) * 20:
+                self.index.rebuild(devices[:count])
+            done.set()
+
+        def lookup():
+            while not done.is_set():
+                try:
+                    match = self.index.resolve("lamb 7")
+                    self.assertEqual(match.entity_id, "light.lamp_7")
+                except Exception as e:  # pylint: disable=broad-except
+                    errors.append(e)
+                    return
+
+        self.index.rebuild(devices)
+        # Switch threads as often as possible, so lookups run in the middle of rebuilds
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        threads = [Thread(target=rebuild), Thread(target=lookup), Thread(target=lookup)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_incremental_updates(self):
+        self.assertFalse(self.index.upsert({"id": "light.kitchen_lamp", "name": "Kitchen Lamp", "type": "light"}))
+        self.assertTrue(
+            self.index.upsert(
+                {"id": "light.kitchen_lamp", "type": "light", "attributes": {"friendly_name": "Counter Lamp"}}
+            )
+        )
+        # Still found by its entity ID
+        self.assertEqual(self.index.get("kitchen lamp").name, "Counter Lamp")
+        self.assertEqual(self.index.resolve("counter lamp").entity_id, "light.kitchen_lamp")
+        self.assertEqual(self.index.by_id("light.hue_1").area, "office")
+        self.index.upsert({"id": "light.hue_1", "name": "Desk Lamp", "type": "light"})
+        self.assertEqual(self.index.get("office desk lamp").entity_id, "light.hue_1")
+        self.assertTrue(self.index.remove("fan.ceiling"))
+        self.assertFalse(self.index.remove("fan.ceiling"))
+        self.assertIsNone(self.index.resolve("ceiling fan"))
+        self.assertIsNone(self.index.get("big light"))
+        self.assertEqual(len(self.index), 3)
+
+    def test_select(self):
+        self.index.rebuild(
+            DEVICES
+            + [
+                {
+                    "id": "binary_sensor.back_door",
+                    "name": "Back Door",
+                    "type": "binary_sensor",
+                    "state": "on",
+                    "attributes": {"device_class": "door"},
+                },
+                {
+                    "id": "cover.garage",
+                    "name": "Garage Door",
+                    "type": "cover",
+                    "state": "closed",
+                    "attributes": {"device_class": "garage"},
+                },
+                {"id": "light.porch", "name": "Porch Light", "type": "light", "state": "ON", "attributes": {}},
+            ]
+        )
+        names = lambda matches: [match.name for match in matches]  # noqa: E731
+        self.assertEqual(names(self.index.select(kinds=["light"], states=["on"])), ["Porch Light"])
+        self.assertEqual(names(self.index.select(kinds=["door"], states=["on", "open"])), ["Back Door"])
+        self.assertEqual(names(self.index.select(kinds=["door"])), ["Back Door", "Garage Door"])
+        self.assertEqual(names(self.index.select(kinds=["light"], area="office")), ["Hue 1"])
+        # No device is assigned to the kitchen, so it is found by name
+        self.assertEqual(names(self.index.select(area="the kitchen")), ["Kitchen Lamp"])
+        self.assertEqual(names(self.index.select(named="lamp")), ["Kitchen Lamp", "Salt and Pepper Lamp"])
+        self.assertEqual(self.index.select(kinds=["window"]), [])
+        self.assertEqual(len(self.index.select()), 7)
+
+        self.assertTrue(self.index.set_state("light.kitchen_lamp", "on"))
+        self.assertFalse(self.index.set_state("light.kitchen_lamp", "on"))
+        self.assertFalse(self.index.set_state("light.missing", "on"))
+        self.assertEqual(names(self.index.select(states=["on"], kinds=["light"])), ["Kitchen Lamp", "Porch Light"])
+        # A pushed state change moves the entity between state indexes
+        self.assertTrue(
+            self.index.upsert({"id": "light.porch", "name": "Porch Light", "type": "light", "state": "off"})
+        )
+        self.assertEqual(self.index.by_id("light.porch").state, "off")
+        self.assertEqual(names(self.index.select(states=["on"])), ["Back Door", "Kitchen Lamp"])
+        self.index.remove("binary_sensor.back_door")
+        self.assertEqual(names(self.index.select(states=["on"])), ["Kitchen Lamp"])
+        self.assertEqual(names(self.index.select(kinds=["door"])), ["Garage Door"])
+
+    def test_compact_records(self):
+        device = {
+            "id": "light.porch",
+            "name": "porch",
+            "type": "light",
+            "state": "ON",
+            "attributes": {
+                "friendly_name": "Porch Light",
+                "brightness": 128.0,
+                "supported_features": 44,
+                "icon": "mdi",
+            },
+            "host": "http://homeassistant.local:8123",
+        }
+        record = EntityRecord.from_device(device)
+        self.assertEqual(
+            (record.name, record.type, record.state, record.brightness), ("Porch Light", "light", "on", 128)
+        )
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertEqual(EntityRecord.from_device(record.to_device()), record)
+        # Values many entities share are stored once
+        other = EntityRecord.from_device({**device, "id": "light.path", "state": "On"})
+        self.assertIs(other.type, record.type)
+        self.assertIs(other.state, record.state)
+        self.assertIs(other.kinds, record.kinds)
+        self.assertEqual(EntityRecord.from_device({"name": "Lamp"}).name, "Lamp")
+
+    def test_footprint(self):
+        devices = [
+            {
+                "id": f"light.device_{i}",
+                "name": f"Device {i}",
+                "type": "light",
+                "state": "off",
+                "area": f"room {i % 20}",
+                "attributes": {"brightness": 128, "rgb_color": [255, 0, 0], "supported_color_modes": ["rgb"]},
+            }
+            for i in range(2000)
+        ]
+        self.index.rebuild(devices)
+        footprint = self.index.footprint()
+        self.assertEqual(footprint["entities"], 2000)
+        self.assertLess(footprint["record_bytes"], footprint["bytes"])
+        # Everything the index holds, names and lookup structures included, in a couple of KB per entity
+        self.assertLess(footprint["bytes_per_entity"], 2500)
+        self.index.clear()
+        self.assertEqual(self.index.footprint()["bytes_per_entity"], 0)
+
+    def test_unknown_names(self):
+        self.assertIsNone(self.index.resolve("spaceship"))
+        self.assertIsNone(self.index.resolve("the"))
+        self.index.clear()
+        self.assertEqual(len(self.index), 0)
+        self.assertIsNone(self.index.resolve("kitchen lamp"))
+
+    def test_large_index(self):
+        rooms = ("kitchen", "living room", "bedroom", "office", "garage", "porch", "basement", "hallway")
+        kinds = ("lamp", "light", "ceiling light", "fan", "switch", "heater", "speaker", "outlet")
+        self.index.rebuild(
+            {"id": f"light.device_{i}", "name": f"{rooms[i % 8]} {kinds[i // 8 % 8]} {i}", "type": "light"}
+            for i in range(6000)
+        )
+        self.assertEqual(len(self.index), 6000)
+        queries = ["bedroom ceiling lite 1234", "bedrom fan 3001", "porch light 5", "spaceship"] * 25
+        start = perf_counter()
+        matches = [self.index.resolve(query) for query in queries]
+        # Sub-millisecond on average; generous so slow CI machines don't flake
+        self.assertLess((perf_counter() - start) / len(queries), 0.005)
+        self.assertEqual(matches[0].entity_id, "light.device_1234")
+        self.assertIsNone(matches[3])
+
+        start = perf_counter()
+        for _ in range(100):
+            selected = self.index.select(kinds=["light"], area="porch", named="heater")
+        self.assertLess((perf_counter() - start) / 100, 0.005)
+        self.assertEqual(len(selected), 94)
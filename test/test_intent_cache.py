@@ -0,0 +1,59 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+from glob import glob
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from mock import Mock, patch
+
+from test.intent_cache import IntentCache, expand_samples, fingerprint, load_intent_samples
+
+
+class TestIntentCache(unittest.TestCase):
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.source = join(self._dir.name, "turn.on.intent")
+        with open(self.source, "w", encoding="utf-8") as f:
+            f.write("turn on (|the) {entity}")
+        self.cache = IntentCache(join(self._dir.name, "cache"))
+
+    def test_expand_samples(self):
+        self.assertCountEqual(
+            expand_samples(["# comment", "turn on (|the|my) {entity}", "", "turn on {entity}"]),
+            ["turn on {entity}", "turn on the {entity}", "turn on my {entity}"],
+        )
+
+    def test_locale_samples_expanded(self):
+        samples = load_intent_samples("en-us")
+        self.assertIn("lights.increase.brightness.intent", samples)
+        self.assertIn("make the {entity} a little brighter", samples["lights.increase.brightness.intent"])
+
+    def test_value_built_once_until_sources_change(self):
+        build = Mock(return_value={"turn.on.intent": ["turn on {entity}"]})
+        first = self.cache.get("samples", [self.source], build)
+        self.assertEqual(self.cache.get("samples", [self.source], build), first)
+        build.assert_called_once()
+        key = fingerprint([self.source])
+        with open(self.source, "a", encoding="utf-8") as f:
+            f.write("\nswitch on {entity}")
+        self.assertNotEqual(fingerprint([self.source]), key)
+        self.cache.get("samples", [self.source], build)
+        self.assertEqual(build.call_count, 2)
+        # Only the value for the current sources is kept
+        self.assertEqual(len(glob(join(self.cache.cache_dir, "samples.*.pickle"))), 1)
+        # Pickled matchers are rebuilt for another padacioso release
+        with patch("test.intent_cache.PADACIOSO_VERSION", "0.0.0"):
+            self.cache.get("samples", [self.source], build)
+        self.assertEqual(build.call_count, 3)
+
+    def test_unreadable_cache_is_rebuilt(self):
+        self.cache.get("samples", [self.source], lambda: 1)
+        for path in glob(join(self.cache.cache_dir, "samples.*.pickle")):
+            with open(path, "wb") as f:
+                f.write(b"not a pickle")
+        self.assertEqual(self.cache.get("samples", [self.source], lambda: 2), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+from os import makedirs
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from neon_homeassistant_skill.lang import locale_directories, normalize_lang
+
+
+class TestLocaleDirectories(unittest.TestCase):
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        for lang in ("en-us", "de-DE"):
+            makedirs(join(self._dir.name, lang))
+
+    def test_directories_by_tag(self):
+        directories = locale_directories(self._dir.name)
+        self.assertEqual(directories["de-de"], join(self._dir.name, "de-DE"))
+        # A region without its own directory falls back to the language's
+        self.assertEqual(directories["en"], join(self._dir.name, "en-us"))
+        self.assertNotIn("fr", directories)
+        self.assertEqual(locale_directories(join(self._dir.name, "missing")), {})
+
+    def test_normalize_lang(self):
+        self.assertEqual(normalize_lang("en-us"), "en-US")
+
+
+if __name__ == "__main__":
+    unittest.main()
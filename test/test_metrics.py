@@ -0,0 +1,75 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+
+from ovos_bus_client import Message
+
+from neon_homeassistant_skill.metrics import TRACE_ID_KEY, Histogram, Metrics
+from test.utils import FakeClock
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram()
+        for ms in [0.5] * 90 + [30] * 9 + [20000]:
+            histogram.add(ms)
+        # Percentiles are reported as the upper bound of their bucket
+        self.assertEqual(histogram.percentile(0.5), 1)
+        self.assertEqual(histogram.percentile(0.95), 50)
+        self.assertEqual(histogram.percentile(1.0), 20000)
+        self.assertEqual(histogram.to_dict()["count"], 100)
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = Metrics(sample_rate=1.0, trace_ttl=60, clock=self.clock)
+
+    def test_stages_are_timed(self):
+        message = Message("turn.on.intent")
+        self.metrics.start(message, "turn.on.intent")
+        request = message.forward("ovos.phal.plugin.homeassistant.device.turn_on")
+        self.clock.now = 0.002
+        self.metrics.mark(request, "request")
+        self.clock.now = 0.102
+        self.metrics.mark(request.response(), "response")
+        self.metrics.mark(message, "dialog")
+        self.clock.now = 0.105
+        self.metrics.mark(message, "rendered")
+        self.clock.now = 0.106
+        self.metrics.mark(message, "spoken")
+        stats = self.metrics.snapshot()["handlers"]["turn.on.intent"]
+        self.assertEqual((stats["calls"], stats["sampled"], stats["completed"]), (1, 1, 1))
+        self.assertEqual(stats["stages"]["phal"]["max_ms"], 100)
+        self.assertEqual(stats["stages"]["skill"]["p50_ms"], 2)
+        self.assertEqual(stats["stages"]["render"]["p50_ms"], 3)
+        self.assertEqual(stats["stages"]["speech"]["p50_ms"], 1)
+        self.assertAlmostEqual(stats["stages"]["total"]["max_ms"], 106)
+        self.assertIn("turn.on.intent: 1 calls, total p50", self.metrics.summary())
+
+    def test_trace_waits_for_pending_requests(self):
+        message = Message("turn.on.intent")
+        self.metrics.start(message, "turn.on.intent")
+        self.metrics.mark(message, "request")
+        # An acknowledgement spoken before the response doesn't finish the trace
+        self.metrics.mark(message, "spoken")
+        self.assertEqual(self.metrics.snapshot()["open_traces"], 1)
+        self.metrics.mark(message, "timeout")
+        self.metrics.mark(message, "spoken")
+        stats = self.metrics.snapshot()["handlers"]["turn.on.intent"]
+        self.assertEqual((stats["completed"], stats["timeouts"]), (1, 1))
+
+    def test_sampling(self):
+        self.metrics.sample_rate = 0
+        message = Message("sensor.intent")
+        self.assertIsNone(self.metrics.start(message, "sensor.intent"))
+        self.assertNotIn(TRACE_ID_KEY, message.context)
+        self.metrics.mark(message, "spoken")
+        self.assertEqual(self.metrics.snapshot()["handlers"]["sensor.intent"], {"calls": 1, "stages": {}})
+
+    def test_unfinished_traces_are_dropped(self):
+        self.metrics.start(Message("lights.set.color.intent"), "lights.set.color.intent")
+        self.clock.now = 61
+        self.metrics.start(Message("lights.set.color.intent"), "lights.set.color.intent")
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot["open_traces"], 1)
+        self.assertEqual(snapshot["handlers"]["lights.set.color.intent"]["abandoned"], 1)
@@ -0,0 +1,112 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import json
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from ovos_bus_client import Message
+
+from neon_homeassistant_skill.offline import OfflineQueue
+from test.utils import FakeClock
+
+
+class TestOfflineQueue(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.queue = OfflineQueue(clock=self.clock)
+
+    def test_only_last_intent_per_device_is_kept(self):
+        self.queue.add("device.turn_on", {"device": "Lamp"}, Message("test"))
+        self.queue.add("set.light.brightness", {"device": "lamp", "brightness": 128}, Message("test"))
+        self.queue.add("set.light.color", {"device": "lamp", "color": "red"}, Message("test"))
+        self.queue.add("set.light.color", {"device": "lamp", "color": "blue"}, Message("test"))
+        commands = self.queue.drain()
+        self.assertEqual(
+            [(command.request_type, command.data) for command in commands],
+            [
+                ("device.turn_on", {"device": "Lamp"}),
+                ("set.light.brightness", {"device": "lamp", "brightness": 128}),
+                ("set.light.color", {"device": "lamp", "color": "blue"}),
+            ],
+        )
+        self.assertEqual(len(self.queue), 0)
+
+    def test_turn_off_replaces_other_commands(self):
+        self.queue.add("set.light.brightness", {"device": "lamp", "brightness": 128}, Message("test"))
+        self.queue.add("device.turn_off", {"device": "lamp"}, Message("test"))
+        self.assertEqual([command.request_type for command in self.queue.drain()], ["device.turn_off"])
+        self.queue.add("device.turn_off", {"device": "lamp"}, Message("test"))
+        self.queue.add("increase.light.brightness", {"device": "lamp"}, Message("test"))
+        self.assertEqual([command.request_type for command in self.queue.drain()], ["increase.light.brightness"])
+
+    def test_queries_are_not_queued(self):
+        self.assertIsNone(self.queue.add("get.device", {"device": "lamp"}, Message("test")))
+        self.assertEqual(len(self.queue), 0)
+
+    def test_bounded_and_stale_commands_dropped(self):
+        self.queue.max_size = 2
+        for device in ("lamp", "fan", "kettle"):
+            self.queue.add("device.turn_on", {"device": device}, Message("test"))
+        self.assertEqual(len(self.queue), 2)
+        self.clock.now += self.queue.ttl + 1
+        self.queue.add("device.turn_on", {"device": "heater"}, Message("test"))
+        self.assertEqual([command.device for command in self.queue.drain()], ["heater"])
+
+    def test_unanswered_replays(self):
+        command = self.queue.add("device.turn_on", {"device": "lamp"}, Message("first"))
+        self.clock.now += 100
+        # A replay that goes unanswered keeps the command's age and message, and counts the attempt
+        for attempt in range(1, self.queue.max_attempts):
+            command = self.queue.drain()[0]
+            self.queue.add("device.turn_on", {"device": "lamp"}, Message("replay"), replayed=command)
+            self.assertEqual(len(self.queue), 1)
+        command = self.queue.drain()[0]
+        self.assertEqual((command.queued_at, command.attempts, command.message.msg_type), (1000.0, attempt, "first"))
+        self.assertIsNone(self.queue.add("device.turn_on", {"device": "lamp"}, Message("replay"), replayed=command))
+        self.assertEqual(len(self.queue), 0)
+        # It doesn't replace a command for the device queued while it was being replayed
+        replayed = self.queue.add("device.turn_on", {"device": "lamp"}, Message("first"))
+        self.queue.drain()
+        self.clock.now += 1
+        self.queue.add("device.turn_off", {"device": "lamp"}, Message("newer"))
+        self.assertIsNone(self.queue.add("device.turn_on", {"device": "lamp"}, Message("replay"), replayed=replayed))
+        self.assertEqual([command.request_type for command in self.queue.drain()], ["device.turn_off"])
+        # And it is dropped once it is older than the queue's ttl
+        self.queue.add("device.turn_on", {"device": "lamp"}, Message("replay"), replayed=replayed)
+        self.clock.now += self.queue.ttl
+        self.assertEqual(self.queue.drain(), [])
+
+    def test_late_response_confirms_command(self):
+        self.queue.add("device.turn_on", {"device": "lamp"}, Message("test"), request_id="abc")
+        self.assertFalse(self.queue.confirm("xyz"))
+        self.assertTrue(self.queue.confirm("abc"))
+        self.assertEqual(len(self.queue), 0)
+
+    def test_persisted_across_restarts(self):
+        with TemporaryDirectory() as directory:
+            path = join(directory, "queue.json")
+            queue = OfflineQueue(path=path, clock=self.clock)
+            context = {"session": {"session_id": "kitchen"}}
+            queue.add("device.turn_on", {"device": "lamp", "device_id": "light.lamp"}, Message("test", {}, context))
+            restored = OfflineQueue(path=path, clock=self.clock)
+            self.assertEqual(len(restored), 1)
+            command = restored.drain()[0]
+            self.assertEqual(command.data, {"device": "lamp", "device_id": "light.lamp"})
+            self.assertEqual(command.message.context, context)
+            queue.add("device.turn_on", {"device": "lamp"}, Message("test"), replayed=command)
+            self.assertEqual(OfflineQueue(path=path, clock=self.clock).drain()[0].attempts, 1)
+            self.assertEqual(len(OfflineQueue(path=path, clock=self.clock)), 0)
+
+    def test_unreadable_file_is_ignored(self):
+        with TemporaryDirectory() as directory:
+            path = join(directory, "queue.json")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("{not json")
+            self.assertEqual(len(OfflineQueue(path=path)), 0)
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump({"commands": [{"request_type": "get.device", "data": {}}]}, file)
+            self.assertEqual(len(OfflineQueue(path=path)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
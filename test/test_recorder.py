@@ -0,0 +1,62 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from ovos_bus_client import Message
+
+from neon_homeassistant_skill.correlation import PHAL_NAMESPACE, REQUEST_ID_KEY
+from neon_homeassistant_skill.recorder import INTENT, REQUEST, RESPONSE, TrafficRecorder, read_recording
+from test.utils import FakeClock
+
+
+class TestTrafficRecorder(unittest.TestCase):
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = join(self._dir.name, "traffic.jsonl")
+        self.clock = FakeClock(100.0)
+
+    def test_messages_recorded_with_timing(self):
+        recorder = TrafficRecorder(self.path, clock=self.clock)
+        context = {"session": {"session_id": "kitchen"}}
+        recorder.record(INTENT, Message("skill.id:turn.on.intent", {"entity": "lamp"}, context))
+        self.clock.now += 0.25
+        request = Message(f"{PHAL_NAMESPACE}device.turn_on", {"device": "lamp"}, {**context, REQUEST_ID_KEY: "abc"})
+        recorder.record(REQUEST, request)
+        self.clock.now += 0.5
+        recorder.record(RESPONSE, request.response({"device": "lamp"}))
+        recorder.close()
+        recorder.record(RESPONSE, Message(f"{PHAL_NAMESPACE}ready"))
+        records = read_recording(self.path)
+        self.assertEqual(
+            [(record.time, record.direction, record.msg_type, record.request_id) for record in records],
+            [
+                (0.0, INTENT, "turn.on.intent", None),
+                (0.25, REQUEST, "device.turn_on", "abc"),
+                (0.75, RESPONSE, "device.turn_on.response", "abc"),
+            ],
+        )
+        self.assertEqual(records[0].data, {"entity": "lamp"})
+        self.assertEqual(records[2].session_id, "kitchen")
+
+    def test_recordings_appended(self):
+        for _ in range(2):
+            recorder = TrafficRecorder(self.path, clock=self.clock)
+            self.clock.now += 2
+            recorder.record(REQUEST, Message(f"{PHAL_NAMESPACE}get.devices"))
+            recorder.close()
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write('{"t":1,"d":"out"')
+        self.assertEqual([record.time for record in read_recording(self.path)], [2, 4])
+
+    def test_recording_stops_at_size_limit(self):
+        recorder = TrafficRecorder(self.path, max_bytes=200, clock=self.clock)
+        for _ in range(10):
+            recorder.record(REQUEST, Message(f"{PHAL_NAMESPACE}get.device", {"device": "lamp"}))
+        self.assertTrue(recorder.closed)
+        self.assertLess(len(read_recording(self.path)), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+
+from ovos_bus_client import Message
+
+from neon_homeassistant_skill.routines import Routine, RoutineRuns, compile_routines
+
+MOVIE_TIME = [
+    {"action": "brightness", "device": "living room lamp", "value": 20},
+    {"action": "turn_off", "device": "kitchen lights"},
+    {"action": "turn_on", "device": "TV"},
+    {"action": "turn_on", "device": "soundbar", "after": [3]},
+    {"action": "color", "device": "Living Room Lamp", "value": "antique white"},
+]
+
+
+class TestRoutine(unittest.TestCase):
+    def test_graph(self):
+        routine = Routine("Movie Time", MOVIE_TIME)
+        self.assertEqual(routine.roots, (0, 1, 2))
+        # The soundbar waits for the TV, and the lamp's second command for its first
+        self.assertEqual(routine.dependents, [(4,), (), (3,), (), ()])
+        self.assertEqual(routine.dependencies, (0, 0, 0, 1, 1))
+        self.assertEqual(routine.order, (0, 1, 2, 4, 3))
+        self.assertEqual(routine.steps[0].value, 20)
+        self.assertEqual(routine.steps[3].request_type, "device.turn_on")
+
+    def test_invalid_routines(self):
+        for steps in (
+            [],
+            [{"action": "dance", "device": "lamp"}],
+            [{"action": "turn_on"}],
+            [{"action": "brightness", "device": "lamp"}],
+            [{"action": "brightness", "device": "lamp", "value": "bright"}],
+            [{"action": "turn_on", "device": "lamp", "after": [2]}],
+            [{"action": "turn_on", "device": "a", "after": 2}, {"action": "turn_on", "device": "b", "after": 1}],
+        ):
+            with self.assertRaises(ValueError, msg=steps):
+                Routine("broken", steps)
+        compiled = compile_routines({"Movie Time": MOVIE_TIME, "broken": []})
+        self.assertEqual(list(compiled), ["movie time"])
+
+    def test_run(self):
+        runs = RoutineRuns()
+        run = runs.start(Routine("movie time", MOVIE_TIME), Message("test"))
+        self.assertEqual(runs.record(run.run_id, 1, True), (run, [], False))
+        _, ready, done = runs.record(run.run_id, 0, True)
+        self.assertEqual([step.index for step in ready], [4])
+        self.assertFalse(done)
+        # A result that was already recorded changes nothing
+        self.assertEqual(runs.record(run.run_id, 0, False), (run, [], False))
+        # A failed step skips the steps waiting for it
+        _, ready, done = runs.record(run.run_id, 2, False)
+        self.assertEqual((ready, done), ([], False))
+        self.assertEqual(run.failed, ["TV", "soundbar"])
+        self.assertEqual(runs.record(run.run_id, 4, True), (run, [], True))
+        self.assertEqual(run.succeeded, ["kitchen lights", "living room lamp", "Living Room Lamp"])
+        self.assertEqual(len(runs), 0)
+        self.assertEqual(runs.record(run.run_id, 3, True), (None, [], False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+
+from mock import Mock
+from ovos_bus_client import Message
+from ovos_utils.fakebus import FakeBus
+
+from neon_homeassistant_skill.correlation import PHAL_NAMESPACE
+from neon_homeassistant_skill.routing import ResponseRouter
+
+
+class TestResponseRouter(unittest.TestCase):
+    def setUp(self):
+        self.bus = FakeBus()
+        self.brightness = Mock()
+        self.color = Mock()
+        self.router = ResponseRouter(
+            self.bus,
+            {
+                "set.light.brightness.response": self.brightness,
+                "increase.light.brightness.response": self.brightness,
+                "set.light.color.response": self.color,
+            },
+        )
+        self.router.attach()
+
+    def test_messages_dispatched_and_counted(self):
+        self.bus.emit(Message(f"{PHAL_NAMESPACE}set.light.brightness.response", {"brightness": 50}))
+        self.bus.emit(Message(f"{PHAL_NAMESPACE}increase.light.brightness.response"))
+        self.bus.emit(Message(f"{PHAL_NAMESPACE}get.light.color.response"))
+        self.assertEqual(self.brightness.call_count, 2)
+        self.assertEqual(self.brightness.call_args_list[0][0][0].data, {"brightness": 50})
+        self.color.assert_not_called()
+        self.assertEqual(
+            self.router.counts, {"set.light.brightness.response": 1, "increase.light.brightness.response": 1}
+        )
+
+    def test_route_added_after_attach(self):
+        handler = Mock()
+        self.router.add("get.light.color.response", handler)
+        self.assertIn("get.light.color.response", self.router)
+        self.bus.emit(Message(f"{PHAL_NAMESPACE}get.light.color.response"))
+        handler.assert_called_once()
+
+    def test_detach_unsubscribes(self):
+        self.router.detach()
+        self.router.detach()
+        self.bus.emit(Message(f"{PHAL_NAMESPACE}set.light.color.response"))
+        self.color.assert_not_called()
+        self.router.attach()
+        self.router.attach()
+        self.bus.emit(Message(f"{PHAL_NAMESPACE}set.light.color.response"))
+        self.color.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,21 @@
 # pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
 # pylint: disable=invalid-name,protected-access
 import unittest
+from contextlib import ExitStack
+from functools import partial
 from os import getenv
+from os.path import dirname, join
 
-from mock import Mock, call
+from mock import Mock, call, patch
 from ovos_bus_client import Message
 from ovos_utils.messagebus import FakeBus
 from padacioso import IntentContainer
 from yaml import safe_load
 
 from neon_homeassistant_skill import NeonHomeAssistantSkill
+from neon_homeassistant_skill.correlation import REQUEST_ID_KEY
+from test.intent_cache import IntentCache
+from test.utils import temporary_skill_data
 
 BRANCH = "main"
 REPO = "neon-homeassistant-skill"
@@ -17,10 +23,10 @@ AUTHOR = "mikejgray"
 url = f"https://github.com/{AUTHOR}/{REPO}@{BRANCH}"
 
 
-class TestSkillIntentMatching(unittest.TestCase):
-    skill = NeonHomeAssistantSkill()
+INTENT_CACHE = IntentCache(getenv("INTENT_CACHE_DIR", join(dirname(__file__), ".intent_cache")))
 
-    test_intents_filename = getenv("INTENT_TEST_FILE", "test/test_intents.yaml")
+
+def build_intent_container(test_intents_filename):
     with open(test_intents_filename, encoding="utf-8") as f:
         valid_intents = safe_load(f)
     ha_intents = IntentContainer()
@@ -39,15 +45,38 @@ class TestSkillIntentMatching(unittest.TestCase):
                     elif "area" in entity[0].keys():
                         u.append(sentence.replace(entity[0].get("area"), "{area}"))
             ha_intents.add_intent(name, u)
+    return valid_intents, ha_intents
+
+
+class TestSkillIntentMatching(unittest.TestCase):
+    skill = NeonHomeAssistantSkill()
+
+    test_intents_filename = getenv("INTENT_TEST_FILE", "test/test_intents.yaml")
+    # Parsing the samples and compiling the container is only redone after the samples change
+    valid_intents, ha_intents = INTENT_CACHE.get(
+        "test_intents", [test_intents_filename], partial(build_intent_container, test_intents_filename)
+    )
 
     bus = FakeBus()
     test_skill_id = "test_skill.test"
 
     @classmethod
     def setUpClass(cls) -> None:
-        cls.skill.config_core["secondary_langs"] = list(cls.valid_intents.keys())
+        cls._skill_data = ExitStack()
+        cls._skill_data.enter_context(temporary_skill_data())
         cls.skill._startup(cls.bus, cls.test_skill_id)
 
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.skill.shutdown()
+        cls._skill_data.close()
+
+    def setUp(self):
+        # Requests left unanswered by earlier tests time out in the background and mark Home Assistant unreachable
+        self.skill._pending_requests.clear()
+        self.skill._offline_queue.clear()
+        self.skill._set_available(True)
+
     def test_intents(self):
         for lang in self.valid_intents.keys():
             for intent, examples in self.valid_intents[lang].items():
@@ -64,7 +93,7 @@ class TestSkillIntentMatching(unittest.TestCase):
 
     def test_turn_on_silent_entities(self):
         self.skill.speak_dialog = Mock()
-        self.skill.settings["silent_entities"] = ["emergency switch", "freezer switch"]
+        self.skill.silent_entities = ["emergency switch", "freezer switch"]
         self.skill.handle_turn_on_response(Message(msg_type="test", data={"device": "emergency switch"}))
         self.skill.speak_dialog.assert_has_calls([call("no.parsed.device")])
         self.skill.speak_dialog.reset_mock()
@@ -76,7 +105,7 @@ class TestSkillIntentMatching(unittest.TestCase):
 
     def test_turn_off_silent_entities(self):
         self.skill.speak_dialog = Mock()
-        self.skill.settings["silent_entities"] = ["emergency switch", "freezer switch"]
+        self.skill.silent_entities = ["emergency switch", "freezer switch"]
         self.skill.handle_turn_off_response(Message(msg_type="test", data={"device": "emergency switch"}))
         self.skill.speak_dialog.assert_has_calls([call("no.parsed.device")])
         self.skill.speak_dialog.reset_mock()
@@ -88,7 +117,7 @@ class TestSkillIntentMatching(unittest.TestCase):
 
     def test_light_brightness_response_silent_entities(self):
         self.skill.speak_dialog = Mock()
-        self.skill.settings["silent_entities"] = ["ignore bulb"]
+        self.skill.silent_entities = ["ignore bulb"]
         self.skill.handle_set_light_brightness_response(
             Message(msg_type="test", data={"device": "ignore bulb", "brightness": 50})
         )
@@ -103,7 +132,7 @@ class TestSkillIntentMatching(unittest.TestCase):
 
     def test_set_light_color_response_silent_entities(self):
         self.skill.speak_dialog = Mock()
-        self.skill.settings["silent_entities"] = ["ignore bulb"]
+        self.skill.silent_entities = ["ignore bulb"]
         self.skill.handle_set_light_color_response(
             Message(msg_type="test", data={"device": "ignore bulb", "color": "chartreuse"})
         )
@@ -120,3 +149,90 @@ class TestSkillIntentMatching(unittest.TestCase):
         self.skill.speak_dialog = Mock()
         self.skill.handle_rebuild_device_list(Message(msg_type="test"))
         self.skill.speak_dialog.assert_called_once_with("acknowledge")
+
+    def test_device_status_served_from_cache(self):
+        self.skill.speak_dialog = Mock()
+        self.skill._state_cache.clear()
+        self.skill.handle_get_device_response(
+            Message(
+                msg_type="test",
+                data={"name": "Porch Light", "type": "light", "state": "on", "attributes": {"brightness": 128}},
+            )
+        )
+        self.skill.speak_dialog.reset_mock()
+        with patch.object(self.skill.bus, "emit") as emit:
+            self.skill.get_device_intent(Message(msg_type="test", data={"entity": "porch light"}))
+            emit.assert_not_called()
+            self.skill.handle_get_brightness_intent(Message(msg_type="test", data={"entity": "porch light"}))
+            emit.assert_not_called()
+        self.skill.speak_dialog.assert_has_calls(
+            [
+                call("device.status", data={"device": "Porch Light", "type": "light", "state": "on"}),
+                call("lights.current.brightness", data={"brightness": 50, "device": "porch light"}),
+            ]
+        )
+
+    def test_command_invalidates_cached_state(self):
+        self.skill.speak_dialog = Mock()
+        self.skill._state_cache.clear()
+        self.skill._state_cache.update("porch light", name="Porch Light", type="light", state="on")
+        with patch.object(self.skill.bus, "emit") as emit:
+            self.skill.handle_turn_off_intent(Message(msg_type="test", data={"entity": "porch light"}))
+            self.skill.get_device_intent(Message(msg_type="test", data={"entity": "porch light"}))
+            self.assertEqual(
+                [c.args[0].msg_type for c in emit.call_args_list],
+                ["ovos.phal.plugin.homeassistant.device.turn_off", "ovos.phal.plugin.homeassistant.get.device"],
+            )
+
+    def test_response_matched_to_request(self):
+        self.skill.speak_dialog = Mock()
+        with patch.object(self.skill.bus, "emit") as emit:
+            self.skill.handle_turn_on_intent(Message(msg_type="test", data={"entity": "ambiance"}))
+            request = emit.call_args.args[0]
+        self.assertIn(REQUEST_ID_KEY, request.context)
+        self.skill.handle_turn_on_response(request.response(data={"device": "ambiance"}))
+        self.skill.speak_dialog.assert_called_once_with("device.turned.on", data={"device": "ambiance"})
+        self.assertNotIn(request.context[REQUEST_ID_KEY], self.skill._pending_requests)
+
+    def test_unknown_device_status(self):
+        self.skill.speak_dialog = Mock()
+        self.skill._state_cache.clear()
+        with patch.object(self.skill.bus, "emit") as emit:
+            self.skill.get_device_intent(Message(msg_type="test", data={"entity": "ambiance"}))
+            request = emit.call_args.args[0]
+        self.skill.handle_get_device_response(request.response(data={}))
+        self.skill.speak_dialog.assert_called_once_with("device.not.found", data={"device": "ambiance"})
+
+    def test_request_timeout(self):
+        self.skill.speak_dialog = Mock()
+        self.skill._pending_requests.clear()
+        self.skill._offline_queue.clear()
+        requests = []
+        with patch.object(self.skill.bus, "emit", side_effect=requests.append):
+            for device in ("ambiance", "fan", "heater"):
+                self.skill.handle_turn_off_intent(Message(msg_type="test", data={"entity": device}))
+            self.skill._pending_requests.expire(now=float("inf"))
+        # A single unanswered command may just be a slow device, so it isn't sent again later. Once enough
+        # go unanswered in a row, Home Assistant is taken to be unreachable and the command is held for later.
+        self.assertEqual(
+            self.skill.speak_dialog.call_args_list,
+            [
+                call("request.timeout", data={"device": "ambiance"}),
+                call("request.timeout", data={"device": "fan"}),
+                call("commands.queued", data={"devices": "heater"}),
+            ],
+        )
+        self.assertFalse(self.skill._ha_available)
+        self.assertEqual(len(self.skill._offline_queue), 1)
+        self.skill.speak_dialog.reset_mock()
+        # A late response confirms it, so it isn't sent again
+        request = next(message for message in requests if message.data.get("device") == "heater")
+        self.skill.handle_turn_off_response(request.response(data={"device": "heater"}))
+        self.skill.speak_dialog.assert_not_called()
+        self.assertEqual(len(self.skill._offline_queue), 0)
+        self.assertTrue(self.skill._ha_available)
+
+    def test_split_entities(self):
+        self.assertEqual(self.skill._split_entities("lamp, the fan and the TV"), ["lamp", "fan", "TV"])
+        self.assertEqual(self.skill._split_entities("kitchen lamp"), ["kitchen lamp"])
+        self.assertEqual(self.skill._split_entities("lamp, fan, and my heater"), ["lamp", "fan", "heater"])
@@ -0,0 +1,85 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import json
+import unittest
+from os.path import exists, join
+from tempfile import TemporaryDirectory
+
+from neon_homeassistant_skill.entities import EntityIndex
+from neon_homeassistant_skill.snapshot import SNAPSHOT_VERSION, EntitySnapshot
+
+DEVICES = [
+    {"id": "light.kitchen_lamp", "name": "Kitchen Lamp", "type": "light", "state": "on", "attributes": {}},
+    {
+        "id": "binary_sensor.back_door",
+        "name": "Back Door",
+        "type": "binary_sensor",
+        "state": "off",
+        "attributes": {"device_class": "door", "area": "hallway"},
+    },
+]
+
+
+class TestEntitySnapshot(unittest.TestCase):
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = join(self._dir.name, "skill", "entities.jsonl")
+        self.snapshot = EntitySnapshot(self.path)
+
+    def test_index_survives_restart(self):
+        index = EntityIndex()
+        index.rebuild(DEVICES, aliases={"reading lamp": "light.kitchen_lamp"})
+        self.assertTrue(self.snapshot.save(index.export(), index.generation))
+        self.assertEqual(self.snapshot.generation, index.generation)
+
+        restored = EntityIndex()
+        restored.rebuild(EntitySnapshot(self.path).load(), aliases={"reading lamp": "light.kitchen_lamp"})
+        self.assertEqual(restored.export(), index.export())
+        self.assertEqual(restored.get("reading lamp").entity_id, "light.kitchen_lamp")
+        self.assertEqual(restored.get("hallway back door").state, "off")
+        # Kinds from the device class are kept, though the device class itself isn't
+        self.assertEqual([match.name for match in restored.select(kinds=["door"])], ["Back Door"])
+        # A pushed state change with the full attributes doesn't count as a new device
+        restored.upsert({**DEVICES[1], "state": "on"})
+        self.assertEqual(restored.by_id("binary_sensor.back_door").area, "hallway")
+
+    def test_format(self):
+        index = EntityIndex()
+        index.rebuild(DEVICES)
+        self.snapshot.save(index.export())
+        with open(self.path, encoding="utf-8") as file:
+            lines = [json.loads(line) for line in file]
+        self.assertEqual(lines[0]["version"], SNAPSHOT_VERSION)
+        self.assertEqual(lines[0]["entities"], 2)
+        self.assertEqual(lines[1]["id"], "light.kitchen_lamp")
+        self.assertFalse(exists(f"{self.path}.tmp"))
+
+    def test_unreadable_snapshots(self):
+        self.assertEqual(self.snapshot.load(), [])
+        self.snapshot.save([{"id": "light.a", "name": "A"}, {"id": "light.b", "name": "B"}])
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write('{"id": "light.c", "na')
+        # A cut off line only loses that entity
+        self.assertEqual([entity["id"] for entity in self.snapshot.load()], ["light.a", "light.b"])
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"version": SNAPSHOT_VERSION + 1}) + "\n" + json.dumps({"id": "light.a"}) + "\n")
+        self.assertEqual(self.snapshot.load(), [])
+        self.snapshot.clear()
+        self.assertFalse(exists(self.path))
+        self.snapshot.clear()
+
+    def test_generation_counts_changes(self):
+        index = EntityIndex()
+        index.rebuild(DEVICES)
+        generation = index.generation
+        self.assertFalse(index.set_state("light.kitchen_lamp", "on"))
+        self.assertFalse(index.upsert(DEVICES[0]))
+        self.assertEqual(index.generation, generation)
+        index.set_state("light.kitchen_lamp", "off")
+        index.remove("light.kitchen_lamp")
+        self.assertFalse(index.remove("light.kitchen_lamp"))
+        self.assertEqual(index.generation, generation + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# pylint: disable=missing-class-docstring,missing-module-docstring,missing-function-docstring
+import unittest
+
+from neon_homeassistant_skill.throttle import CommandThrottle, TokenBucket
+from test.utils import FakeClock
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refills_at_rate(self):
+        bucket = TokenBucket(rate=2, capacity=2, now=0)
+        for _ in range(2):
+            self.assertEqual(bucket.delay(0), 0)
+            bucket.take()
+        self.assertAlmostEqual(bucket.delay(0), 0.5)
+        self.assertEqual(bucket.delay(0.5), 0)
+        self.assertEqual(bucket.delay(100), 0)
+        self.assertTrue(bucket.full)
+
+
+class TestCommandThrottle(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.sent, self.shed, self.merged = [], [], []
+        self.throttle = CommandThrottle(
+            send=self.sent.append,
+            on_shed=self.shed.append,
+            on_merged=self.merged.append,
+            rate=5,
+            entity_rate=1,
+            max_backlog=3,
+            clock=self.clock,
+        )
+        self.addCleanup(self.throttle.clear)
+
+    def test_per_device_limit(self):
+        for i in range(3):
+            self.throttle.submit("Lamp", f"lamp {i}", "power" if i != 1 else "color")
+        self.throttle.submit("fan", "fan", "power")
+        # Two commands per device at once; the third waits without holding up other devices
+        self.assertEqual(self.sent, ["lamp 0", "lamp 1", "fan"])
+        self.assertEqual(len(self.throttle), 1)
+        self.clock.now += 1
+        self.throttle.drain()
+        self.assertEqual(self.sent[-1], "lamp 2")
+        self.assertEqual(len(self.throttle), 0)
+
+    def test_waiting_duplicates_merged(self):
+        self.throttle.configure(rate=1, entity_rate=0, max_backlog=3)
+        for request in ("query", "on", "off", "on again"):
+            self.throttle.submit("lamp", request, "power" if request != "query" else None)
+        self.assertEqual(self.sent, ["query", "on"])
+        self.assertEqual(self.merged, ["off"])
+        self.clock.now += 1
+        self.throttle.drain()
+        self.assertEqual(self.sent, ["query", "on", "on again"])
+
+    def test_backlog_shed_when_full(self):
+        self.throttle.configure(rate=1, entity_rate=0, max_backlog=2)
+        results = [self.throttle.submit(f"device {i}", i) for i in range(6)]
+        self.assertEqual(results, [True, True, True, True, False, False])
+        self.assertEqual((self.sent, self.shed), ([0, 1], [4, 5]))
+        self.clock.now += 2
+        self.throttle.drain()
+        self.assertEqual(self.sent, [0, 1, 2, 3])
+
+    def test_no_limits(self):
+        self.throttle.configure(rate=0, entity_rate=0, max_backlog=0)
+        for i in range(100):
+            self.throttle.submit("lamp", i, "power")
+        self.assertEqual(len(self.sent), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
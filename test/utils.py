@@ -1,8 +1,31 @@
+from contextlib import contextmanager
+from os import environ
+from tempfile import TemporaryDirectory
+from typing import Iterator
+
+from mock import patch
 from padacioso.bracket_expansion import expand_parentheses
 
 
+class FakeClock:
+    """A monotonic clock for tests, moved forward by setting `now`."""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@contextmanager
+def temporary_skill_data() -> Iterator[str]:
+    """Point the file system of skills created in the block at a temporary directory.
+
+    Their offline queue, entity snapshot and traffic recording are then left out of the real skill data.
+    """
+    with TemporaryDirectory() as path, patch.dict(environ, {"XDG_DATA_HOME": path}):
+        yield path
+
+
 def construct_test_yaml(intent: str, entity: str) -> None:
-    [
-        print(f"    - {x.replace('{entity}', entity)}:\n        - entity: {entity}")
-        for x in expand_parentheses(intent)
-    ]
+    [print(f"    - {x.replace('{entity}', entity)}:\n        - entity: {entity}") for x in expand_parentheses(intent)]